@@ -1,25 +1,194 @@
+import threading
 from .calculator import Calculator
 from .configurator import Configurator
 from .projection import Projection
 from .handler import Handler
 from .map_features import MapFeatures
+from .storage import Storage
+from .instrumentation import Instrumentation
+from .threads import ThreadController
 from .app import IBEXMapper as _IBEXMapperClass
-from .map_features import MapFeatures
 
-_calculator = Calculator()
-_handler = Handler(_calculator)
-_map_features = MapFeatures(_handler)
-_configurator = Configurator(_calculator)
-_projection = Projection(_calculator, _configurator, _handler)
-_mapper = _IBEXMapperClass(_projection, _calculator, _configurator, _handler, _map_features)
+# The mapper is built on first use, not on import. Building it creates app directories and default files,
+# so a plain "import IBEXMapper" has no side effects on disk.
+_mapper = None
+_mapper_lock = threading.Lock()
 
 
-def getObjectInstance() -> _IBEXMapperClass:
+def createMapper(root: str = ".", cache_dir: str or None = None) -> _IBEXMapperClass:
+    # Builds an independent mapper with its own workspace, feature store and in-memory basis.
+    storage = Storage(root, cache_dir)
+    instrumentation = Instrumentation()
+    calculator = Calculator(instrumentation, ThreadController())
+    handler = Handler(calculator, storage, instrumentation)
+    map_features = MapFeatures(handler, storage)
+    configurator = Configurator(calculator, instrumentation)
+    projection = Projection(calculator, configurator, handler, storage, instrumentation)
+    return _IBEXMapperClass(projection, calculator, configurator, handler, map_features, storage, instrumentation)
+
+
+def _getMapper() -> _IBEXMapperClass:
+    global _mapper
+
+    if _mapper is None:
+        with _mapper_lock:
+            if _mapper is None:
+                _mapper = createMapper()
+
     return _mapper
 
 
-def generateSingleMapFromGivenFilePath(link: str, output_path: str or None = None, config=None) -> None:
-    return _mapper.generateSingleMapFromGivenFilePath(link, output_path, config)
+def getObjectInstance() -> _IBEXMapperClass:
+    return _getMapper()
+
+
+def generateSingleMapFromGivenFilePath(link: str, output_path: str or None = None, config=None,
+                                       show: bool = True) -> str:
+    return _getMapper().generateSingleMapFromGivenFilePath(link, output_path, config, show)
+
+
+def computeHeatmap(source, config=None) -> dict:
+    return _getMapper().computeHeatmap(source, config)
+
+
+def computeUncertaintyHeatmap(source, config=None, samples: int = 0, seed: int = 0) -> dict:
+    return _getMapper().computeUncertaintyHeatmap(source, config, samples, seed)
+
+
+def generateUncertaintyMap(link: str, output_path: str or None = None, config=None, product: str = "both",
+                           samples: int = 0, seed: int = 0, show: bool = False) -> list:
+    return _getMapper().generateUncertaintyMap(link, output_path, config, product, samples, seed, show)
+
+
+def renderHeatmap(heatmap: dict, output_path: str or None = None, file_name: str or None = None,
+                  show: bool = True) -> str:
+    return _getMapper().renderHeatmap(heatmap, output_path, file_name, show)
+
+
+def getSpectralWindow(config=None):
+    return _getMapper().getSpectralWindow(config)
+
+
+def filterCoefficients(source, config=None):
+    return _getMapper().filterCoefficients(source, config)
+
+
+def clearStageCache() -> None:
+    return _getMapper().clearStageCache()
+
+
+def createCoefficientsSidecar(link: str) -> str:
+    return _getMapper().handler.writeCoefficientsSidecar(link)
+
+
+def createCoefficientContainer(container_path: str, links: list, metadata: dict or None = None) -> None:
+    return _getMapper().createCoefficientContainer(container_path, links, metadata)
+
+
+def computeHeatmapsFromContainer(container_path: str, bands: list or None = None, intervals: list or None = None,
+                                 config=None) -> list:
+    return _getMapper().computeHeatmapsFromContainer(container_path, bands, intervals, config)
+
+
+def generateMapsFromContainer(container_path: str, output_path: str or None = None, config=None,
+                              bands: list or None = None, intervals: list or None = None, show: bool = False) -> list:
+    return _getMapper().generateMapsFromContainer(container_path, output_path, config, bands, intervals, show)
+
+
+def generateMaps(links: list, output_path: str or None = None, config=None, jobs: int = 1,
+                 basis_sharing: str = "auto") -> list:
+    return _getMapper().generateMaps(links, output_path, config, jobs, basis_sharing)
+
+
+def generateMapsFromDirectory(directory: str, output_path: str or None = None, config=None, jobs: int = 1,
+                              pattern: str = "*.txt", basis_sharing: str = "auto") -> list:
+    return _getMapper().generateMapsFromDirectory(directory, output_path, config, jobs, pattern, basis_sharing)
+
+
+def iterMaps(links, output_path: str or None = None, config=None, render: bool = True, prefetch: int = 2):
+    return _getMapper().iterMaps(links, output_path, config, render, prefetch)
+
+
+def computeHeatmapProgressive(source, config=None, output_path: str or None = None, render: bool = False,
+                              preview_accuracy: int or None = None, preview_max_l: int or None = None):
+    return _getMapper().computeHeatmapProgressive(source, config, output_path, render, preview_accuracy,
+                                                  preview_max_l)
+
+
+def createMapSession(source=None, config=None):
+    return _getMapper().createMapSession(source, config)
+
+
+def createMapExpression(source):
+    return _getMapper().createMapExpression(source)
+
+
+def meanMaps(maps: list, weights: list or None = None):
+    return _getMapper().meanMaps(maps, weights)
+
+
+async def agenerate(link: str, output_path: str or None = None, config=None) -> str:
+    return await _getMapper().agenerate(link, output_path, config)
+
+
+async def acomputeHeatmap(source, config=None) -> dict:
+    return await _getMapper().acomputeHeatmap(source, config)
+
+
+async def arenderHeatmap(heatmap: dict, output_path: str or None = None, file_name: str or None = None) -> str:
+    return await _getMapper().arenderHeatmap(heatmap, output_path, file_name)
+
+
+def configureAsync(max_workers: int or None = None, max_concurrency: int or None = None) -> None:
+    return _getMapper().configureAsync(max_workers, max_concurrency)
+
+
+def enableInstrumentation(report_path: str or None = None, profile_dir: str or None = None) -> None:
+    return _getMapper().enableInstrumentation(report_path, profile_dir)
+
+
+def getInstrumentationReport() -> dict:
+    return _getMapper().getInstrumentationReport()
+
+
+def writeInstrumentationReport(file_path: str or None = None) -> None:
+    return _getMapper().writeInstrumentationReport(file_path)
+
+
+def validateEngines(sources: list, config: dict or None = None, stages: list or None = None,
+                    engines: list or None = None, repeats: int = 3, error_maps_dir: str or None = None) -> dict:
+    return _getMapper().validateEngines(sources, config, stages, engines, repeats, error_maps_dir)
+
+
+def estimateCost(config: dict or None = None, render: bool = True) -> dict:
+    return _getMapper().estimateCost(config, render)
+
+
+def getMetrics() -> dict:
+    return _getMapper().getMetrics()
+
+
+def exportMetrics(file_format: str = "prometheus") -> str:
+    return _getMapper().exportMetrics(file_format)
+
+
+def writeMetrics(file_path: str, file_format: str or None = None) -> None:
+    return _getMapper().writeMetrics(file_path, file_format)
+
+
+def startMetricsExport(file_path: str, interval: float = 15.0, file_format: str or None = None) -> None:
+    return _getMapper().startMetricsExport(file_path, interval, file_format)
+
+
+def stopMetricsExport() -> None:
+    return _getMapper().stopMetricsExport()
+
+
+def createMapServer(host: str = "127.0.0.1", port: int = 8765, unix_socket: str or None = None,
+                    verbose: bool = False):
+    # Imported here, so the HTTP modules are only loaded when a server is actually created.
+    from .server import MapServer
+    return MapServer(_getMapper(), host, port, unix_socket, verbose)
 
 # ----------------------------------------
 #                  CONFIG
@@ -27,19 +196,19 @@ def generateSingleMapFromGivenFilePath(link: str, output_path: str or None = Non
 
 
 def setDefaultConfig(config: dict) -> None:
-    return _mapper.setDefaultConfig(config)
+    return _getMapper().setDefaultConfig(config)
 
 
 def getDefaultConfig() -> dict:
-    return _mapper.getDefaultConfig()
+    return _getMapper().getDefaultConfig()
 
 
 def resetConfigToDefaultConfig() -> None:
-    return _mapper.resetCurrentDefaultConfigBackToAppDefaultConfig()
+    return _getMapper().resetCurrentDefaultConfigBackToAppDefaultConfig()
 
 
 def createNewConfig(config: dict) -> dict:
-    return _mapper.generateValidConfigFromPartialInfo(config)
+    return _getMapper().generateValidConfigFromPartialInfo(config)
 
 # ----------------------------------------
 #                  POINTS
@@ -52,15 +221,15 @@ def addPoint(point_name: str,
              show_text: bool = True,
              point_type: str = "o",
              hollow: bool = False) -> None:
-    return _mapper.map_features.addPoint(point_name, coordinates, color, show_text, point_type, hollow)
+    return _getMapper().map_features.addPoint(point_name, coordinates, color, show_text, point_type, hollow)
 
 
 def removePoint(point_name: str) -> None:
-    return _mapper.map_features.removePoint(point_name)
+    return _getMapper().map_features.removePoint(point_name)
 
 
 def removeAllPoints() -> None:
-    return _mapper.map_features.removeAllPoints()
+    return _getMapper().map_features.removeAllPoints()
 
 # ----------------------------------------
 #                  CIRCLES
@@ -72,19 +241,19 @@ def addCircle(circle_name: str,
               angle: float = 90,
               color: str = 'g',
               linestyle: str = "-") -> None:
-    return _mapper.map_features.addCircle(circle_name,
-                                          coordinates_of_circle_center,
-                                          angle,
-                                          color,
-                                          linestyle)
+    return _getMapper().map_features.addCircle(circle_name,
+                                               coordinates_of_circle_center,
+                                               angle,
+                                               color,
+                                               linestyle)
 
 
 def removeCircle(circle_name: str) -> None:
-    return _mapper.map_features.removeCircle(circle_name)
+    return _getMapper().map_features.removeCircle(circle_name)
 
 
 def removeAllCircles() -> None:
-    return _mapper.map_features.removeAllCircles()
+    return _getMapper().map_features.removeAllCircles()
 
 # ----------------------------------------
 #                  TEXTS
@@ -96,15 +265,15 @@ def addMapText(text_name: str,
                color: str = "g",
                font_size: int = 8,
                tilt_angle: int = 0) -> None:
-    return _mapper.map_features.addMapText(text_name, coords, color, font_size, tilt_angle)
+    return _getMapper().map_features.addMapText(text_name, coords, color, font_size, tilt_angle)
 
 
 def removeMapText(text_name: str) -> None:
-    return _mapper.map_features.removeMapText(text_name)
+    return _getMapper().map_features.removeMapText(text_name)
 
 
 def removeAllMapText() -> None:
-    return _mapper.map_features.removeAllMapText()
+    return _getMapper().map_features.removeAllMapText()
 
 # ----------------------------------------
 #         HEATMAP SCALE AND COLOR
@@ -112,49 +281,49 @@ def removeAllMapText() -> None:
 
 
 def changeHeatmapScale(color: tuple[float, float]) -> None:
-    return _mapper.map_features.changeHeatmapScale(color)
+    return _getMapper().map_features.changeHeatmapScale(color)
 
 
 def resetHeatmapScaleToDefault():
-    return _mapper.map_features.resetHeatmapScaleToDefault()
+    return _getMapper().map_features.resetHeatmapScaleToDefault()
 
 
 def selectHeatmapColorPalette(color: str) -> None:
-    return _mapper.map_features.selectHeatmapColorPalette(color)
+    return _getMapper().map_features.selectHeatmapColorPalette(color)
 
 
 def resetHeatmapColorPalette():
-    return _mapper.map_features.resetHeatmapColorPalette()
+    return _getMapper().map_features.resetHeatmapColorPalette()
 
 
 def getMapFeatures() -> dict:
-    return _mapper.handler.getMapFeatures()
+    return _getMapper().handler.getMapFeatures()
 
 
 def getPointsList() -> list:
-    return _mapper.handler.getPointsList()
+    return _getMapper().handler.getPointsList()
 
 
 def getCirclesList() -> list:
-    return _mapper.handler.getCirclesList()
+    return _getMapper().handler.getCirclesList()
 
 
 def getTextsList() -> list:
-    return _mapper.handler.getTextsList()
+    return _getMapper().handler.getTextsList()
 
 
 def getHeatmapScale() -> tuple[float, float]:
-    return _mapper.handler.getHeatmapScale()
+    return _getMapper().handler.getHeatmapScale()
 
 
 def getHeatmapColor() -> str:
-    return _mapper.handler.getHeatmapColor()
+    return _getMapper().handler.getHeatmapColor()
 
 
 def cleanMap() -> None:
     # Warning: Clears all points, circles, texts and defaults heatmap scale and color.
-    return _mapper.map_features.cleanMap()
+    return _getMapper().map_features.cleanMap()
 
 
 def toggleTypeChecking() -> None:
-    _mapper.toggleTypeChecking()
+    _getMapper().toggleTypeChecking()
@@ -0,0 +1,292 @@
+import numbers
+import os
+import numpy as np
+
+
+class MapExpression:
+    """
+    Class of lazy expressions over coefficient sets, e.g. (A - B), mean([A1, A2, ...]), A * w, A / B, abs(A).
+    Nothing is calculated until computeHeatmap (or render) is called.
+
+    Maps are linear in their coefficients, so sums, differences, scaling, adding constants and weighted means are
+    evaluated in coefficient space: a linear expression of any number of files is synthesized once. Nonlinear
+    operations (ratio and product of two maps, abs) are evaluated on the synthesized grid, so every linear
+    subexpression under them costs one synthesis. The result is rotated and clipped once, like a single map.
+
+    Uncertainties (4th column) of linear expressions are propagated assuming independent inputs:
+    sigma^2 = sum of w^2 sigma_i^2.
+    """
+
+    # Operations of the expression tree. "coefficients" is a leaf (a file or an array).
+    LINEAR_OPERATIONS = ("coefficients", "linear")
+
+    # Numbers (and NumPy scalars) on the left of an operator call the reflected methods of this class.
+    __array_ufunc__ = None
+
+    def __init__(self, mapper, operation: str, operands: list, weights: list or None = None, constant: float = 0.0):
+        """
+        :param mapper:
+        IBEXMapper instance that evaluates the expression.
+
+        :param operation:
+        "coefficients" (operands: [source]), "linear" (sum of weights times operands, plus constant), "ratio",
+        "product" (two operands) or "abs" (one operand).
+        """
+
+        self.mapper = mapper
+        self.operation = operation
+        self.operands = operands
+        self.weights = weights
+        self.constant = constant
+
+    # ----------------------------------------
+    #               OPERATORS
+    # ----------------------------------------
+
+    @classmethod
+    def combine(cls, terms: list, constant: float = 0.0) -> "MapExpression":
+        """
+        Method that builds a linear expression from (weight, expression) terms, flattening nested linear ones,
+        so (A - B) + C is one sum of three maps.
+        """
+
+        weights, operands = [], []
+
+        for weight, expression in terms:
+            if expression.operation == "linear":
+                constant += weight * expression.constant
+                weights.extend(weight * inner_weight for inner_weight in expression.weights)
+                operands.extend(expression.operands)
+            else:
+                weights.append(weight)
+                operands.append(expression)
+
+        return cls(operands[0].mapper, "linear", operands, weights, constant)
+
+    def __add__(self, other):
+        if isinstance(other, MapExpression):
+            return self.combine([(1.0, self), (1.0, other)])
+        if isinstance(other, numbers.Real):
+            return self.combine([(1.0, self)], float(other))
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, MapExpression):
+            return self.combine([(1.0, self), (-1.0, other)])
+        if isinstance(other, numbers.Real):
+            return self.combine([(1.0, self)], -float(other))
+        return NotImplemented
+
+    def __rsub__(self, other):
+        if isinstance(other, numbers.Real):
+            return self.combine([(-1.0, self)], float(other))
+        return NotImplemented
+
+    def __neg__(self):
+        return self.combine([(-1.0, self)])
+
+    def __mul__(self, other):
+        if isinstance(other, MapExpression):
+            return MapExpression(self.mapper, "product", [self, other])
+        if isinstance(other, numbers.Real):
+            return self.combine([(float(other), self)])
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, MapExpression):
+            return MapExpression(self.mapper, "ratio", [self, other])
+        if isinstance(other, numbers.Real):
+            return self.combine([(1.0 / float(other), self)])
+        return NotImplemented
+
+    def __abs__(self):
+        return MapExpression(self.mapper, "abs", [self])
+
+    def isLinear(self) -> bool:
+        # True if the whole expression can be evaluated in coefficient space.
+        return self.operation in self.LINEAR_OPERATIONS and all(
+            operand.isLinear() for operand in self.operands if isinstance(operand, MapExpression))
+
+    # ----------------------------------------
+    #              EVALUATION
+    # ----------------------------------------
+
+    def computeHeatmap(self, config: dict or None = None) -> dict:
+        """
+        Method that evaluates the expression into a map.
+
+        :param config:
+        Config of the map. Defaults to the default config.
+
+        :return:
+        Returns the result dictionary of computeHeatmap, "source" is None.
+        """
+
+        if config is None:
+            config = self.mapper.getDefaultConfig()
+
+        with self.mapper.instrumentation.call("computeExpression"):
+            heatmap_data, synthesis_key, config = self.evaluateGrid(config)
+
+            return self.mapper.completeHeatmap(heatmap_data, synthesis_key, config, None)
+
+    def render(self, output_path: str or None = None, file_name: str or None = None, config: dict or None = None,
+               show: bool = False) -> str:
+        """
+        Method that evaluates the expression and saves it as PDF, see IBEXMapper.renderHeatmap.
+
+        :param file_name:
+        Name of the PDF file. Defaults to "expression".
+
+        :return:
+        Returns the path of the saved PDF file.
+        """
+
+        return self.mapper.renderHeatmap(self.computeHeatmap(config), output_path, file_name or "expression", show)
+
+    def getCoefficients(self, config: dict or None = None) -> np.ndarray:
+        """
+        Method that evaluates a linear expression in coefficient space.
+
+        :param config:
+        Config whose max_l_to_cache sets the degrees. Defaults to the default config.
+
+        :return:
+        Returns (N, 4) (l, m, coefficient, uncertainty) rows of the non-zero coefficients, sorted by (l, m).
+        Raises ValueError for expressions with nonlinear operations.
+        """
+
+        if not self.isLinear():
+            raise ValueError("Only expressions of sums, differences and scaling have coefficients.")
+
+        if config is None:
+            config = self.mapper.getDefaultConfig()
+
+        coefficients, variances = self.evaluateCoefficients(config["max_l_to_cache"])
+
+        return self.buildRows(coefficients, variances)
+
+    def evaluateGrid(self, config: dict) -> tuple[np.ndarray, str, dict]:
+        """
+        Method that evaluates the expression on the synthesized (unrotated) grid.
+
+        :return:
+        Returns (grid, stage cache key of the grid, config prepared for completeHeatmap).
+        """
+
+        if self.isLinear():
+            # One synthesis of the combined coefficients, memoized like a file.
+            coefficients, variances = self.evaluateCoefficients(config["max_l_to_cache"])
+            return self.mapper.synthesizeParsedHeatmap(self.buildRows(coefficients, variances), self.getKey(), config)
+
+        if self.operation == "linear":
+            # Linear terms are summed in coefficient space and synthesized once, the others are added on the grid.
+            linear_terms = [(weight, operand) for weight, operand in zip(self.weights, self.operands)
+                            if operand.isLinear()]
+            grid_terms = [(weight, operand) for weight, operand in zip(self.weights, self.operands)
+                          if not operand.isLinear()]
+
+            grid, _, prepared_config = grid_terms[0][1].evaluateGrid(config)
+            grid = grid_terms[0][0] * grid
+
+            for weight, operand in grid_terms[1:]:
+                grid = grid + weight * operand.evaluateGrid(config)[0]
+
+            if linear_terms:
+                grid = grid + self.combine(linear_terms, self.constant).evaluateGrid(config)[0]
+            elif self.constant:
+                # A constant alone is added on the grid, scaled like the monopole by a spectral filter.
+                window = self.mapper.handler.getSpectralWindow(config)
+                grid = grid + self.constant * (1.0 if window is None else window[0])
+        else:
+            grids = []
+
+            for operand in self.operands:
+                operand_grid, _, prepared_config = operand.evaluateGrid(config)
+                grids.append(operand_grid)
+
+            if self.operation == "ratio":
+                # Pixels with a zero denominator have no value, like pixels outside of a rotated grid.
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    grid = np.where(grids[1] != 0, grids[0] / grids[1], np.nan)
+            elif self.operation == "product":
+                grid = grids[0] * grids[1]
+            else:
+                grid = np.abs(grids[0])
+
+        synthesis_key = self.mapper.stage_cache.hashKey(
+            self.getKey(), config["map_accuracy"], config["max_l_to_cache"], config.get("precision", "float64"),
+            self.mapper.handler.getSpectralWindow(config))
+
+        return grid, synthesis_key, prepared_config
+
+    def evaluateCoefficients(self, max_l: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Method that evaluates a linear expression into dense coefficient and variance vectors (index l^2 + l + m).
+        """
+
+        size = (max_l + 1) ** 2
+
+        if self.operation == "coefficients":
+            imported_data, _ = self.mapper.parseCoefficients(self.operands[0])
+            self.mapper.checkFor_L_Mismatch(imported_data[:, 0].max(), max_l)
+
+            indices = self.mapper.handler.getCoefficientIndices(imported_data)
+            coefficients, variances = np.zeros(size), np.zeros(size)
+            coefficients[indices] = imported_data[:, 2]
+
+            if imported_data.shape[1] > 3:
+                variances[indices] = imported_data[:, 3] ** 2
+
+            return coefficients, variances
+
+        coefficients, variances = np.zeros(size), np.zeros(size)
+
+        for weight, operand in zip(self.weights, self.operands):
+            operand_coefficients, operand_variances = operand.evaluateCoefficients(max_l)
+            coefficients += weight * operand_coefficients
+            variances += weight * weight * operand_variances
+
+        # A constant is the monopole, Y_00 = 1 / sqrt(4 pi).
+        coefficients[0] += self.constant * np.sqrt(4 * np.pi)
+
+        return coefficients, variances
+
+    @staticmethod
+    def buildRows(coefficients: np.ndarray, variances: np.ndarray) -> np.ndarray:
+        # (l, m, coefficient, uncertainty) rows of non-zero entries, at least the monopole so the map is defined.
+        indices = np.flatnonzero((coefficients != 0) | (variances != 0))
+
+        if indices.size == 0:
+            indices = np.zeros(1, dtype=np.int64)
+
+        l_values = np.floor(np.sqrt(indices)).astype(np.int64)
+
+        return np.column_stack((l_values, indices - l_values * l_values - l_values, coefficients[indices],
+                                np.sqrt(variances[indices]))).astype(np.float64)
+
+    def getKey(self) -> str:
+        # Content hash of the expression: coefficient hashes of leaves, operations and weights.
+        if self.operation == "coefficients":
+            return self.mapper.parseCoefficients(self.operands[0])[1]
+
+        return self.mapper.stage_cache.hashKey(self.operation, self.weights, self.constant,
+                                               *[operand.getKey() for operand in self.operands])
+
+    def __repr__(self) -> str:
+        if self.operation == "coefficients":
+            source = self.operands[0]
+            return repr(str(source)) if isinstance(source, (str, os.PathLike)) else "array"
+
+        if self.operation == "linear":
+            terms = [f"{weight:g} * {operand!r}" for weight, operand in zip(self.weights, self.operands)]
+            return "(" + " + ".join(terms + ([f"{self.constant:g}"] if self.constant else [])) + ")"
+
+        if self.operation == "abs":
+            return f"abs({self.operands[0]!r})"
+
+        return f"({self.operands[0]!r} {'/' if self.operation == 'ratio' else '*'} {self.operands[1]!r})"
@@ -1,9 +1,19 @@
-import json
 from .calculator import Calculator
 from .configurator import Configurator
 from .projection import Projection
 from .handler import Handler
 from .map_features import MapFeatures
+from .storage import Storage
+from .batch import BatchRenderer
+from .stage_cache import StageCache
+from .container import CoefficientContainer
+from .stream import StreamRenderer
+from .progressive import ProgressiveRenderer, ProgressiveMap
+from .session import MapSession
+from .algebra import MapExpression
+from .async_runner import AsyncRunner
+from .instrumentation import Instrumentation
+from .planner import ResourcePlanner
 import numpy as np
 from copy import deepcopy
 import os
@@ -12,34 +22,58 @@ import os
 class IBEXMapper:
     """
     Main app class. Handles all top level logic.
+    Every instance works in its own workspace (see Storage), so several independent instances can live
+    in one process and one instance can be used to render several maps at once from a thread pool.
     """
-    CONFIG_DIR = "config"
-    FEATURES_DIR = "map_features"
-    CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
-    FEATURES_FILE = os.path.join(FEATURES_DIR, "map_features.json")
-    OUTPUT_DIR = "output"
+
+    # Number of container slices synthesized with one matrix product.
+    CONTAINER_SLAB_SIZE = 16
 
     def __init__(self, projection: Projection, calculator: Calculator, configurator: Configurator,
-                 handler: Handler, map_features: MapFeatures) -> None:
+                 handler: Handler, map_features: MapFeatures, storage: Storage,
+                 instrumentation: Instrumentation or None = None) -> None:
         self.projection = projection
         self.calculator = calculator
         self.configurator = configurator
         self.handler = handler
         self.map_features = map_features
+        self.storage = storage
+        self.instrumentation = instrumentation if instrumentation is not None else calculator.instrumentation
+        self.metrics = self.instrumentation.metrics
+        self.batch_renderer = BatchRenderer(self)
+        self.stage_cache = StageCache()
+        self.stream_renderer = StreamRenderer(self)
+        self.progressive_renderer = ProgressiveRenderer(self)
+        self.async_runner = AsyncRunner(self)
+        self.planner = ResourcePlanner(self.storage.cache_dir)
+        self.threads = calculator.threads
+
+        # Statistics of the stage cache are exported with the other metrics.
+        self.metrics.declare("ibex_mapper_stage_cache_hits_total", "counter", "Pipeline stage results reused.")
+        self.metrics.declare("ibex_mapper_stage_cache_misses_total", "counter", "Pipeline stage results computed.")
+        self.metrics.declare("ibex_mapper_stage_cache_bytes", "gauge", "Bytes of memoized pipeline stage results.")
+        self.metrics.addCollector(self.collectStageCacheMetrics)
 
         # We need to generate few directories to make sure app works correctly.
-        os.makedirs(self.CONFIG_DIR, exist_ok=True)
-        os.makedirs(self.FEATURES_DIR, exist_ok=True)
-        os.makedirs(self.OUTPUT_DIR, exist_ok=True)
+        self.storage.createWorkspaceDirectories()
 
-        # Generate default JSON files in these dirs.
-        self.generateDefaultConfig()
-        self.generateDefaultMapFeatures()
+        # Generate default files in these dirs, but only if they are missing, so saved state is kept.
+        with self.storage.lock:
+            if not os.path.exists(self.storage.config_file):
+                self.generateDefaultConfig()
+            if not self.storage.mapFeaturesExist():
+                self.generateDefaultMapFeatures()
 
-    def generateSingleMapFromGivenFilePath(self, file_path: str, output_path: str or None, config=None) -> None:
+        # Instrumentation may also be switched on by the default config (besides environment variables).
+        if self.getDefaultConfig().get("instrumentation", False):
+            self.instrumentation.enable()
+
+    def generateSingleMapFromGivenFilePath(self, file_path: str, output_path: str or None, config=None,
+                                           show: bool = True) -> str:
         """
         Main method of the app. From given path to .txt file with coefficients of spherical harmonics,
         it generates a custom mollweide projection based or user given config and map features.
+        It is computeHeatmap followed by renderHeatmap.
 
         :param file_path:
         Full path to the file. Works with absolute and relative paths.
@@ -52,83 +86,978 @@ class IBEXMapper:
         :param config:
         Config dictionary if user wishes to not use default config (use other config but not setting it up as default).
 
+        :param show:
+        Whether to display the map in a window after saving it. Use False when rendering from threads or scripts.
+
+        :return:
+        Returns the path of the saved PDF file.
         """
 
-        # Import the data from .txt file.
-        # Note: It is user responsibility to verify that the file is valid file for this app's method of
-        # generating spherical harmonics. It has to be a (N, 4) array, where first column contains
-        # l of spherical harmonics function, second column contains its m, 3rd column contains the coefficients
-        # and 4th column contains the uncertainties.
-        imported_data = np.loadtxt(file_path, comments='#')
+        with self.instrumentation.call("generateSingleMapFromGivenFilePath"):
+            # Numerical stage: coefficients -> final heatmap array.
+            heatmap = self.computeHeatmap(file_path, config)
 
-        # Get default config if there is no config given.
-        if config is None:
-            config = self.getDefaultConfig()
+            # Drawing stage: heatmap array -> PDF.
+            return self.renderHeatmap(heatmap, output_path, show=show)
+
+    def computeHeatmap(self, source, config: dict or None = None) -> dict:
+        """
+        Method that calculates the final heatmap (synthesized, rotated and with negative values filtered out
+        according to config) without drawing anything. Matplotlib is never imported by this method.
+
+        :param source:
+        Path to the .txt file with coefficients, or an already loaded (N, 3) or (N, 4) array of (l, m, coefficient,
+        uncertainty) rows.
+
+        :param config:
+        Config dictionary. Defaults to the default config.
+
+        :return:
+        Returns a dictionary:
+        - "heatmap": (dpi, dpi) array, rows go from latitude 90 to -90 and columns from longitude 180 to -180
+          (east on the left, same as on the map),
+        - "lon", "lat": longitude of every column and latitude of every row, in radians. For a rotated map these are
+          coordinates in the rotated frame, so (0, 0) is the central point,
+        - "dpi", "max_l": resolution and max l used,
+        - "rotate", "central_point", "meridian_point": rotation settings from config,
+        - "rotation": the 3x3 rotation that was applied (identity if rotate is False), used to place map features,
+        - "source": the file path, or None for an array.
+        Note: Results of every stage are memoized (see StageCache), so arrays in the result are read-only
+        and shared with later calls. Copy them before modifying.
+        """
+
+        with self.instrumentation.call("computeHeatmap"):
+            # Get default config if there is no config given.
+            if config is None:
+                config = self.getDefaultConfig()
+
+            # Every stage below is memoized on a content hash of its inputs, so only stages whose inputs changed
+            # are calculated again.
+            imported_data, coefficients_key = self.parseCoefficients(source)
+
+            return self.computeParsedHeatmap(imported_data, coefficients_key, config,
+                                             str(source) if isinstance(source, (str, os.PathLike)) else None)
+
+    def computeParsedHeatmap(self, imported_data: np.ndarray, coefficients_key: str, config: dict,
+                             source: str or None) -> dict:
+        """
+        Synthesize, rotate and clip stages of computeHeatmap, for coefficients that are already parsed
+        (see parseCoefficients).
 
-        # Make the directories given by the output path if it is given.
-        if output_path is not None:
-            os.makedirs(output_path, exist_ok=True)
+        :return:
+        Returns the result dictionary described in computeHeatmap.
+        """
+
+        heatmap_data, synthesis_key, config = self.synthesizeParsedHeatmap(imported_data, coefficients_key, config)
+
+        return self.completeHeatmap(heatmap_data, synthesis_key, config, source)
+
+    def synthesizeParsedHeatmap(self, imported_data: np.ndarray, coefficients_key: str, config: dict) \
+            -> tuple[np.ndarray, str, dict]:
+        """
+        Synthesize stage of computeHeatmap.
+
+        :return:
+        Returns (synthesized heatmap, its stage cache key, config prepared for completeHeatmap).
+        """
+
+        imported_data, synthesis_key, config = self.prepareSynthesis(imported_data, coefficients_key, config)
+
+        def synthesize():
+            # Pick the basis engine that fits into the memory budget (or refuse) before anything big is allocated.
+            engine, band_size, workers = self.planner.selectEngine(config)
+
+            with self.threads.limit(config.get("threads", 0)):
+                return self.handler.processUserDataset(config["map_accuracy"], config["max_l_to_cache"],
+                                                       imported_data, engine, band_size, workers,
+                                                       config.get("precision", "float64"))
+
+        # Calculate the heatmap data before potential rotations.
+        heatmap_data = self.stage_cache.getOrCompute("synthesize", synthesis_key, synthesize)
+
+        return heatmap_data, synthesis_key, config
+
+    def prepareSynthesis(self, imported_data: np.ndarray, coefficients_key: str, config: dict) \
+            -> tuple[np.ndarray, str, dict]:
+        """
+        Checks and spectral filtering before the synthesize stage, shared by every way of synthesizing a file.
+
+        :return:
+        Returns (filtered coefficients, stage cache key of their synthesis, config prepared for completeHeatmap).
+        """
+
+        # The config is copied, since it is modified below and the caller may share it between threads.
+        config = dict(config)
 
         # Getting both max l's to check for potential mismatch.
         config_max_l = config["max_l_to_cache"]
-        file_max_l = imported_data[-1, 0]
+        # Note: Rows may come in any order, so the max l is taken from the whole first column.
+        file_max_l = imported_data[:, 0].max()
 
         # We need to check if there is l mismatch in file and config.
         self.checkFor_L_Mismatch(file_max_l, config_max_l)
-        
-        # Changing both points to np.arrays to use correct calculations.
-        config["central_point"] = np.array(config["central_point"])
-        config["meridian_point"] = np.array(config["meridian_point"])
 
-        # Calculate the heatmap data before potential rotations.
-        heatmap_data = self.handler.processUserDataset(config["map_accuracy"], config["max_l_to_cache"], imported_data)
+        # Spectral filters scale the coefficients, so the same cached basis synthesizes filtered maps.
+        window = self.handler.getSpectralWindow(config)
 
-        if config["rotate"]:
-            # Initializing the grid that will be rotated.
-            lon = np.linspace(np.pi, -np.pi, config["map_accuracy"])
-            lat = np.linspace(np.pi / 2, -np.pi / 2, config["map_accuracy"])
-            lon, lat = np.meshgrid(lon, lat)
+        if window is not None:
+            imported_data = self.handler.filterCoefficients(imported_data, window)
+            coefficients_key = self.stage_cache.hashKey(coefficients_key, window)
 
-            # Convert the grid to cartesian coordinates.
-            x, y, z = self.calculator.convertSphericalToCartesian(lon, lat)
+        # Changing both points to tuples of floats, so they hash the same no matter how they were given.
+        config["central_point"] = tuple(float(value) for value in config["central_point"])
+        config["meridian_point"] = tuple(float(value) for value in config["meridian_point"])
 
-            # Build central rotation.
-            central_rotation = self.configurator.buildCenteringRotation(config["central_point"])
+        # Note: Engines give the same heatmap, so the engine is not a part of the key. Precisions do not.
+        synthesis_key = self.stage_cache.hashKey(coefficients_key, config["map_accuracy"], config["max_l_to_cache"],
+                                                 config.get("precision", "float64"))
 
-            # If central and meridian points are the same, do only the first rotation.
-            if np.allclose(config["central_point"], config["meridian_point"]) or np.allclose(config["meridian_point"], [0.0, 0.0]):
+        return imported_data, synthesis_key, config
 
-                # Why we transpose will be explained in few next lines.
-                main_rotation = central_rotation.T
-            else:
+    def completeHeatmap(self, heatmap_data: np.ndarray, synthesis_key: str, config: dict, source: str or None) -> dict:
+        """
+        Rotate and clip stages of computeHeatmap, shared by every way of synthesizing the heatmap.
+
+        :param heatmap_data:
+        Synthesized (dpi, dpi) heatmap.
+
+        :param synthesis_key:
+        Stage cache key of the synthesized heatmap.
 
-                # Build the second rotation.
-                meridian_rotation = self.configurator.buildMeridianRotation(config["meridian_point"], central_rotation)
+        :param config:
+        Config with central and meridian points as tuples of floats.
+
+        :param source:
+        Source recorded in the result.
 
-                # Combine rotations and transpose (again, why we transpose will be explained in a second).
-                main_rotation = (meridian_rotation @ central_rotation).T
+        :return:
+        Returns the result dictionary described in computeHeatmap.
+        """
 
-            # Rotate the grid by transposed combined rotation.
-            x_rot, y_rot, z_rot = self.calculator.rotateGridByRotation(x, y, z, main_rotation)
+        # Grid of the map: longitude of every column and latitude of every row.
+        lon_axis = np.linspace(np.pi, -np.pi, config["map_accuracy"])
+        lat_axis = np.linspace(np.pi / 2, -np.pi / 2, config["map_accuracy"])
 
-            # Get the lon and lat coordinates back.
-            lon, lat = self.calculator.convertCartesianToSpherical(x_rot, y_rot, z_rot)
+        # Unrotated maps are drawn without any rotation.
+        rotation_key = synthesis_key
+        final_rotation = np.eye(3)
 
-            # We interpolated the new grid with old data.
-            # Note: We need to transpose the rotation for the interpolator, because of how interpolation works.
-            # Basically interpolator takes the data in new, unofficial coordinate system (where our central point
-            # is true (0, 0)) and calculates reverse rotation to "guess" what value should be in given point
-            # by doing linear interpolation. That is why we need to give it the transposed combined rotations.
-            heatmap_data = self.calculator.interpolateDataForNewGrid(heatmap_data, lat, lon)
+        if config["rotate"]:
+            synthesized_heatmap_data = heatmap_data
+            rotation_key = self.stage_cache.hashKey(synthesis_key, config["central_point"], config["meridian_point"])
+            heatmap_data, final_rotation = self.stage_cache.getOrCompute(
+                "rotate", rotation_key,
+                lambda: self.rotateHeatmapWithThreads(synthesized_heatmap_data, lon_axis, lat_axis, config))
 
         # Filter out all negative values if this option in config is false.
         if not config["show_negative_values"]:
-            heatmap_data[heatmap_data < 0] = 0
+            rotated_heatmap_data = heatmap_data
+            heatmap_data = self.stage_cache.getOrCompute(
+                "clip", self.stage_cache.hashKey(rotation_key, "clip"),
+                lambda: np.where(rotated_heatmap_data < 0, 0, rotated_heatmap_data))
+
+        return {
+            "heatmap": heatmap_data,
+            "lon": lon_axis,
+            "lat": lat_axis,
+            "dpi": config["map_accuracy"],
+            "max_l": config["max_l_to_cache"],
+            "rotate": config["rotate"],
+            "central_point": config["central_point"],
+            "meridian_point": config["meridian_point"],
+            "rotation": final_rotation,
+            "source": source
+        }
+
+    def computeUncertaintyHeatmap(self, source, config: dict or None = None, samples: int = 0,
+                                  seed: int = 0) -> dict:
+        """
+        Method that calculates the heatmap together with its uncertainty map, from the 4th column of coefficients
+        (uncertainties, taken as independent). The analytic standard deviation sqrt(sum of sigma_lm^2 * Y_lm^2)
+        is summed in the same pass over the basis as the heatmap, so it costs about one more synthesis of memory
+        reads instead of a pass of its own. Optionally, it is also estimated by Monte Carlo from maps synthesized
+        from drawn coefficients, many maps per matrix product.
+
+        :param source:
+        Path to the .txt file with coefficients, or an already loaded (N, 4) array.
+
+        :param config:
+        Config dictionary. Defaults to the default config. Uncertainty maps are rotated like the heatmap and never
+        clipped, spectral filters scale the uncertainties like the coefficients.
+
+        :param samples:
+        Number of Monte Carlo maps, 0 for none (otherwise at least 2).
+
+        :param seed:
+        Seed of the Monte Carlo draws, the same seed gives the same map.
+
+        :return:
+        Returns the result dictionary of computeHeatmap with:
+        - "uncertainty": (dpi, dpi) analytic standard deviation of every pixel,
+        - "monte_carlo_uncertainty": (dpi, dpi) Monte Carlo standard deviation, or None if samples is 0,
+        - "samples": number of Monte Carlo maps.
+        """
+
+        if samples < 0 or samples == 1:
+            raise ValueError("Monte Carlo uncertainty needs 0 (none) or at least 2 samples.")
+
+        with self.instrumentation.call("computeUncertaintyHeatmap"):
+            if config is None:
+                config = self.getDefaultConfig()
+
+            imported_data, coefficients_key = self.parseCoefficients(source)
+
+            if imported_data.shape[1] < 4:
+                raise ValueError("Coefficients error: Uncertainty maps need a 4th column with uncertainties.")
+
+            imported_data, synthesis_key, config = self.prepareSynthesis(imported_data, coefficients_key, config)
+            uncertainty_key = self.stage_cache.hashKey(synthesis_key, "uncertainty", samples, seed)
+
+            # The heatmap is memoized under the key of computeHeatmap, so both share it.
+            heatmap_data = self.stage_cache.get("synthesize", synthesis_key)
+            uncertainty_data = self.stage_cache.get("uncertainty", uncertainty_key)
+
+            if heatmap_data is None or uncertainty_data is None:
+                engine, band_size, workers = self.planner.selectEngine(config)
+
+                with self.threads.limit(config.get("threads", 0)):
+                    synthesized_heatmap_data, deviation, monte_carlo_deviation = self.handler.processUncertainties(
+                        config["map_accuracy"], config["max_l_to_cache"], imported_data, engine, band_size, workers,
+                        config.get("precision", "float64"), samples, seed)
+
+                if heatmap_data is None:
+                    heatmap_data = synthesized_heatmap_data
+                    self.stage_cache.put("synthesize", synthesis_key, heatmap_data)
+
+                uncertainty_data = (deviation, monte_carlo_deviation)
+                self.stage_cache.put("uncertainty", uncertainty_key, uncertainty_data)
+
+            source_name = str(source) if isinstance(source, (str, os.PathLike)) else None
+            heatmap = self.completeHeatmap(heatmap_data, synthesis_key, config, source_name)
+
+            # Standard deviations are never negative, so clipping is skipped and only rotation applies.
+            unclipped_config = dict(config, show_negative_values=True)
+            heatmap["uncertainty"] = self.completeHeatmap(
+                uncertainty_data[0], self.stage_cache.hashKey(uncertainty_key, "analytic"), unclipped_config,
+                source_name)["heatmap"]
+            heatmap["monte_carlo_uncertainty"] = None if uncertainty_data[1] is None else self.completeHeatmap(
+                uncertainty_data[1], self.stage_cache.hashKey(uncertainty_key, "monte_carlo"), unclipped_config,
+                source_name)["heatmap"]
+            heatmap["samples"] = samples
+
+            return heatmap
+
+    def generateUncertaintyMap(self, file_path: str, output_path: str or None = None, config: dict or None = None,
+                               product: str = "both", samples: int = 0, seed: int = 0, show: bool = False) -> list:
+        """
+        Method that renders the flux map and/or its uncertainty map from one pass of computeUncertaintyHeatmap.
+
+        :param product:
+        "flux", "uncertainty" or "both".
+
+        :param samples:
+        Number of Monte Carlo maps. If given, the Monte Carlo uncertainty is rendered instead of the analytic one.
+
+        :return:
+        Returns the paths of the saved PDF files, flux first. Uncertainty maps are named "<file>_uncertainty".
+        """
+
+        if product not in ("flux", "uncertainty", "both"):
+            raise ValueError("Product must be 'flux', 'uncertainty' or 'both'.")
+
+        with self.instrumentation.call("generateUncertaintyMap"):
+            heatmap = self.computeUncertaintyHeatmap(file_path, config, samples, seed)
+            output_files = []
+
+            if product in ("flux", "both"):
+                output_files.append(self.renderHeatmap(heatmap, output_path, show=show))
+
+            if product in ("uncertainty", "both"):
+                uncertainty = dict(heatmap, heatmap=heatmap["monte_carlo_uncertainty" if samples else "uncertainty"])
+                file_name = os.path.basename(str(file_path)) + "_uncertainty"
+                output_files.append(self.renderHeatmap(uncertainty, output_path, file_name, show))
+
+            return output_files
+
+    def computeHeatmapsFromContainer(self, container_path: str, bands: list or None = None,
+                                     intervals: list or None = None, config: dict or None = None) -> list:
+        """
+        Method that calculates heatmaps of many slices of a coefficient container (see CoefficientContainer).
+        Coefficients are read straight from the memory mapped file, without any text parsing, and slices are
+        synthesized in slabs with one matrix product each instead of one by one.
+
+        :param container_path:
+        Path to the container file.
+
+        :param bands:
+        Indices of bands. Defaults to all bands.
+
+        :param intervals:
+        Indices of time intervals. Defaults to all intervals.
+
+        :param config:
+        Config dictionary. Defaults to the default config.
+
+        :return:
+        Returns a list of result dictionaries (same as computeHeatmap, plus "band" and "interval"), for every
+        selected band and, within it, every selected interval.
+        """
+
+        if config is None:
+            config = self.getDefaultConfig()
+        else:
+            config = dict(config)
+
+        container = CoefficientContainer(container_path)
+
+        # Container always holds complete coefficient vectors up to its max l.
+        self.checkFor_L_Mismatch(container.max_l, config["max_l_to_cache"])
+
+        config["central_point"] = tuple(float(value) for value in config["central_point"])
+        config["meridian_point"] = tuple(float(value) for value in config["meridian_point"])
+
+        pairs = container.getSlicePairs(bands, intervals)
+
+        # Slices of an unchanged container file are memoized like parsed text files.
+        file_stat = os.stat(container.file_path)
+        container_key = self.stage_cache.hashKey(container.file_path, file_stat.st_mtime_ns, file_stat.st_size)
+
+        # Spectral filters scale every coefficient by the weight of its degree l, see synthesizeParsedHeatmap.
+        window = self.handler.getSpectralWindow(config)
+        slice_weights = None
+
+        if window is not None:
+            indices = np.arange(container.coefficients.shape[-1])
+            slice_weights = window[np.floor(np.sqrt(indices)).astype(np.int64)]
+
+        synthesis_keys = [self.stage_cache.hashKey(container_key, band, interval, config["map_accuracy"],
+                                                   config["max_l_to_cache"], config.get("precision", "float64"),
+                                                   window) for band, interval in pairs]
+        synthesized = [self.stage_cache.get("synthesize", key) for key in synthesis_keys]
+        missing = [index for index, heatmap_data in enumerate(synthesized) if heatmap_data is None]
+
+        if missing:
+            engine, band_size, workers = self.planner.selectEngine(config)
+
+        # Missing slices are synthesized in slabs, so memory stays bounded for containers with many intervals.
+        for start in range(0, len(missing), self.CONTAINER_SLAB_SIZE):
+            slab_indices = missing[start:start + self.CONTAINER_SLAB_SIZE]
+            slab = container.getCoefficientSlab([pairs[index] for index in slab_indices])
+
+            if slice_weights is not None:
+                slab = slab * slice_weights
+
+            # One matrix product per slab, threaded by BLAS.
+            with self.threads.limit(config.get("threads", 0)):
+                heatmaps = self.handler.processCoefficientSlab(config["map_accuracy"], config["max_l_to_cache"],
+                                                               slab, engine, band_size, workers,
+                                                               config.get("precision", "float64"))
+
+            for index, heatmap_data in zip(slab_indices, heatmaps):
+                synthesized[index] = heatmap_data
+                self.stage_cache.put("synthesize", synthesis_keys[index], heatmap_data)
+
+        results = []
+
+        for (band, interval), heatmap_data, synthesis_key in zip(pairs, synthesized, synthesis_keys):
+            result = self.completeHeatmap(heatmap_data, synthesis_key, config, container.file_path)
+            result["band"] = band
+            result["interval"] = interval
+            results.append(result)
+
+        return results
+
+    def generateMapsFromContainer(self, container_path: str, output_path: str or None = None,
+                                  config: dict or None = None, bands: list or None = None,
+                                  intervals: list or None = None, show: bool = False) -> list:
+        """
+        Method that renders selected slices of a coefficient container to PDF files named
+        "file_{container name}_band{b}_interval{i}__res{dpi}.pdf".
+
+        Parameters are the same as in computeHeatmapsFromContainer, plus output_path and show
+        (same as in generateSingleMapFromGivenFilePath, but not shown by default).
+
+        :return:
+        Returns a list of paths of saved PDF files.
+        """
+
+        container_name = os.path.splitext(os.path.basename(container_path))[0]
+        output_files = []
+
+        for heatmap in self.computeHeatmapsFromContainer(container_path, bands, intervals, config):
+            file_name = f"{container_name}_band{heatmap['band']}_interval{heatmap['interval']}"
+            output_files.append(self.renderHeatmap(heatmap, output_path, file_name, show))
+
+        return output_files
+
+    def createCoefficientContainer(self, container_path: str, file_paths: list, metadata: dict or None = None) -> None:
+        """
+        Method that packs text data files into one coefficient container.
+
+        :param container_path:
+        Path of the container file to write.
+
+        :param file_paths:
+        Nested list of data files, file_paths[band][interval]. Every band must have the same number of intervals.
+
+        :param metadata:
+        Optional JSON serializable dictionary stored in the container (band names, interval times...).
+        """
+
+        bands = len(file_paths)
+        intervals = len(file_paths[0]) if bands else 0
+
+        if bands == 0 or intervals == 0 or any(len(band_files) != intervals for band_files in file_paths):
+            raise ValueError("File paths must be a non-empty [band][interval] grid with the same number of intervals "
+                             "in every band.")
+
+        loaded_data = [[self.handler.loadCoefficients(path) for path in band_files] for band_files in file_paths]
+
+        max_l = int(max(data[:, 0].max() for band_data in loaded_data for data in band_data))
+
+        coefficients = np.zeros((bands, intervals, (max_l + 1) ** 2))
+        uncertainties = np.zeros_like(coefficients)
+
+        # Every row goes to its (l, m) place, missing pairs stay zero.
+        for band, band_data in enumerate(loaded_data):
+            for interval, data in enumerate(band_data):
+                indices = self.handler.getCoefficientIndices(data)
+                coefficients[band, interval, indices] = data[:, 2]
+
+                if data.shape[1] > 3:
+                    uncertainties[band, interval, indices] = data[:, 3]
+
+        CoefficientContainer.write(container_path, coefficients, uncertainties, metadata)
+
+    def parseCoefficients(self, source) -> tuple[np.ndarray, str]:
+        """
+        Parse stage of computeHeatmap. Files are memoized on their path, modification time and size, so an unchanged
+        file is parsed only once.
+
+        :param source:
+        Path to the .txt file with coefficients, or an already loaded array.
+
+        :return:
+        Returns (coefficients array, content hash of the coefficients).
+        """
+
+        # Import the data.
+        # Note: It is user responsibility to verify that the file is valid file for this app's method of
+        # generating spherical harmonics. It has to be a (N, 4) array, where first column contains
+        # l of spherical harmonics function, second column contains its m, 3rd column contains the coefficients
+        # and 4th column contains the uncertainties. Rows may be unordered and (l, m) pairs may be missing.
+        if not isinstance(source, (str, os.PathLike)):
+            with self.instrumentation.span("parse"):
+                imported_data = self.handler.loadCoefficients(source)
+                return imported_data, self.stage_cache.hashKey(imported_data)
+
+        file_stat = os.stat(source)
+        parse_key = self.stage_cache.hashKey(os.path.abspath(source), file_stat.st_mtime_ns, file_stat.st_size)
+
+        def parse():
+            with self.instrumentation.span("parse"):
+                parsed_data = self.handler.loadCoefficients(source)
+                return parsed_data, self.stage_cache.hashKey(parsed_data)
+
+        return self.stage_cache.getOrCompute("parse", parse_key, parse)
+
+    def getSpectralWindow(self, config: dict or None = None) -> np.ndarray:
+        """
+        Method that returns the weights of degrees l = 0..max_l_to_cache of the spectral filter of a config
+        ("filter_beam_fwhm", "filter_l_min", "filter_l_max", "filter_l_weights"), all ones if it sets none.
+
+        :param config:
+        Config, missing keys are taken from the default config. Defaults to the default config.
+        """
+
+        config = self.generateValidConfigFromPartialInfo(config or {})
+        window = self.handler.getSpectralWindow(config)
+
+        return np.ones(config["max_l_to_cache"] + 1) if window is None else window
+
+    def filterCoefficients(self, source, config: dict or None = None) -> np.ndarray:
+        """
+        Method that applies the spectral filter of a config to coefficients, as computeHeatmap does before synthesis.
+
+        :param source:
+        Path to the .txt file with coefficients or a coefficient array.
+
+        :param config:
+        Config with the filter, missing keys are taken from the default config. Defaults to the default config.
+
+        :return:
+        Returns the filtered (N, 3) or (N, 4) coefficient rows (uncertainties are scaled like coefficients).
+        """
+
+        imported_data, _ = self.parseCoefficients(source)
+        config = self.generateValidConfigFromPartialInfo(config or {})
+        self.checkFor_L_Mismatch(imported_data[:, 0].max(), config["max_l_to_cache"])
+
+        return self.handler.filterCoefficients(imported_data, self.getSpectralWindow(config))
+
+    def rotateHeatmapWithThreads(self, heatmap_data: np.ndarray, lon_axis: np.ndarray, lat_axis: np.ndarray,
+                                 config: dict) -> tuple[np.ndarray, np.ndarray]:
+        # Rotate stage with the thread count of the config.
+        with self.threads.limit(config.get("threads", 0)):
+            return self.rotateHeatmap(heatmap_data, lon_axis, lat_axis, config["central_point"],
+                                      config["meridian_point"])
+
+    def rotateHeatmap(self, heatmap_data: np.ndarray, lon_axis: np.ndarray, lat_axis: np.ndarray,
+                      central_point: tuple[float, float], meridian_point: tuple[float, float]) \
+            -> tuple[np.ndarray, np.ndarray]:
+        """
+        Rotate stage of computeHeatmap. Resamples the heatmap so the central point is in the center of the map
+        and the meridian point is on the north part of the central meridian.
+
+        :return:
+        Returns (rotated heatmap, applied 3x3 rotation).
+        """
+
+        lat, lon, final_rotation = self.getRotatedGrid(lon_axis, lat_axis, central_point, meridian_point,
+                                                       heatmap_data.dtype)
+
+        # We interpolated the new grid with old data.
+        # Note: We need to transpose the rotation for the interpolator, because of how interpolation works.
+        # Basically interpolator takes the data in new, unofficial coordinate system (where our central point
+        # is true (0, 0)) and calculates reverse rotation to "guess" what value should be in given point
+        # by doing linear interpolation. That is why we need to give it the transposed combined rotations.
+        return self.calculator.interpolateDataForNewGrid(heatmap_data, lat, lon), final_rotation
+
+    def getRotatedGrid(self, lon_axis: np.ndarray, lat_axis: np.ndarray, central_point: tuple[float, float],
+                       meridian_point: tuple[float, float], dtype=np.float64) \
+            -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Method that calculates where every pixel of the rotated map lies on the unrotated one.
+
+        :return:
+        Returns (latitude, longitude, applied 3x3 rotation), both (dpi, dpi) grids in radians.
+        """
+
+        # Initializing the grid that will be rotated, in the given precision (of the heatmap).
+        lon, lat = np.meshgrid(lon_axis.astype(dtype), lat_axis.astype(dtype))
+
+        # Convert the grid to cartesian coordinates.
+        x, y, z = self.calculator.convertSphericalToCartesian(lon, lat)
+
+        # Build the combined rotation (centering rotation, then meridian rotation if needed).
+        final_rotation = self.configurator.buildFinalRotation(central_point, meridian_point)
 
-        # Passes all of this data to second main method, which is projection.
-        return self.projection.projectDataOnMollweideProjection(heatmap_data, config["map_accuracy"], file_path,
-                                                                config["rotate"], config["central_point"],
-                                                                config["meridian_point"], output_path)
+        # Rotate the grid by transposed combined rotation.
+        x_rot, y_rot, z_rot = self.calculator.rotateGridByRotation(x, y, z, final_rotation.T)
+
+        # Get the lon and lat coordinates back.
+        lon, lat = self.calculator.convertCartesianToSpherical(x_rot, y_rot, z_rot)
+
+        return lat, lon, final_rotation
+
+    def renderHeatmap(self, heatmap: dict, output_path: str or None = None, file_name: str or None = None,
+                      show: bool = True) -> str:
+        """
+        Method that draws a heatmap returned by computeHeatmap on a mollweide projection, together with
+        current map features, and saves it as PDF.
+
+        :param heatmap:
+        Dictionary returned by computeHeatmap.
+
+        :param output_path:
+        Output folder, created if missing. Defaults to the output folder.
+
+        :param file_name:
+        Name used for the PDF file. Defaults to the name of the source file, or "heatmap" for array input.
+
+        :param show:
+        Whether to display the map in a window after saving it.
+
+        :return:
+        Returns the path of the saved PDF file.
+        """
+
+        with self.instrumentation.call("renderHeatmap"):
+            # Make the directories given by the output path if it is given.
+            if output_path is not None:
+                os.makedirs(output_path, exist_ok=True)
+
+            output_file_path = self.projection.renderHeatmap(heatmap, output_path, file_name, show)
+
+        self.metrics.increment("ibex_mapper_maps_rendered_total", format="pdf")
+
+        return output_file_path
+
+    def generateMaps(self, file_paths: list, output_path: str or None = None, config: dict or None = None,
+                     jobs: int = 1, basis_sharing: str = "auto") -> list:
+        """
+        Method that generates maps for many files at once, using a pool of worker processes.
+        The basis is loaded once and shared by the workers. Refer to BatchRenderer for details.
+
+        :param file_paths:
+        List of paths to coefficient files.
+
+        :param output_path:
+        Folder for all PDF files. Defaults to the output folder.
+
+        :param config:
+        Config used for all files. Defaults to the default config.
+
+        :param jobs:
+        Number of worker processes. 1 renders in this process, 0 or less uses all CPU cores.
+
+        :param basis_sharing:
+        How workers get the basis: "auto", "fork", "shared_memory" or "mmap". Refer to BatchRenderer for details.
+
+        :return:
+        Returns a list with the result of every file (file, output, success, error, seconds).
+        """
+
+        return self.batch_renderer.generateMaps(file_paths, output_path, config, jobs, basis_sharing)
+
+    def generateMapsFromDirectory(self, directory: str, output_path: str or None = None,
+                                  config: dict or None = None, jobs: int = 1, pattern: str = "*.txt",
+                                  basis_sharing: str = "auto") -> list:
+        """
+        Method that generates maps for every file in a directory matching the pattern. Same as generateMaps otherwise.
+        """
+
+        return self.batch_renderer.generateMapsFromDirectory(directory, output_path, config, jobs, pattern,
+                                                             basis_sharing)
+
+    def renderHeatmapToBytes(self, heatmap: dict, file_format: str = "pdf") -> bytes:
+        """
+        Method that renders a heatmap returned by computeHeatmap into memory instead of a file.
+
+        :param heatmap:
+        Dictionary returned by computeHeatmap.
+
+        :param file_format:
+        "pdf", "png" (or any other format matplotlib can save), or "npy" for the raw heatmap array in NumPy's
+        .npy format (nothing is drawn).
+
+        :return:
+        Returns the contents of the file.
+        """
+
+        with self.instrumentation.call("renderHeatmapToBytes"):
+            if file_format == "npy":
+                import io
+
+                buffer = io.BytesIO()
+                np.save(buffer, heatmap["heatmap"])
+                contents = buffer.getvalue()
+            else:
+                contents = self.projection.renderHeatmapToBytes(heatmap, file_format)
+
+        self.metrics.increment("ibex_mapper_maps_rendered_total", format=file_format)
+
+        return contents
+
+    def clearStageCache(self) -> None:
+        """
+        Method that drops all memoized pipeline stage results (parsed files, synthesized and rotated heatmaps).
+        """
+
+        self.stage_cache.clear()
+
+    def enableInstrumentation(self, report_path: str or None = None, profile_dir: str or None = None) -> None:
+        """
+        Method that switches on timing of pipeline stages (see Instrumentation). It is off by default.
+
+        :param report_path:
+        If given, the JSON run report is written to this file when the process exits.
+
+        :param profile_dir:
+        If given, every top-level call is also profiled with cProfile and dumped into this folder.
+        """
+
+        self.instrumentation.enable(report_path, profile_dir)
+
+    def getInstrumentationReport(self) -> dict:
+        """
+        :return:
+        Returns the run report of measured stages, refer to Instrumentation.getReport.
+        """
+
+        return self.instrumentation.getReport()
+
+    def writeInstrumentationReport(self, file_path: str or None = None) -> None:
+        """
+        Method that writes the run report as JSON, to given file or to the report path given when enabling.
+        """
+
+        self.instrumentation.writeReport(file_path)
+
+    def iterMaps(self, file_paths, output_path: str or None = None, config: dict or None = None,
+                 render: bool = True, prefetch: int = 2):
+        """
+        Generator that streams maps of many files, overlapping file reading, calculation and saving.
+        Refer to StreamRenderer for details.
+
+        :param file_paths:
+        Iterable of paths to coefficient files.
+
+        :param output_path:
+        Folder for PDF files. Defaults to the output folder.
+
+        :param config:
+        Config used for all files. Defaults to the default config.
+
+        :param render:
+        Whether to draw and save maps, or only calculate heatmaps.
+
+        :param prefetch:
+        How many files are read ahead and how many maps may wait for saving.
+
+        :return:
+        Yields {"file", "heatmap", "output", "success", "error", "seconds"} for every file, in the given order.
+        """
+
+        return self.stream_renderer.iterMaps(file_paths, output_path, config, render, prefetch)
+
+    def computeHeatmapProgressive(self, source, config: dict or None = None, output_path: str or None = None,
+                                  render: bool = False, preview_accuracy: int or None = None,
+                                  preview_max_l: int or None = None) -> ProgressiveMap:
+        """
+        Method that computes a low dpi, low max l preview of a map right away, and refines it to the config in the
+        background. Refer to ProgressiveRenderer for details.
+
+        :param source:
+        Path to the .txt file with coefficients, or an already loaded coefficient array.
+
+        :param config:
+        Config of the refined map. Defaults to the default config.
+
+        :param output_path:
+        Folder for PDF files, if rendered. Defaults to the output folder.
+
+        :param render:
+        Whether to save the preview and the refined map as PDF.
+
+        :param preview_accuracy:
+        Dpi of the preview. Defaults to 100.
+
+        :param preview_max_l:
+        Max l of the preview. Defaults to 10.
+
+        :return:
+        Returns a ProgressiveMap handle: "preview" holds the result of the preview, and done(), result(), output()
+        or awaiting it give the refined map.
+        """
+
+        return self.progressive_renderer.computeProgressive(source, config, output_path, render, preview_accuracy,
+                                                            preview_max_l)
+
+    def createMapSession(self, source=None, config: dict or None = None) -> MapSession:
+        """
+        Method that synthesizes a map once and keeps it, together with its coefficients, for incremental edits:
+        changed coefficients only add their difference to the (rotated) map. Refer to MapSession for details.
+
+        :param source:
+        Path to the .txt file with coefficients or a coefficient array to start from. None starts from zeros.
+
+        :param config:
+        Config of the map. Defaults to the default config.
+
+        :return:
+        Returns the MapSession.
+        """
+
+        return MapSession(self, source, config)
+
+    def createMapExpression(self, source) -> MapExpression:
+        """
+        Method that wraps coefficients into a lazy map expression, to be combined with others, e.g.
+        (A - B) / (A + B), A * 0.5 or abs(A). Nothing is parsed or synthesized until the expression is evaluated.
+        Refer to MapExpression for details.
+
+        :param source:
+        Path to the .txt file with coefficients, or a coefficient array.
+
+        :return:
+        Returns the MapExpression.
+        """
+
+        return MapExpression(self, "coefficients", [source])
+
+    def meanMaps(self, maps: list, weights: list or None = None) -> MapExpression:
+        """
+        Method that builds the lazy (weighted) mean of maps. The mean is taken in coefficient space, so it costs
+        one synthesis no matter how many maps are averaged.
+
+        :param maps:
+        List of MapExpressions, paths to .txt files with coefficients or coefficient arrays.
+
+        :param weights:
+        Weight of every map, normalized to sum 1. Defaults to equal weights.
+
+        :return:
+        Returns the MapExpression of the mean.
+        """
+
+        if len(maps) == 0:
+            raise ValueError("Mean of maps needs at least one map.")
+
+        weights = np.ones(len(maps)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+        if weights.shape != (len(maps),) or weights.sum() == 0:
+            raise ValueError("Mean of maps needs one weight per map and a non-zero sum of weights.")
+
+        expressions = [item if isinstance(item, MapExpression) else self.createMapExpression(item) for item in maps]
+
+        return MapExpression.combine([(float(weight), expression) for weight, expression
+                                      in zip(weights / weights.sum(), expressions)])
+
+    async def agenerate(self, file_path: str, output_path: str or None = None, config: dict or None = None) -> str:
+        """
+        Coroutine counterpart of generateSingleMapFromGivenFilePath for asyncio code. Stages run on a managed thread
+        pool, so the event loop is not blocked. The map is saved, never shown. Refer to AsyncRunner for details.
+
+        :return:
+        Returns the path of the saved PDF file.
+        """
+
+        return await self.async_runner.generate(file_path, output_path, config)
+
+    async def acomputeHeatmap(self, source, config: dict or None = None) -> dict:
+        """
+        Coroutine counterpart of computeHeatmap. Refer to AsyncRunner for details.
+        """
+
+        return await self.async_runner.computeHeatmap(source, config)
+
+    async def arenderHeatmap(self, heatmap: dict, output_path: str or None = None,
+                             file_name: str or None = None) -> str:
+        """
+        Coroutine counterpart of renderHeatmap. The map is saved, never shown.
+        """
+
+        return await self.async_runner.renderHeatmap(heatmap, output_path, file_name)
+
+    def configureAsync(self, max_workers: int or None = None, max_concurrency: int or None = None) -> None:
+        """
+        Method that sets up the executor of coroutine methods. The previous executor is shut down after its running
+        stages finish.
+
+        :param max_workers:
+        Threads of the executor. Defaults to the number of CPU cores.
+
+        :param max_concurrency:
+        Maps processed at once, further requests wait. Defaults to max_workers.
+        """
+
+        previous_runner = self.async_runner
+        self.async_runner = AsyncRunner(self, max_workers, max_concurrency)
+        previous_runner.close()
+
+    def validateEngines(self, sources: list, config: dict or None = None, stages: list or None = None,
+                        engines: list or None = None, repeats: int = 3, error_maps_dir: str or None = None) -> dict:
+        """
+        Method that compares every registered engine of pipeline stages with the reference implementation on given
+        coefficients, reporting the error and the speedup of each. Refer to ValidationHarness for details.
+
+        :param sources:
+        Paths to data files or coefficient arrays.
+
+        :param config:
+        Config of the maps. Defaults to the default config.
+
+        :param stages:
+        Stages to validate ("basis", "synthesis", "rotation", "pipeline"). Defaults to all.
+
+        :param engines:
+        Names of engines to validate. Defaults to all.
+
+        :param repeats:
+        Timed runs of every engine.
+
+        :param error_maps_dir:
+        If given, per-pixel absolute errors are saved there as .npy files.
+
+        :return:
+        Returns {"passed", "results": [...]}, see ValidationHarness.validate.
+        """
+
+        # Imported here, validation is a development tool.
+        from .validation import ValidationHarness
+
+        return ValidationHarness(self, repeats, error_maps_dir).validate(sources, config, stages, engines)
+
+    def estimateCost(self, config: dict or None = None, render: bool = True) -> dict:
+        """
+        Method that predicts peak memory, disk cache size and runtime of one map for the config, for every basis
+        engine, without calculating anything. Refer to ResourcePlanner.estimateCost for details.
+
+        :param config:
+        Config dictionary (partial configs are completed with the default config). Defaults to the default config.
+
+        :param render:
+        Whether the peak memory includes rendering the map. False estimates computeHeatmap alone.
+
+        :return:
+        Returns the estimate dictionary, with the engine maps of this config would use in "selected_engine"
+        (None if they would be refused, with the reason in "refusal").
+        """
+
+        full_config = self.getDefaultConfig()
+
+        if config is not None:
+            full_config.update(config)
+
+        return self.planner.estimateCost(full_config, render)
+
+    def getMetrics(self) -> dict:
+        """
+        :return:
+        Returns cumulative metrics of this mapper (basis cache, bytes loaded, maps rendered, stage latency
+        histograms, interpolation NaN counts, peak RSS...), refer to MetricsRegistry.getMetrics.
+        """
+
+        return self.metrics.getMetrics()
+
+    def exportMetrics(self, file_format: str = "prometheus") -> str:
+        """
+        Method that returns cumulative metrics as text.
+
+        :param file_format:
+        "prometheus" for Prometheus text exposition format, or "json".
+        """
+
+        if file_format == "json":
+            import json
+            return json.dumps(self.metrics.getMetrics(), indent=4)
+
+        if file_format != "prometheus":
+            raise ValueError(f"Invalid metrics format '{file_format}'. Must be 'prometheus' or 'json'.")
+
+        return self.metrics.exportPrometheus()
+
+    def writeMetrics(self, file_path: str, file_format: str or None = None) -> None:
+        """
+        Method that writes cumulative metrics to a file (replaced atomically).
+
+        :param file_path:
+        Output file, e.g. a .prom file in node_exporter's textfile collector folder.
+
+        :param file_format:
+        "prometheus" or "json". Defaults to "json" for .json files and "prometheus" otherwise.
+        """
+
+        self.metrics.writeFile(file_path, file_format)
+
+    def startMetricsExport(self, file_path: str, interval: float = 15.0, file_format: str or None = None) -> None:
+        """
+        Method that writes cumulative metrics to a file every interval seconds, on a background thread,
+        until stopMetricsExport is called.
+        """
+
+        self.metrics.startExport(file_path, interval, file_format)
+
+    def stopMetricsExport(self) -> None:
+        self.metrics.stopExport()
+
+    def collectStageCacheMetrics(self) -> None:
+        statistics = self.stage_cache.getStatistics()
+
+        self.metrics.setValue("ibex_mapper_stage_cache_hits_total", statistics["hits"])
+        self.metrics.setValue("ibex_mapper_stage_cache_misses_total", statistics["misses"])
+        self.metrics.setValue("ibex_mapper_stage_cache_bytes", statistics["bytes"])
 
     def generateDefaultConfig(self) -> None:
         """
@@ -137,48 +1066,53 @@ class IBEXMapper:
 
         # App set default config.
         default_config = {
-            "map_accuracy": "400",
-            "max_l_to_cache": "30",
-            "rotate": "False",
-            "central_point": "(0, 0)",  # (lon, lat)
-            "meridian_point": "(0, 0)",
-            "show_negative_values": "True",
-            "map_features_type_checking": "True"
+            "map_accuracy": 400,
+            "max_l_to_cache": 30,
+            "rotate": False,
+            "central_point": (0, 0),  # (lon, lat)
+            "meridian_point": (0, 0),
+            "show_negative_values": True,
+            "map_features_type_checking": True,
+            "map_features_encoding": "json",
+            "instrumentation": False,
+            "basis_engine": "auto",
+            "memory_budget_mb": 0,
+            "basis_workers": 0,
+            "threads": 0,
+            "precision": "float64",
+            "filter_beam_fwhm": 0.0,
+            "filter_l_min": 0,
+            "filter_l_max": 0,
+            "filter_l_weights": []
         }
 
         # Write it to config/config.json.
-        with open(self.CONFIG_FILE, "w") as config:
-            json.dump(default_config, config, indent=4)
+        self.storage.saveConfig(default_config)
 
     def getDefaultConfig(self) -> dict:
         """
         Method that fetches config from a config/config.json file as a python dictionary
-        and returns it with parsed data from strings to python datastructures.
+        with correct python datastructures.
         """
 
-        # Loads the config/config.json file.
-        with open(self.CONFIG_FILE, "r") as config_file:
-            config = json.load(config_file)
-
-        # Uses Handler class method to parse the entire dictionary from {key: str} to {key: correct_datatype}.
-        return self.handler.formatConfigToPythonDatastructures(config)
+        # Storage decodes the typed document (and migrates legacy stringified config on first load).
+        return self.storage.loadConfig()
 
     def setDefaultConfig(self, config: dict) -> None:
         """
-        Method that takes a valid config dictionary, stringifies it and overrides the config / config.json file
+        Method that takes a valid config dictionary and overrides the config / config.json file
         with it, setting it as the new default config.
 
         :param config:
         Dictionary with chosen config.
-        Note: This dictionary is NOT stringified and assumed valid.
+        Note: This dictionary is assumed valid.
         """
 
-        # Stringifies the config dictionary.
-        stringified_config = self.handler.stringifyValue(config)
+        # Puts the new config into config/config.json, stored with native JSON values.
+        self.storage.saveConfig(config)
 
-        # Puts the new stringified config into config/config.json.
-        with open(self.CONFIG_FILE, "w") as c:
-            json.dump(stringified_config, c, indent=4)
+        if config.get("instrumentation", False):
+            self.instrumentation.enable()
 
     def resetCurrentDefaultConfigBackToAppDefaultConfig(self) -> None:
         """
@@ -201,13 +1135,12 @@ class IBEXMapper:
             # We set (0, 0) tuple as default since assert requires it to be a tuple of floats.
             # Projection will then detect whether the heatmap scale tuple is (0, 0), and if it is, projection will not
             # apply the scale (it will use dynamic scale generator based on given heatmap data).
-            "heatmap_scale": "(0, 0)",
+            "heatmap_scale": (0, 0),
             "heatmap_color": "magma"
         }
 
-        # Dumps it into map_features.json
-        with open(self.FEATURES_FILE, "w") as map_features:
-            json.dump(default_map_features, map_features, indent=4)
+        # Dumps it into the map features file.
+        self.storage.saveMapFeatures(default_map_features)
 
     def generateValidConfigFromPartialInfo(self, partial_config: dict) -> dict:
         """
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncRunner:
+    """
+    Class that runs the map pipeline for asyncio code without blocking the event loop.
+
+    Every stage (parse, synthesize, rotate and clip, render) runs on a thread pool owned by this class, and the
+    coroutine awaits it, so the event loop keeps serving other tasks. A semaphore limits how many maps are processed
+    at once, so any number of requests can queue without oversubscribing the cores.
+    Cancelling a task stops it at the next stage boundary: the stage that is already running finishes in its thread,
+    but its result is dropped and no further stage is started.
+    """
+
+    def __init__(self, mapper, max_workers: int or None = None, max_concurrency: int or None = None):
+        """
+        :param mapper:
+        IBEXMapper instance to run.
+
+        :param max_workers:
+        Threads of the executor. Defaults to the number of CPU cores.
+
+        :param max_concurrency:
+        Maps processed at once. Defaults to max_workers.
+        """
+
+        self.mapper = mapper
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers
+
+        # Created on first use and shut down by close().
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+        # asyncio primitives belong to one event loop, so every loop gets its own semaphore, {loop: Semaphore}.
+        self.semaphores = weakref.WeakKeyDictionary()
+
+    def getExecutor(self) -> ThreadPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ibex-mapper")
+
+            return self.executor
+
+    def getSemaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+
+        with self.executor_lock:
+            if loop not in self.semaphores:
+                self.semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+
+            return self.semaphores[loop]
+
+    async def runStage(self, function, *args):
+        # Every await is a point where a cancelled task stops.
+        return await asyncio.get_running_loop().run_in_executor(self.getExecutor(), function, *args)
+
+    async def computeHeatmap(self, source, config: dict or None = None) -> dict:
+        """
+        Coroutine counterpart of IBEXMapper.computeHeatmap.
+        """
+
+        async with self.getSemaphore():
+            return await self.computeStages(source, config)
+
+    async def generate(self, file_path: str, output_path: str or None = None, config: dict or None = None) -> str:
+        """
+        Coroutine counterpart of IBEXMapper.generateSingleMapFromGivenFilePath. The map is never shown.
+
+        :return:
+        Returns the path of the saved PDF file.
+        """
+
+        async with self.getSemaphore():
+            heatmap = await self.computeStages(file_path, config)
+            return await self.runStage(self.mapper.renderHeatmap, heatmap, output_path, None, False)
+
+    async def renderHeatmap(self, heatmap: dict, output_path: str or None = None,
+                            file_name: str or None = None) -> str:
+        """
+        Coroutine counterpart of IBEXMapper.renderHeatmap. The map is never shown.
+        """
+
+        async with self.getSemaphore():
+            return await self.runStage(self.mapper.renderHeatmap, heatmap, output_path, file_name, False)
+
+    async def computeStages(self, source, config: dict or None) -> dict:
+        if config is None:
+            config = await self.runStage(self.mapper.getDefaultConfig)
+
+        imported_data, coefficients_key = await self.runStage(self.mapper.parseCoefficients, source)
+
+        heatmap_data, synthesis_key, config = await self.runStage(
+            self.mapper.synthesizeParsedHeatmap, imported_data, coefficients_key, config)
+
+        source_name = str(source) if isinstance(source, (str, os.PathLike)) else None
+
+        return await self.runStage(self.mapper.completeHeatmap, heatmap_data, synthesis_key, config, source_name)
+
+    def close(self) -> None:
+        """
+        Method that shuts the executor down, after the stages already running finish.
+        A later call starts a new executor.
+        """
+
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
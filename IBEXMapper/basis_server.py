@@ -0,0 +1,139 @@
+import numpy as np
+from multiprocessing import shared_memory
+from .handler import Handler
+from .planner import ResourcePlanner
+
+
+class BasisServer:
+    """
+    Class that publishes a spherical harmonics basis once, so many worker processes can use it without each of them
+    holding its own copy. N workers then cost one basis worth of memory instead of N.
+
+    Two ways of publishing are supported:
+    - "shared_memory": the basis is copied once into a multiprocessing.shared_memory block, from memory if this
+      process already holds it, otherwise from the memory mapped cache file in slices, so the publishing process
+      never holds a private copy next to the shared one,
+    - "mmap": the cached .npy file is memory mapped read-only, so the operating system shares its pages.
+
+    Publishing returns a small, picklable descriptor. Workers turn it into a read-only, zero-copy NumPy view
+    with BasisServer.attach.
+    """
+
+    MODES = ("shared_memory", "mmap")
+
+    # Bytes of the mapped cache file copied into the shared memory block at once.
+    COPY_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, handler: Handler):
+        self.handler = handler
+
+        # Shared memory blocks created by this server, {name: SharedMemory}. Unlinked by close().
+        self.published = {}
+
+    def publish(self, dpi: int, target_max_l: int, mode: str = "shared_memory", precision: str = "float64") -> dict:
+        """
+        Method that publishes the basis for given dpi and L. If it is not cached, it is calculated into the cache
+        file first (by the chunked engine, so it is never held in memory whole).
+
+        :param dpi:
+        Resolution of the map.
+
+        :param target_max_l:
+        Max l of the basis.
+
+        :param mode:
+        "shared_memory" or "mmap".
+
+        :param precision:
+        "float64" or "float32", type of the published basis.
+
+        :return:
+        Returns a descriptor dictionary: {"mode", "name" or "path", "shape", "dtype", "dpi", "max_l"}.
+        """
+
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid basis sharing mode '{mode}'. Must be one of: {list(self.MODES)}")
+
+        descriptor = {"mode": mode, "dpi": dpi, "max_l": target_max_l}
+
+        if mode == "mmap":
+            cache_path = self.handler.getSphericalHarmonicsCachePath(dpi, target_max_l, precision)
+
+            # The disk cache is already a plain .npy file, so it can be mapped directly. It only has to be built
+            # if it does not exist yet.
+            if not cache_path.exists():
+                self.buildCache(dpi, target_max_l, precision)
+
+            basis = np.load(cache_path, mmap_mode="r")
+            descriptor.update({"path": str(cache_path), "shape": tuple(basis.shape), "dtype": basis.dtype.str})
+            return descriptor
+
+        # A basis this process already holds is copied as it is. Otherwise it is not loaded, the cache file is
+        # mapped instead (built band by band straight into the file if missing, see the chunked engine).
+        with self.handler.basis_lock:
+            basis = self.handler.basis_cache.get((dpi, target_max_l, precision))
+
+        if basis is None:
+            cache_path = self.handler.getSphericalHarmonicsCachePath(dpi, target_max_l, precision)
+
+            if not cache_path.exists():
+                self.buildCache(dpi, target_max_l, precision)
+
+            basis = np.load(cache_path, mmap_mode="r")
+
+        descriptor.update({"shape": tuple(basis.shape), "dtype": basis.dtype.str})
+
+        block = shared_memory.SharedMemory(create=True, size=max(basis.nbytes, 1))
+        shared_basis = np.ndarray(basis.shape, dtype=basis.dtype, buffer=block.buf)
+
+        # Copied a few basis functions at a time, pages of the mapped file are only read through the page cache.
+        step = max(1, self.COPY_BYTES // max(basis[0].nbytes, 1)) if basis.shape[0] else 1
+
+        for start in range(0, basis.shape[0], step):
+            shared_basis[start:start + step] = basis[start:start + step]
+
+        self.published[block.name] = block
+        descriptor["name"] = block.name
+
+        return descriptor
+
+    def buildCache(self, dpi: int, target_max_l: int, precision: str) -> None:
+        # Calculates the basis band by band straight into its cache file (chunked engine), the handler only keeps
+        # a memory map of the file.
+        band_size = ResourcePlanner(self.handler.storage.cache_dir).getBandSize(
+            {"map_accuracy": dpi, "max_l_to_cache": target_max_l}, None)
+        self.handler.getSphericalHarmonicsBasis(dpi, target_max_l, "chunked", band_size, precision=precision)
+
+    def close(self) -> None:
+        """
+        Method that releases all shared memory blocks published by this server.
+        Note: Workers must be done with their views before this is called.
+        """
+
+        for block in self.published.values():
+            block.close()
+            block.unlink()
+
+        self.published.clear()
+
+    @staticmethod
+    def attach(descriptor: dict) -> tuple[np.ndarray, any]:
+        """
+        Method that turns a descriptor into a read-only view of the published basis. Nothing is copied.
+
+        :param descriptor:
+        Descriptor returned by publish.
+
+        :return:
+        Returns (basis view, handle). The handle keeps the shared memory block open and must be kept alive
+        as long as the view is used (it is None for "mmap").
+        """
+
+        if descriptor["mode"] == "mmap":
+            return np.load(descriptor["path"], mmap_mode="r"), None
+
+        block = shared_memory.SharedMemory(name=descriptor["name"])
+        basis = np.ndarray(descriptor["shape"], dtype=np.dtype(descriptor["dtype"]), buffer=block.buf)
+        basis.flags.writeable = False
+
+        return basis, block
@@ -0,0 +1,224 @@
+import glob
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .basis_server import BasisServer
+from .threads import ThreadController
+
+# Mapper used by the current worker process. With the "fork" start method it is inherited from the parent
+# together with the basis the parent already loaded into memory, so workers never load it again.
+_worker_mapper = None
+
+
+def _initializeWorker(root: str, cache_dir: str, basis_descriptor: dict or None, threads: int) -> None:
+    global _worker_mapper
+
+    # Workers share the cores, so by default each one gets its part of them (configs with "threads" still win).
+    ThreadController.limitProcess(threads)
+
+    # Spawned workers (or forked ones that got a different workspace) build their own mapper.
+    if _worker_mapper is None or _worker_mapper.storage.root != root:
+        from . import createMapper
+        _worker_mapper = createMapper(root, cache_dir)
+
+    # With a published basis, workers attach a zero-copy view of it instead of holding their own copy.
+    if basis_descriptor is not None:
+        _worker_mapper.handler.attachSharedBasis(basis_descriptor)
+
+
+def _renderInWorker(file_path: str, output_path: str or None, config: dict) -> dict:
+    return BatchRenderer.renderOne(_worker_mapper, file_path, output_path, config)
+
+
+class BatchRenderer:
+    """
+    Class that renders many coefficient files at once, fanning them out to a pool of worker processes.
+    The basis is loaded once in the parent before the pool starts and shared with the workers, either by forking
+    (copy-on-write) or through a BasisServer (shared memory or memory mapped cache file), instead of every worker
+    loading its own copy.
+    """
+
+    BASIS_SHARING_MODES = ("auto", "fork", "shared_memory", "mmap")
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+
+    def generateMaps(self, file_paths: list, output_path: str or None = None, config: dict or None = None,
+                     jobs: int = 1, basis_sharing: str = "auto") -> list:
+        """
+        Method that renders every given file to PDF and reports the result of each one.
+        A failing file does not stop the batch.
+
+        :param file_paths:
+        List of paths to coefficient files.
+
+        :param output_path:
+        Folder for all PDF files. Defaults to the output folder of the mapper's workspace.
+
+        :param config:
+        Config used for all files. Defaults to the default config.
+
+        :param jobs:
+        Number of worker processes. 1 renders in this process, 0 or less uses all CPU cores.
+
+        :param basis_sharing:
+        How workers get the basis: "fork" (inherited from this process), "shared_memory" (one shared memory block),
+        "mmap" (read-only mapping of the cache file) or "auto" (fork where it is safe, see canFork, shared memory
+        otherwise).
+
+        :return:
+        Returns a list of result dictionaries, in the same order as the given files:
+        {"file": str, "output": str or None, "success": bool, "error": str or None, "seconds": float}
+        """
+
+        if basis_sharing not in self.BASIS_SHARING_MODES:
+            raise ValueError(f"Invalid basis sharing '{basis_sharing}'. Must be one of: {list(self.BASIS_SHARING_MODES)}")
+
+        file_paths = [str(path) for path in file_paths]
+
+        if config is None:
+            config = self.mapper.getDefaultConfig()
+
+        if output_path is not None:
+            os.makedirs(output_path, exist_ok=True)
+
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+
+        jobs = min(jobs, max(len(file_paths), 1))
+
+        if basis_sharing == "auto":
+            basis_sharing = "fork" if self.canFork() else "shared_memory"
+
+        if basis_sharing == "fork" and "fork" not in multiprocessing.get_all_start_methods():
+            raise ValueError("Basis sharing 'fork' is not available on this platform.")
+
+        if basis_sharing == "fork" and not self.canFork():
+            raise ValueError("Basis sharing 'fork' is not safe while other threads of this process run, "
+                             "use 'shared_memory' or 'mmap'.")
+
+        if jobs == 1:
+            results = [self.renderOne(self.mapper, path, output_path, config) for path in file_paths]
+        elif basis_sharing == "fork":
+            # Warm the basis once in this process (with the engine maps will use), forked workers inherit it.
+            engine, band_size, basis_workers = self.mapper.planner.selectEngine(config)
+            self.mapper.handler.getSphericalHarmonicsBasis(config["map_accuracy"], config["max_l_to_cache"], engine,
+                                                          band_size, basis_workers, config.get("precision", "float64"))
+            results = self.renderInPool(file_paths, output_path, config, jobs, None)
+        else:
+            basis_server = BasisServer(self.mapper.handler)
+            try:
+                descriptor = basis_server.publish(config["map_accuracy"], config["max_l_to_cache"], basis_sharing,
+                                                  config.get("precision", "float64"))
+
+                # This process switches to the published basis as well, so its private copy can be freed.
+                self.mapper.handler.attachSharedBasis(descriptor)
+
+                results = self.renderInPool(file_paths, output_path, config, jobs, descriptor)
+            finally:
+                self.mapper.handler.releaseBasis()
+                basis_server.close()
+
+        return results
+
+    def generateMapsFromDirectory(self, directory: str, output_path: str or None = None,
+                                  config: dict or None = None, jobs: int = 1, pattern: str = "*.txt",
+                                  basis_sharing: str = "auto") -> list:
+        """
+        Method that renders every coefficient file in a directory.
+
+        :param directory:
+        Directory with coefficient files (not searched recursively).
+
+        :param pattern:
+        Glob pattern of files to render. Default is "*.txt".
+
+        Other parameters and the return value are the same as in generateMaps.
+        """
+
+        if not os.path.isdir(directory):
+            raise ValueError(f"Directory '{directory}' does not exist.")
+
+        file_paths = sorted(glob.glob(os.path.join(directory, pattern)))
+
+        return self.generateMaps(file_paths, output_path, config, jobs, basis_sharing)
+
+    def renderInPool(self, file_paths: list, output_path: str or None, config: dict, jobs: int,
+                     basis_descriptor: dict or None) -> list:
+        global _worker_mapper
+
+        # Fork is preferred, because children start faster and get the already loaded basis (or attach
+        # the published one) without importing everything again. Spawned workers load it (or attach it) themselves.
+        if self.canFork():
+            context = multiprocessing.get_context("fork")
+            _worker_mapper = self.mapper
+
+            # Import the rendering and rotation modules once here as well, so forked workers do not pay
+            # their import cost on the first file.
+            import matplotlib.figure  # noqa: F401
+            import matplotlib.backends.backend_pdf  # noqa: F401
+            import scipy.interpolate  # noqa: F401
+            import scipy.spatial.transform  # noqa: F401
+        else:
+            context = multiprocessing.get_context("spawn")
+
+        storage = self.mapper.storage
+        results = [None] * len(file_paths)
+        worker_threads = ThreadController.getWorkerThreads(jobs)
+
+        # Spawned workers read BLAS thread counts from the environment when they import NumPy.
+        with ThreadController.workerEnvironment(worker_threads), \
+                ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_initializeWorker,
+                                    initargs=(storage.root, storage.cache_dir, basis_descriptor,
+                                              worker_threads)) as executor:
+            futures = {executor.submit(_renderInWorker, path, output_path, config): index
+                       for index, path in enumerate(file_paths)}
+
+            for future, index in futures.items():
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    # Only happens if the worker itself died, errors while rendering are reported by renderOne.
+                    results[index] = {"file": file_paths[index], "output": None, "success": False,
+                                      "error": f"{type(e).__name__}: {e}", "seconds": 0.0}
+
+        return results
+
+    @staticmethod
+    def canFork() -> bool:
+        """
+        :return:
+        Returns True if fork is available and no other thread of this process runs (e.g. an AsyncRunner executor,
+        a progressive refine thread, the metrics exporter or MapServer handlers). Forked children would inherit
+        the locks such threads hold (basis, stage cache, instrumentation) and wait for them forever.
+        Idle threads of the managed block pool (see ThreadController) hold none, since this thread is the only one
+        that could hand blocks to them.
+        """
+
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return False
+
+        current = threading.current_thread()
+
+        return all(thread is current or thread.name.startswith("ibex-block") for thread in threading.enumerate())
+
+    @staticmethod
+    def renderOne(mapper, file_path: str, output_path: str or None, config: dict) -> dict:
+        start = time.perf_counter()
+
+        try:
+            output = mapper.generateSingleMapFromGivenFilePath(file_path, output_path, config, show=False)
+            result = {
+                "file": file_path,
+                "output": output,
+                "success": True,
+                "error": None
+            }
+        except Exception as e:
+            result = {"file": file_path, "output": None, "success": False, "error": f"{type(e).__name__}: {e}"}
+
+        result["seconds"] = time.perf_counter() - start
+
+        return result
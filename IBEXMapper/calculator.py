@@ -1,6 +1,7 @@
-from scipy.special import sph_harm_y_all as spherical_harmonics
-from scipy.interpolate import RegularGridInterpolator
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .instrumentation import Instrumentation
+from .threads import ThreadController
 
 
 class Calculator:
@@ -8,8 +9,12 @@ class Calculator:
     Class that is responsible for all number work on spheres, matrices, complex numbers and more.
     """
 
-    def __init__(self):
-        pass
+    # Bytes of basis functions gathered (copied) at once by one block of a sparse synthesis.
+    GATHER_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, instrumentation: Instrumentation or None = None, threads: ThreadController or None = None):
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.threads = threads if threads is not None else ThreadController()
 
     def calculateMainMatrixFromData(self, data: np.ndarray, spherical_harmonics_values_matrix: np.ndarray, dpi: int) \
             -> np.ndarray:
@@ -34,22 +39,311 @@ class Calculator:
         coordinates.
         """
 
-        print("Calculating heatmap data...")
-
         # Assuming that the 3rd column is always the column with coefficients
-        coefficients = data[:, 2]
+        return self.calculateMainMatrixFromCoefficients(data[:, 2], spherical_harmonics_values_matrix, dpi)
+
+    def calculateMainMatrixFromCoefficients(self, coefficients: np.ndarray,
+                                            spherical_harmonics_values_matrix: np.ndarray, dpi: int,
+                                            indices: np.ndarray or None = None) -> np.ndarray:
+        """
+        Method that calculates main heatmap matrix from a vector of coefficients, where the i-th coefficient
+        belongs to the i-th matrix of :param spherical_harmonics_values_matrix: (or to the matrix of the i-th index).
 
-        # A tensor dot product to multiply the equivalent coefficients with equivalent spherical harmonics
-        # Transposed to switch from (lat, lon) to (lon, lat) system that is used in this app.
-        main_matrix = np.tensordot(coefficients, np.stack(spherical_harmonics_values_matrix), axes=1).T
+        :param coefficients:
+        (K,) vector of coefficients.
 
-        # Necessary matrix realignment to match the mollweide projection
-        final_matrix = np.roll(np.fliplr(main_matrix), shift=dpi // 2, axis=1)
+        :param spherical_harmonics_values_matrix:
+        (K, dpi, dpi) stack of spherical harmonics matching the coefficients.
 
-        print("Heatmap data calculated")
+        :param dpi:
+        Final size of matrix (dpi, dpi).
+
+        :param indices:
+        If given, basis indices of the coefficients in the whole basis. The used basis functions are then
+        gathered a few rows at a time by every block (see getGatherRows), never all at once.
+
+        :return:
+        Returns the realigned main matrix, same as calculateMainMatrixFromData.
+        """
+
+        with self.instrumentation.span("synthesis"):
+            # Note: np.asarray keeps an already stacked (possibly shared or memory mapped) basis as it is, without a copy.
+            spherical_harmonics_values_matrix = np.asarray(spherical_harmonics_values_matrix)
+
+            # Synthesis runs in the precision of the basis (a float32 basis is summed by float32 kernels).
+            coefficients = np.asarray(coefficients, dtype=spherical_harmonics_values_matrix.dtype)
+            main_matrix = np.empty(spherical_harmonics_values_matrix.shape[1:],
+                                   dtype=spherical_harmonics_values_matrix.dtype)
+
+            def synthesizeBlock(block: tuple) -> None:
+                # A tensor dot product to multiply the equivalent coefficients with equivalent spherical harmonics,
+                # for a block of rows of the basis (a view, rows of every basis function are contiguous).
+                start, stop = block
+
+                if indices is None:
+                    main_matrix[start:stop] = np.tensordot(
+                        coefficients, spherical_harmonics_values_matrix[:, start:stop], axes=1)
+                    return
+
+                step = self.getGatherRows(indices.size, spherical_harmonics_values_matrix[0, 0].nbytes)
+
+                for row in range(start, stop, step):
+                    rows = slice(row, min(row + step, stop))
+                    main_matrix[rows] = np.tensordot(
+                        coefficients, spherical_harmonics_values_matrix[indices, rows], axes=1)
+
+            # Blocks of rows are summed on the managed thread pool (see ThreadController).
+            self.threads.map(synthesizeBlock, self.threads.getBlocks(main_matrix.shape[0], main_matrix.shape[1]))
+
+            # Transposed to switch from (lat, lon) to (lon, lat) system that is used in this app.
+            main_matrix = main_matrix.T
+
+            # Necessary matrix realignment to match the mollweide projection
+            final_matrix = np.roll(np.fliplr(main_matrix), shift=dpi // 2, axis=1)
 
         return final_matrix
                             
+    def calculateMainMatrixInBands(self, coefficients: np.ndarray, spherical_harmonics_values_matrix: np.ndarray,
+                                   indices: np.ndarray or slice, dpi: int, band_size: int) -> np.ndarray:
+        """
+        Same as calculateMainMatrixFromCoefficients, but the basis is read one latitude band at a time, so only
+        a band of the selected basis functions is ever copied. Used with a memory mapped basis (chunked engine).
+
+        :param coefficients:
+        (N,) vector of coefficients.
+
+        :param spherical_harmonics_values_matrix:
+        Whole (K, dpi, dpi) basis, usually memory mapped.
+
+        :param indices:
+        Basis indices (or a slice of them) of the coefficients.
+
+        :param dpi:
+        Final size of matrix (dpi, dpi).
+
+        :param band_size:
+        Number of colatitude columns of the basis read at once.
+
+        :return:
+        Returns the realigned main matrix, same as calculateMainMatrixFromData.
+        """
+
+        with self.instrumentation.span("synthesis"):
+            # (lon, colat) matrix, the same as the tensor dot product of the whole basis, in the precision of the basis.
+            coefficients = np.asarray(coefficients, dtype=spherical_harmonics_values_matrix.dtype)
+            main_matrix = np.empty((dpi, dpi), dtype=spherical_harmonics_values_matrix.dtype)
+
+            for start in range(0, dpi, band_size):
+                stop = min(start + band_size, dpi)
+                main_matrix[:, start:stop] = np.tensordot(
+                    coefficients, spherical_harmonics_values_matrix[indices, :, start:stop], axes=1)
+
+            # Necessary matrix realignment to match the mollweide projection
+            final_matrix = np.roll(np.fliplr(main_matrix.T), shift=dpi // 2, axis=1)
+
+        return final_matrix
+
+    def calculateMainMatricesFromCoefficients(self, coefficients: np.ndarray,
+                                              spherical_harmonics_values_matrix: np.ndarray, dpi: int) -> np.ndarray:
+        """
+        Method that calculates many heatmap matrices with one matrix product (M, K) @ (K, dpi * dpi), which is
+        much faster than M separate tensor dot products.
+
+        :param coefficients:
+        (M, K) array, one row of coefficients per map.
+
+        :param spherical_harmonics_values_matrix:
+        (K, dpi, dpi) stack of spherical harmonics matching the coefficients.
+
+        :param dpi:
+        Final size of every matrix (dpi, dpi).
+
+        :return:
+        Returns (M, dpi, dpi) array of realigned matrices, each the same as calculateMainMatrixFromCoefficients.
+        """
+
+        with self.instrumentation.span("synthesis"):
+            # Flattening the basis is a view for a contiguous (also shared or memory mapped) basis.
+            basis = np.asarray(spherical_harmonics_values_matrix)
+            basis = basis.reshape(basis.shape[0], dpi * dpi)
+            coefficients = np.asarray(coefficients, dtype=basis.dtype)
+
+            # One matrix product for all maps, then the same transpose as for a single map, for every map.
+            main_matrices = (coefficients @ basis).reshape(-1, dpi, dpi).transpose(0, 2, 1)
+
+            # Necessary matrix realignment to match the mollweide projection
+            final_matrices = np.roll(main_matrices[:, :, ::-1], shift=dpi // 2, axis=2)
+
+        return final_matrices
+
+    def calculateMainAndVarianceMatrices(self, coefficients: np.ndarray, variances: np.ndarray,
+                                         spherical_harmonics_values_matrix: np.ndarray, indices: np.ndarray or slice,
+                                         dpi: int, band_size: int or None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Method that calculates the main heatmap matrix and its variance matrix, sum of variance_lm * Y_lm^2
+        (uncertainties of coefficients taken as independent), in one pass over the basis: every block of the basis
+        is read once for both sums.
+
+        :param coefficients:
+        (N,) vector of coefficients.
+
+        :param variances:
+        (N,) vector of variances (squared uncertainties) of the coefficients.
+
+        :param spherical_harmonics_values_matrix:
+        Whole (K, dpi, dpi) basis.
+
+        :param indices:
+        Basis indices (or a slice of them) of the coefficients.
+
+        :param dpi:
+        Final size of matrix (dpi, dpi).
+
+        :param band_size:
+        If given, the basis is read one band of colatitude columns at a time (memory mapped basis, chunked engine).
+        Otherwise blocks of rows are summed on the managed thread pool.
+
+        :return:
+        Returns (main matrix, variance matrix), both realigned like calculateMainMatrixFromData.
+        """
+
+        with self.instrumentation.span("synthesis"):
+            basis = spherical_harmonics_values_matrix
+            coefficients = np.asarray(coefficients, dtype=basis.dtype)
+            variances = np.asarray(variances, dtype=basis.dtype)
+            main_matrix = np.empty((dpi, dpi), dtype=basis.dtype)
+            variance_matrix = np.empty((dpi, dpi), dtype=basis.dtype)
+
+            def synthesizeBlock(block: tuple) -> None:
+                # Rows of the block (or columns of the band) of the used basis functions.
+                start, stop = block
+                selection = (indices, slice(start, stop)) if band_size is None else (indices, slice(None),
+                                                                                     slice(start, stop))
+                target = (slice(start, stop),) if band_size is None else (slice(None), slice(start, stop))
+                values = basis[selection]
+
+                main_matrix[target] = np.tensordot(coefficients, values, axes=1)
+                variance_matrix[target] = np.tensordot(variances, values * values, axes=1)
+
+            def synthesizeRows(block: tuple) -> None:
+                # Blocks of rows are split further, so the used basis functions are gathered a few rows at a time.
+                start, stop = block
+                step = self.getGatherRows(coefficients.size, basis[0, 0].nbytes)
+
+                for row in range(start, stop, step):
+                    synthesizeBlock((row, min(row + step, stop)))
+
+            if band_size is None:
+                self.threads.map(synthesizeRows, self.threads.getBlocks(dpi, dpi))
+            else:
+                for start in range(0, dpi, band_size):
+                    synthesizeBlock((start, min(start + band_size, dpi)))
+
+            # Necessary matrix realignment to match the mollweide projection
+            final_matrix = np.roll(np.fliplr(main_matrix.T), shift=dpi // 2, axis=1)
+            final_variance_matrix = np.roll(np.fliplr(variance_matrix.T), shift=dpi // 2, axis=1)
+
+        return final_matrix, final_variance_matrix
+
+    def getGatherRows(self, basis_functions: int, row_bytes: int) -> int:
+        # Rows of basis_functions basis functions (row_bytes each) that fit into GATHER_BYTES, at least one.
+        return max(1, self.GATHER_BYTES // max(basis_functions * row_bytes, 1))
+
+    def calculateMonteCarloDeviationMatrix(self, coefficients: np.ndarray, uncertainties: np.ndarray,
+                                           spherical_harmonics_values_matrix: np.ndarray, dpi: int, samples: int,
+                                           seed: int = 0, batch_size: int = 16) -> np.ndarray:
+        """
+        Method that estimates the standard deviation of every pixel by Monte Carlo: maps are synthesized from
+        coefficients drawn from normal distributions N(coefficient, uncertainty^2), batch_size maps per matrix
+        product (see calculateMainMatricesFromCoefficients).
+
+        :param coefficients:
+        (K,) vector of coefficients, the i-th belongs to the i-th basis function.
+
+        :param uncertainties:
+        (K,) vector of uncertainties (standard deviations) of the coefficients.
+
+        :param spherical_harmonics_values_matrix:
+        (K, dpi, dpi) stack of spherical harmonics matching the coefficients.
+
+        :param samples:
+        Number of drawn maps, at least 2.
+
+        :param seed:
+        Seed of the random generator, the same seed gives the same map.
+
+        :return:
+        Returns the realigned (dpi, dpi) matrix of sample standard deviations.
+        """
+
+        generator = np.random.default_rng(seed)
+
+        # Running mean and sum of squared deviations, merged batch by batch (Chan et al.), in float64.
+        mean = np.zeros((dpi, dpi))
+        squared_deviations = np.zeros((dpi, dpi))
+        count = 0
+
+        for start in range(0, samples, batch_size):
+            size = min(batch_size, samples - start)
+            draws = coefficients + uncertainties * generator.standard_normal((size, coefficients.size))
+            maps = self.calculateMainMatricesFromCoefficients(draws, spherical_harmonics_values_matrix, dpi)
+
+            batch_mean = maps.mean(axis=0, dtype=np.float64)
+            batch_squared_deviations = ((maps - batch_mean) ** 2).sum(axis=0)
+
+            delta = batch_mean - mean
+            total = count + size
+            mean += delta * (size / total)
+            squared_deviations += batch_squared_deviations + delta * delta * (count * size / total)
+            count = total
+
+        return np.sqrt(squared_deviations / (samples - 1)).astype(spherical_harmonics_values_matrix.dtype)
+
+    def calculateSpectralWindow(self, max_l: int, beam_fwhm: float = 0.0, l_min: int = 0, l_max: int = 0,
+                                l_weights: list or None = None) -> np.ndarray:
+        """
+        Method that calculates the weight of every degree l of a spectral filter. Filtering multiplies every
+        coefficient by the weight of its l, which is the same as convolving the map with an axially symmetric
+        kernel, at the cost of one multiplication per coefficient.
+
+        :param max_l:
+        Highest degree to calculate a weight for.
+
+        :param beam_fwhm:
+        Full width at half maximum of a Gaussian beam in degrees, weights exp(-l (l + 1) sigma^2 / 2) where
+        sigma = FWHM / sqrt(8 ln 2). 0 means no smoothing.
+
+        :param l_min:
+        Degrees below l_min get weight 0 (band-pass, e.g. 1 removes the monopole).
+
+        :param l_max:
+        Degrees above l_max get weight 0 (hard l-cut). 0 means no cut.
+
+        :param l_weights:
+        Custom weights of degrees 0, 1, 2..., degrees beyond the list keep weight 1.
+
+        :return:
+        Returns the (max_l + 1,) weights, the product of all given filters.
+        """
+
+        l_values = np.arange(max_l + 1)
+        window = np.ones(max_l + 1)
+
+        if beam_fwhm > 0:
+            sigma = np.deg2rad(beam_fwhm) / np.sqrt(8 * np.log(2))
+            window *= np.exp(-0.5 * l_values * (l_values + 1) * sigma ** 2)
+
+        window[l_values < l_min] = 0
+
+        if l_max > 0:
+            window[l_values > l_max] = 0
+
+        if l_weights:
+            weights = np.asarray(l_weights[:max_l + 1], dtype=np.float64)
+            window[:weights.size] *= weights
+
+        return window
+
     def calculateSphericalHarmonicsDataForSetDPI(self, dpi: int, target_max_l: int) -> list:
         """
         Method that calculates all spherical harmonics up to a given L border.
@@ -68,6 +362,9 @@ class Calculator:
         Each element is (dpi, dpi) size matrix of all spherical harmonics, used later as to form the discrete heatmap.
         """
 
+        # SciPy is imported here, on first use, so importing the package stays fast.
+        from scipy.special import sph_harm_y_all as spherical_harmonics
+
         # Forms the discrete range of values for heatmap generation after.
         # The larger dpi is, the larger raster size will the final projection of the heatmap have.
         colatitude, longitude = np.meshgrid(np.linspace(0, np.pi, dpi), np.linspace(0, 2 * np.pi, dpi))
@@ -75,43 +372,125 @@ class Calculator:
         # Initializing the final list of spherical harmonics.
         spherical_harmonics_array_on_real_plane = []
 
-        print(f"Calculating spherical harmonics for L: {target_max_l}...")
-
         # Calculating all spherical harmonics up to given l and m sizes.
         # Note: This function also calculates invalid spherical harmonics (like l = 2 and m = 8), but it replaces them
         # with zero after.
-        unfiltered_array = spherical_harmonics(target_max_l, target_max_l, colatitude, longitude)
+        with self.instrumentation.span("basis.harmonics"):
+            unfiltered_array = spherical_harmonics(target_max_l, target_max_l, colatitude, longitude)
 
-        print("Calculated spherical harmonics")
+        # We need to filter out the invalid spherical harmonics, double for loop does the job.
+        with self.instrumentation.span("basis.filter"):
+            for l in range(target_max_l + 1):
+                for m in range(-l, l + 1):
+
+                    # Here we transform the spherical harmonics from complex plane to real plane using helper method.
+                    spherical_harmonics_array_on_real_plane.append(
+                        self.filterComplexNumbersFromSphericalHarmonics(
+                            m,
+                            unfiltered_array[l][m],
+                            unfiltered_array[l][-m])
+                        .real)
 
-        print("Filtering spherical harmonics...")
+        # Return the list.
+        return spherical_harmonics_array_on_real_plane
 
-        # Helping variables with showing a percentage of calculations done. Agreed the step is 5%.
-        total_iterations = sum(2 * l + 1 for l in range(target_max_l + 1))
-        completed_iterations = 0
-        progress_checkpoint = 0
+    def calculateSphericalHarmonicsBand(self, dpi: int, target_max_l: int, start: int, stop: int,
+                                        output: np.ndarray or None = None) -> np.ndarray:
+        """
+        Method that calculates colatitude columns [start, stop) of the basis of
+        calculateSphericalHarmonicsDataForSetDPI. Every value is calculated by the same formulas as there, so bands
+        put together give exactly the same basis, while the complex intermediate results only exist for one band.
 
-        # We need to filter out the invalid spherical harmonics, double for loop does the job.
-        for l in range(target_max_l + 1):
-            for m in range(-l, l + 1):
+        :param dpi:
+        Resolution of the map.
+
+        :param target_max_l:
+        Max l of the basis.
+
+        :param start:
+        First colatitude column of the band.
+
+        :param stop:
+        Column after the last column of the band.
+
+        :param output:
+        Optional (K, dpi, stop - start) array (e.g. a band of a memory mapped basis) to write the band into.
+
+        :return:
+        Returns the (K, dpi, stop - start) band.
+        """
+
+        from scipy.special import sph_harm_y_all as spherical_harmonics
+
+        # Same grid as the whole basis, restricted to the columns of the band.
+        colatitude, longitude = np.meshgrid(np.linspace(0, np.pi, dpi)[start:stop], np.linspace(0, 2 * np.pi, dpi))
+
+        if output is None:
+            output = np.empty(((target_max_l + 1) ** 2, dpi, stop - start))
 
-                # Here we transform the spherical harmonics from complex plane to real plane using helper method.
-                spherical_harmonics_array_on_real_plane.append(
-                    self.filterComplexNumbersFromSphericalHarmonics(
+        with self.instrumentation.span("basis.harmonics"):
+            unfiltered_array = spherical_harmonics(target_max_l, target_max_l, colatitude, longitude)
+
+        with self.instrumentation.span("basis.filter"):
+            index = 0
+            for l in range(target_max_l + 1):
+                for m in range(-l, l + 1):
+                    output[index] = self.filterComplexNumbersFromSphericalHarmonics(
                         m,
                         unfiltered_array[l][m],
-                        unfiltered_array[l][-m])
-                    .real)
+                        unfiltered_array[l][-m]).real
+                    index += 1
 
-                # Updating progress of filtering
-                completed_iterations += 1
-                current_progress = int((completed_iterations / total_iterations) * 100)
-                if current_progress >= progress_checkpoint + 5:
-                    progress_checkpoint = current_progress - (current_progress % 5)
-                    print(f"Filtering progress: {progress_checkpoint}%")
+        return output
 
-        # Return the list.
-        return spherical_harmonics_array_on_real_plane
+    def calculateSphericalHarmonicsInBands(self, dpi: int, target_max_l: int, band_size: int, workers: int = 1,
+                                           output: np.ndarray or None = None, dtype=np.float64) -> np.ndarray:
+        """
+        Method that calculates the basis of calculateSphericalHarmonicsDataForSetDPI band by band (see
+        calculateSphericalHarmonicsBand), on a pool of threads. Every band is written into its own columns of one
+        preallocated output, so results are the same as the serial path for any number of workers.
+        Note: SciPy and NumPy release the GIL while they calculate, so threads run on separate cores.
+
+        :param dpi:
+        Resolution of the map.
+
+        :param target_max_l:
+        Max l of the basis.
+
+        :param band_size:
+        Colatitude columns per band. Every worker holds the complex intermediate results of one band.
+
+        :param workers:
+        Number of threads. 1 calculates bands one after another in the calling thread.
+
+        :param output:
+        Optional (K, dpi, dpi) array (e.g. a memory mapped cache file) to write the basis into.
+
+        :param dtype:
+        Type of the basis if there is no output. Values are calculated in float64 (complex128) and rounded to it.
+
+        :return:
+        Returns the (K, dpi, dpi) basis.
+        """
+
+        if output is None:
+            output = np.empty(((target_max_l + 1) ** 2, dpi, dpi), dtype=dtype)
+
+        bands = [(start, min(start + band_size, dpi)) for start in range(0, dpi, band_size)]
+
+        def calculateBand(band: tuple) -> None:
+            start, stop = band
+            self.calculateSphericalHarmonicsBand(dpi, target_max_l, start, stop, output[:, :, start:stop])
+
+        if workers <= 1 or len(bands) == 1:
+            for band in bands:
+                calculateBand(band)
+        else:
+            # Bands are independent, and each one writes into its own columns.
+            with ThreadPoolExecutor(min(workers, len(bands)), thread_name_prefix="ibex-basis") as executor:
+                list(executor.map(calculateBand, bands))
+
+        return output
 
     def filterComplexNumbersFromSphericalHarmonics(self,
                                                    m: float,
@@ -152,7 +531,8 @@ class Calculator:
 
     def convertCartesianToSpherical(self, x: np.ndarray or float, y: np.ndarray or float, z: np.ndarray or float)\
             -> tuple[np.ndarray, np.ndarray] or tuple[float, float]:
-        lat = np.arcsin(z)
+        # Rounding of rotated float32 grids can put z just outside of [-1, 1].
+        lat = np.arcsin(np.clip(z, -1, 1))
         lon = np.arctan2(y, x)
 
         # To prevent out-of-bounds bug for points.
@@ -185,27 +565,25 @@ class Calculator:
         Returns all meshes rotated with the given rotation matrix.
         """
 
-        print("Rotating grid...")
-
         # Check shape before rotating to reshape the meshes back into meshes after rotation.
         original_shape = x_mesh.shape
 
-        # We stack the meshes into (shape, shape) matrix of 3D vectors.
-        cartesian_coordinates_matrix = np.stack((x_mesh, y_mesh, z_mesh), axis=-1).reshape(-1, 3)
+        with self.instrumentation.span("rotation.grid"):
+            # We stack the meshes into (shape, shape) matrix of 3D vectors.
+            cartesian_coordinates_matrix = np.stack((x_mesh, y_mesh, z_mesh), axis=-1).reshape(-1, 3)
 
-        # Apply the rotation
-        # Note, we apply the rotation here with transposing because numpy allows vectorized
-        # matrix multiplications only when the rotation matrix is on the "left side" of the equation.
-        # So we need to transpose it.
-        rotated_cartesian_coordinates_matrix = cartesian_coordinates_matrix @ rotation.T
+            # Apply the rotation
+            # Note, we apply the rotation here with transposing because numpy allows vectorized
+            # matrix multiplications only when the rotation matrix is on the "left side" of the equation.
+            # So we need to transpose it. It is cast to the type of the grid, so a float32 grid stays float32.
+            rotated_cartesian_coordinates_matrix = \
+                cartesian_coordinates_matrix @ rotation.T.astype(cartesian_coordinates_matrix.dtype, copy=False)
 
         # Split the array back into 3 (shape, shape) meshes.
         rot_x_mesh = rotated_cartesian_coordinates_matrix[:, 0].reshape(original_shape)
         rot_y_mesh = rotated_cartesian_coordinates_matrix[:, 1].reshape(original_shape)
         rot_z_mesh = rotated_cartesian_coordinates_matrix[:, 2].reshape(original_shape)
 
-        print("Grid rotated")
-
         return rot_x_mesh, rot_y_mesh, rot_z_mesh
 
     def interpolateDataForNewGrid(self,
@@ -232,14 +610,14 @@ class Calculator:
         a new coordinate system.
         """
 
-        print("Interpolating new heatmap data after rotation...")
+        from scipy.interpolate import RegularGridInterpolator
 
         # Get the N size.
         dpi = data_to_interpolate.shape[0]
 
-        # We generate the lat and lon meshes of original matrix data.
-        lat = np.linspace(np.pi / 2, -np.pi / 2, dpi)
-        lon = np.linspace(np.pi, -np.pi, dpi)
+        # We generate the lat and lon meshes of original matrix data, in the precision of the data.
+        lat = np.linspace(np.pi / 2, -np.pi / 2, dpi, dtype=data_to_interpolate.dtype)
+        lon = np.linspace(np.pi, -np.pi, dpi, dtype=data_to_interpolate.dtype)
 
         # Initialize the interpolator with data and initial lat and lon.
         interpolator = RegularGridInterpolator((lat, lon), data_to_interpolate,
@@ -250,12 +628,76 @@ class Calculator:
 
         # Use the interpolator to interpolate our new grid system with the old grid system and its corresponding data to get
         # our new data.
-        interpolated_data = interpolator(rotated_vectors).reshape(rotated_lat.shape)
+        with self.instrumentation.span("interpolation"):
+            interpolated_data = np.empty(rotated_vectors.shape[0], dtype=data_to_interpolate.dtype)
+
+            def interpolateBlock(block: tuple) -> None:
+                start, stop = block
+                interpolated_data[start:stop] = interpolator(rotated_vectors[start:stop])
+
+            # Pixels are independent, so blocks of them are interpolated on the managed thread pool.
+            self.threads.map(interpolateBlock, self.threads.getBlocks(rotated_vectors.shape[0]))
+
+            interpolated_data = interpolated_data.reshape(rotated_lat.shape)
 
-        print("Heatmap data interpolated")
+        # Pixels whose rotated position falls outside of the original grid are left without a value.
+        self.instrumentation.metrics.increment("ibex_mapper_interpolated_pixels_total", interpolated_data.size)
+        self.instrumentation.metrics.increment("ibex_mapper_interpolation_nan_total",
+                                               int(np.count_nonzero(np.isnan(interpolated_data))))
 
         return interpolated_data
 
+    def calculateInterpolationMatrix(self, dpi: int, rotated_lat: np.ndarray, rotated_lon: np.ndarray) \
+            -> tuple:
+        """
+        Method that expresses interpolateDataForNewGrid as a sparse matrix, so the same rotation can be applied to
+        many maps (e.g. to every update of a MapSession) with one sparse product each, instead of a new interpolator.
+        Every row holds the bilinear weights of the 4 pixels around one rotated pixel.
+
+        :param dpi:
+        Size of the original (dpi, dpi) grid.
+
+        :param rotated_lat:
+        Latitude part of the new grid, as (N, N) size matrix of latitude coordinates.
+
+        :param rotated_lon:
+        Longitude part of the new grid, as (N, N) size matrix of longitude coordinates.
+
+        :return:
+        Returns (sparse (N * N, dpi * dpi) matrix, (N, N) mask of pixels outside of the original grid). Outside pixels
+        have no weights, interpolateDataForNewGrid leaves them as NaN.
+        """
+
+        from scipy.sparse import csr_matrix
+
+        # Same grid as interpolateDataForNewGrid, both axes descend.
+        lat = np.linspace(np.pi / 2, -np.pi / 2, dpi, dtype=rotated_lat.dtype)
+        lon = np.linspace(np.pi, -np.pi, dpi, dtype=rotated_lon.dtype)
+
+        shape = rotated_lat.shape
+        rotated_lat = rotated_lat.ravel()
+        rotated_lon = rotated_lon.ravel()
+
+        outside = (rotated_lat > lat[0]) | (rotated_lat < lat[-1]) | (rotated_lon > lon[0]) | (rotated_lon < lon[-1])
+
+        # Cell of every rotated pixel (top left corner) and its position inside the cell, from 0 to 1.
+        lat_index = np.clip(np.searchsorted(-lat, -rotated_lat, side="right") - 1, 0, dpi - 2)
+        lon_index = np.clip(np.searchsorted(-lon, -rotated_lon, side="right") - 1, 0, dpi - 2)
+        lat_weight = (lat[lat_index] - rotated_lat) / (lat[lat_index] - lat[lat_index + 1])
+        lon_weight = (lon[lon_index] - rotated_lon) / (lon[lon_index] - lon[lon_index + 1])
+
+        corner = lat_index * dpi + lon_index
+        columns = np.stack((corner, corner + 1, corner + dpi, corner + dpi + 1), axis=-1)
+        weights = np.stack(((1 - lat_weight) * (1 - lon_weight), (1 - lat_weight) * lon_weight,
+                            lat_weight * (1 - lon_weight), lat_weight * lon_weight), axis=-1)
+        weights[outside] = 0
+
+        pixels = rotated_lat.size
+        matrix = csr_matrix((weights.ravel(), columns.ravel(), np.arange(0, 4 * pixels + 1, 4)),
+                            shape=(pixels, dpi * dpi))
+
+        return matrix, outside.reshape(shape)
+
     def createCircle(self, circle_center_vector: np.ndarray, alpha: float) -> tuple[np.ndarray, np.ndarray]:
         """
         Method that generates discrete values for drawing circles on the mollweide projection.
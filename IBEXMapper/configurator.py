@@ -1,6 +1,6 @@
 import numpy as np
-from scipy.spatial.transform import Rotation as R
 from .calculator import Calculator
+from .instrumentation import Instrumentation
 
 
 class Configurator:
@@ -8,8 +8,9 @@ class Configurator:
     This class is responsible for building both rotations and handling elliptical coordinates
     edge cases (in calculations).
     """
-    def __init__(self, calculator: Calculator):
+    def __init__(self, calculator: Calculator, instrumentation: Instrumentation or None = None):
         self.calculator = calculator
+        self.instrumentation = instrumentation if instrumentation is not None else calculator.instrumentation
         
     def buildCenteringRotation(self, new_central_vector: np.ndarray) -> np.ndarray:
         """
@@ -24,7 +25,8 @@ class Configurator:
         Returns matrix calculated from a given vector and angle formula for 3d rotations (rotation around a given
         vector for a given angle). Numerically, it's a 3D numpy array.
         """
-        print("Building centering rotation...")
+        # SciPy is imported on first use, so importing the package stays fast.
+        from scipy.spatial.transform import Rotation as R
 
         # Cartesian equivalent of elliptical (0, 0) vectors (we assume that the sphere has a radius of 1)
         current_vec = np.array([[1., 0., 0.]])
@@ -41,8 +43,6 @@ class Configurator:
         # Angle is calculated internally from given vectors.
         rotation, _ = R.align_vectors(current_vec, target_vec)
 
-        print("Centering rotation built")
-
         return rotation.as_matrix()
 
     def buildMeridianRotation(self, meridian_vector: np.ndarray, central_rotation: np.ndarray) -> np.ndarray:
@@ -64,7 +64,7 @@ class Configurator:
         Returns the second rotation (meridian rotation) as a matrix. Numerically a 3D numpy array.
         """
 
-        print("Building meridian rotation...")
+        from scipy.spatial.transform import Rotation as R
 
         # Edge case correction, brute force way.
         meridian_vector = self.correctEllipticalVectorsEdgesCases(meridian_vector)
@@ -87,10 +87,38 @@ class Configurator:
         # around X axis and angle beta.
         meridian_rotation = R.from_euler("x", beta).as_matrix()
 
-        print("Meridian rotation built")
-
         return meridian_rotation
 
+    def buildFinalRotation(self, central_vector: np.ndarray, meridian_vector: np.ndarray) -> np.ndarray:
+        """
+        Method that builds the rotation that moves the central vector to the center of the map and the meridian vector
+        onto the north part of the central meridian (centering rotation first, then meridian rotation).
+
+        :param central_vector:
+        User given central point (lon, lat) in degrees.
+
+        :param meridian_vector:
+        User given meridian point (lon, lat) in degrees.
+
+        :return:
+        Returns the combined rotation as a 3x3 matrix.
+        """
+
+        # Vectors are copied, since edge case correction modifies them in place.
+        central_vector = np.array(central_vector, dtype=float)
+        meridian_vector = np.array(meridian_vector, dtype=float)
+
+        with self.instrumentation.span("rotation.build"):
+            central_rotation = self.buildCenteringRotation(central_vector)
+
+            # If central and meridian points are the same (or meridian is not set), only the first rotation is done.
+            if np.allclose(central_vector, meridian_vector) or np.allclose(meridian_vector, [0.0, 0.0]):
+                return central_rotation
+
+            meridian_rotation = self.buildMeridianRotation(meridian_vector, central_rotation)
+
+            return meridian_rotation @ central_rotation
+
     def correctEllipticalVectorsEdgesCases(self, vector_to_check: np.ndarray) -> np.ndarray:
 
         # Brute forcing the edge cases to agreed 8-digit cutoff range.
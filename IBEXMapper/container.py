@@ -0,0 +1,204 @@
+import json
+import os
+import struct
+import threading
+import numpy as np
+
+
+class CoefficientContainer:
+    """
+    Class that reads (and writes) a binary container of spherical harmonics coefficients for many energy bands and
+    time intervals, so a whole data set lives in one file instead of one text file per band and interval.
+
+    Layout of the file:
+    - 16 byte preamble: magic b"IBXC", one byte of format version, 3 padding bytes, header length (uint64, little endian),
+    - JSON header: max l, number of bands and intervals, dtype, offsets of the arrays and free-form metadata,
+    - coefficients as a C-ordered (bands, intervals, K) array, K = (max_l + 1)^2, in basis order (index l^2 + l + m),
+    - optionally uncertainties with the same shape.
+    Arrays start at offsets aligned to 64 bytes and are memory mapped read-only, so opening a container reads
+    only the header and a slice reads only the pages it needs.
+    """
+
+    MAGIC = b"IBXC"
+    VERSION = 1
+    ALIGNMENT = 64
+    PREAMBLE = struct.Struct("<4sB3xQ")
+
+    def __init__(self, file_path: str):
+        """
+        :param file_path:
+        Path to the container file.
+        """
+
+        self.file_path = os.path.abspath(file_path)
+        self.header = self.readHeader(self.file_path)
+
+        self.max_l = self.header["max_l"]
+        self.bands = self.header["bands"]
+        self.intervals = self.header["intervals"]
+        self.metadata = self.header.get("metadata", {})
+
+        shape = (self.bands, self.intervals, (self.max_l + 1) ** 2)
+        dtype = np.dtype(self.header["dtype"])
+
+        self.coefficients = np.memmap(self.file_path, dtype=dtype, mode="r",
+                                      offset=self.header["coefficients_offset"], shape=shape)
+
+        self.uncertainties = None
+        if self.header.get("uncertainties_offset") is not None:
+            self.uncertainties = np.memmap(self.file_path, dtype=dtype, mode="r",
+                                           offset=self.header["uncertainties_offset"], shape=shape)
+
+    @classmethod
+    def readHeader(cls, file_path: str) -> dict:
+        with open(file_path, "rb") as file:
+            preamble = file.read(cls.PREAMBLE.size)
+
+            if len(preamble) < cls.PREAMBLE.size:
+                raise ValueError(f"'{file_path}' is not a coefficient container.")
+
+            magic, version, header_length = cls.PREAMBLE.unpack(preamble)
+
+            if magic != cls.MAGIC:
+                raise ValueError(f"'{file_path}' is not a coefficient container.")
+
+            if version > cls.VERSION:
+                raise ValueError(f"Coefficient container version {version} is newer than supported version "
+                                 f"{cls.VERSION}. Please update the app.")
+
+            return json.loads(file.read(header_length).decode("utf-8"))
+
+    @classmethod
+    def write(cls, file_path: str, coefficients: np.ndarray, uncertainties: np.ndarray or None = None,
+              metadata: dict or None = None) -> None:
+        """
+        Method that writes a container.
+
+        :param file_path:
+        Path of the container file.
+
+        :param coefficients:
+        (bands, intervals, K) array of coefficients in basis order, K = (max_l + 1)^2.
+
+        :param uncertainties:
+        Optional array of uncertainties with the same shape.
+
+        :param metadata:
+        Optional JSON serializable dictionary (band names, interval times...), stored in the header as it is.
+        """
+
+        coefficients = np.ascontiguousarray(coefficients, dtype="<f8")
+
+        if coefficients.ndim != 3:
+            raise ValueError(f"Coefficients must be a (bands, intervals, K) array, got shape {coefficients.shape}.")
+
+        max_l = int(round(np.sqrt(coefficients.shape[2]))) - 1
+
+        if (max_l + 1) ** 2 != coefficients.shape[2]:
+            raise ValueError(f"K = {coefficients.shape[2]} is not (max_l + 1)^2 for any max l.")
+
+        if uncertainties is not None:
+            uncertainties = np.ascontiguousarray(uncertainties, dtype="<f8")
+            if uncertainties.shape != coefficients.shape:
+                raise ValueError("Uncertainties must have the same shape as coefficients.")
+
+        header = {
+            "max_l": max_l,
+            "bands": coefficients.shape[0],
+            "intervals": coefficients.shape[1],
+            "dtype": "<f8",
+            "coefficients_offset": 0,
+            "uncertainties_offset": None,
+            "metadata": metadata or {}
+        }
+
+        # Offsets depend on the header length and the header holds the offsets, so the header is encoded
+        # with offsets padded to a fixed width first, then filled in.
+        header["coefficients_offset"] = header["uncertainties_offset"] = 10 ** 15
+        header_length = len(json.dumps(header).encode("utf-8"))
+
+        coefficients_offset = cls.alignOffset(cls.PREAMBLE.size + header_length)
+        header["coefficients_offset"] = coefficients_offset
+        header["uncertainties_offset"] = None
+
+        if uncertainties is not None:
+            header["uncertainties_offset"] = cls.alignOffset(coefficients_offset + coefficients.nbytes)
+
+        encoded_header = json.dumps(header).encode("utf-8")
+
+        # Written to a temporary file first, so a reader never sees a half written container.
+        temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        with open(temporary_path, "wb") as file:
+            file.write(cls.PREAMBLE.pack(cls.MAGIC, cls.VERSION, len(encoded_header)))
+            file.write(encoded_header)
+
+            file.write(b"\0" * (coefficients_offset - file.tell()))
+            coefficients.tofile(file)
+
+            if uncertainties is not None:
+                file.write(b"\0" * (header["uncertainties_offset"] - file.tell()))
+                uncertainties.tofile(file)
+
+        os.replace(temporary_path, file_path)
+
+    @classmethod
+    def alignOffset(cls, offset: int) -> int:
+        return -(-offset // cls.ALIGNMENT) * cls.ALIGNMENT
+
+    def getSlicePairs(self, bands: list or None = None, intervals: list or None = None) -> list:
+        """
+        Method that lists (band, interval) pairs of the selected slices, bands first.
+
+        :param bands:
+        Band indices. Defaults to all bands.
+
+        :param intervals:
+        Interval indices. Defaults to all intervals.
+
+        :return:
+        Returns a list of (band, interval) tuples.
+        """
+
+        bands = range(self.bands) if bands is None else bands
+        intervals = range(self.intervals) if intervals is None else intervals
+
+        pairs = [(int(band), int(interval)) for band in bands for interval in intervals]
+
+        for band, interval in pairs:
+            if not (0 <= band < self.bands and 0 <= interval < self.intervals):
+                raise ValueError(f"Slice (band {band}, interval {interval}) is outside of the container "
+                                 f"({self.bands} bands, {self.intervals} intervals).")
+
+        return pairs
+
+    def getCoefficientSlab(self, pairs: list) -> np.ndarray:
+        """
+        Method that reads coefficients of many slices at once.
+
+        :param pairs:
+        List of (band, interval) tuples.
+
+        :return:
+        Returns a (len(pairs), K) array.
+        """
+
+        bands, intervals = zip(*pairs)
+
+        return np.asarray(self.coefficients[list(bands), list(intervals)])
+
+    def getSlice(self, band: int, interval: int) -> np.ndarray:
+        """
+        Method that returns one slice in the same (K, 4) layout as a text data file:
+        (l, m, coefficient, uncertainty) rows. Uncertainties are zero if the container has none.
+        """
+
+        self.getSlicePairs([band], [interval])
+
+        k = np.arange((self.max_l + 1) ** 2)
+        l_values = np.floor(np.sqrt(k)).astype(np.int64)
+        m_values = k - l_values * l_values - l_values
+
+        uncertainties = np.zeros(k.size) if self.uncertainties is None else self.uncertainties[band, interval]
+
+        return np.column_stack([l_values, m_values, self.coefficients[band, interval], uncertainties]).astype(float)
@@ -1,9 +1,10 @@
-import ast
-import json
 from pathlib import Path
 import numpy as np
-from .calculator import Calculator
 import os
+import threading
+from .calculator import Calculator
+from .storage import Storage
+from .instrumentation import Instrumentation
 
 
 class Handler:
@@ -11,277 +12,548 @@ class Handler:
     This class is responsible for using logic from calculator to build the final heatmap matrix
     and for sanitizing user given data.
     """
-    
-    # Initializing the map_features folder using os package to ensure OS compatibility.
-    CONFIG_DIR = "config"
-    CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
-    FEATURES_DIR = "map_features"
-    FEATURES_FILE = os.path.join(FEATURES_DIR, "map_features.json")
-
-    def __init__(self, calculator: Calculator):
+
+    # Bases up to this size (e.g. of progressive previews) stay in memory next to the last used large one.
+    SMALL_BASIS_BYTES = 32 * 1024 * 1024
+    MAX_SMALL_BASES = 4
+
+    def __init__(self, calculator: Calculator, storage: Storage, instrumentation: Instrumentation or None = None):
         self.calculator = calculator
+        self.storage = storage
+        self.instrumentation = instrumentation if instrumentation is not None else calculator.instrumentation
+        self.metrics = self.instrumentation.metrics
+
+        # In-memory bases of this instance, {(dpi, L, precision): basis}.
+        self.basis_cache = {}
+        self.basis_lock = threading.Lock()
+        self.basis_handle = None
 
-    def processUserDataset(self, dpi: int, target_max_l: int, data: np.ndarray) -> np.ndarray:
+    def loadCoefficients(self, source) -> np.ndarray:
         """
-        Main function that generates data for heatmap before configuration is applied.
+        Method that loads spherical harmonics coefficients.
+        Text files are read with NumPy's C text reader. If an up-to-date binary sidecar of the file exists
+        (see writeCoefficientsSidecar), it is loaded instead and no text is parsed at all.
 
-        :param dpi:
-        Resolution of the map. Ranges from 0 to infinity, but generally speaking, the intended accuracy is around 720.
+        :param source:
+        Path to the .txt (or .npy / .npz) file, or an already loaded array of (l, m, coefficient[, uncertainty]) rows.
+        Rows may come in any order and may skip (l, m) pairs, missing pairs are treated as zero.
 
-        :param target_max_l:
-        Caching parameter (related to spherical harmonics). Ranges from 0 to infinity. Determines how deep will
-        calculator calculate the spherical harmonics for. The intended value is one that the user sets as default in the config.
+        :return:
+        Returns the (N, 3) or (N, 4) array of coefficients.
+        """
 
-        :param data:
-        Matrix of (N, 4) size. Generally used for accessing the 3rd column where the coefficients are located and for
-        cutting the cached spherical harmonics data to match the row length for vectorized matrix multiplication in
-        calculator.
+        if isinstance(source, (str, os.PathLike)):
+            source = str(source)
+            sidecar_path = self.getCoefficientsSidecarPath(source)
 
-        :returns:
-        Returns (dpi, dpi) size matrix of data for heatmap.
-        """
+            if source.endswith((".npy", ".npz")):
+                data = self.loadBinaryCoefficients(source)
+            elif os.path.exists(sidecar_path) and os.path.getmtime(sidecar_path) >= os.path.getmtime(source):
+                data = self.loadBinaryCoefficients(sidecar_path)
+            else:
+                data = np.loadtxt(source, comments='#', dtype=np.float64, ndmin=2)
 
-        # Generating file paths for potential caching
-        cache_dir = Path(__file__).resolve().parent / "cache"
-        cache_dir.mkdir(exist_ok=True)
-        file_name = f"DPI{dpi}L{target_max_l}.npy"
-        file_path = cache_dir / file_name
+            self.metrics.increment("ibex_mapper_bytes_loaded_total", data.nbytes, kind="coefficients")
+        else:
+            data = np.asarray(source, dtype=float)
 
-        print("Checking for cached spherical harmonics...")
+        # A single row is reshaped into a single row matrix.
+        data = np.atleast_2d(data)
 
-        if self.checkForCachedSphericalHarmonics(file_path):
-            print('Found cached spherical harmonics. Loading...')
+        if data.ndim != 2 or data.shape[1] < 3:
+            raise ValueError(f"Coefficients must be a (N, 3) or (N, 4) array, got shape {data.shape}.")
 
-            # We can cut it directly here because in app.py there is data sanitization that checks whether the inputted
-            # file and inputted max_l are properly defined (meaning always max_l >= count_of_rows).
-            cached_spherical_harmonics = self.loadSphericalHarmonicsFromCache(file_path)[:data.shape[0]]
+        return data
 
-            print("Loaded cached spherical harmonics. Initializing heatmap data calculations...")
+    def loadBinaryCoefficients(self, file_path: str) -> np.ndarray:
+        # A .npz file holds the array under "coefficients" (or as its only array).
+        if file_path.endswith(".npz"):
+            with np.load(file_path) as archive:
+                key = "coefficients" if "coefficients" in archive.files else archive.files[0]
+                return archive[key]
 
-            return self.calculator.calculateMainMatrixFromData(data, cached_spherical_harmonics, dpi)
-        else:
+        return np.load(file_path)
 
-            print(f"No cached spherical harmonics for DPI: {dpi} and L: {target_max_l}")
+    def getCoefficientsSidecarPath(self, file_path: str) -> str:
+        return f"{file_path}.npy"
 
-            print(f"Initializing calculation of spherical harmonics for DPI: {dpi} and L: {target_max_l}...")
+    def writeCoefficientsSidecar(self, file_path: str) -> str:
+        """
+        Method that parses a text coefficients file once and saves it next to it as a binary .npy sidecar
+        ("data.txt" -> "data.txt.npy"). Later loads of the text file read the sidecar, as long as it is newer
+        than the text file.
 
-            spherical_harmonics_matrices = self.calculator.calculateSphericalHarmonicsDataForSetDPI(dpi, target_max_l)
+        :param file_path:
+        Path to the .txt file.
 
-            print(f"Caching spherical harmonics for DPI: {dpi} and L: {target_max_l}...")
+        :return:
+        Returns the path of the sidecar.
+        """
 
-            self.cacheSphericalHarmonics(file_path, spherical_harmonics_matrices)
+        data = np.loadtxt(file_path, comments='#', dtype=np.float64, ndmin=2)
+        sidecar_path = self.getCoefficientsSidecarPath(str(file_path))
 
-            print(f"Cached spherical harmonics for DPI: {dpi} and L: {target_max_l}")
+        # Written to a temporary file first, so a reader never sees a half written sidecar.
+        temporary_path = f"{sidecar_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.save(file, data)
+        os.replace(temporary_path, sidecar_path)
 
-            # The same assumption here as in line 51.
-            cut_spherical_harmonics = spherical_harmonics_matrices[:data.shape[0]]
+        return sidecar_path
 
-            print("Initializing heatmap data calculation...")
+    def getCoefficientIndices(self, data: np.ndarray) -> np.ndarray:
+        """
+        Method that maps every coefficient row to its index in the basis, l^2 + l + m, which is the order
+        of calculateSphericalHarmonicsDataForSetDPI.
 
-            return self.calculator.calculateMainMatrixFromData(data, cut_spherical_harmonics, dpi)
+        :param data:
+        (N, 3) or (N, 4) array of (l, m, coefficient[, uncertainty]) rows, in any order.
 
-    def checkForCachedSphericalHarmonics(self, file_path) -> bool:
-        return file_path.exists()
+        :return:
+        Returns the (N,) array of basis indices, in the order of rows.
+        """
 
-    def cacheSphericalHarmonics(self, file_path, spherical_harmonics_matrices) -> None:
-        # Saves as .npy file.
-        np.save(file_path, spherical_harmonics_matrices, allow_pickle=True)
+        l_values = np.rint(data[:, 0]).astype(np.int64)
+        m_values = np.rint(data[:, 1]).astype(np.int64)
 
-    def loadSphericalHarmonicsFromCache(self, file_path: Path) -> np.ndarray:
-        return np.load(file_path, allow_pickle=True)
+        # Rows must name a valid spherical harmonic.
+        if not (np.allclose(data[:, :2], np.column_stack([l_values, m_values]))
+                and np.all(l_values >= 0) and np.all(np.abs(m_values) <= l_values)):
+            raise ValueError("Coefficients error: Every row must have integer l >= 0 and integer m with |m| <= l.")
 
-    def stringifyValue(self, value: any) -> str or dict[any: str] or list[str]:
-        """
-        Recursive method that converts all values in a dictionary or list of dictionaries
-        to their string representations. Supports tuples, booleans, ints and floats.
+        indices = l_values * l_values + l_values + m_values
 
-        :param value:
-        Value to convert. It supports lists of dictionaries even.
+        if np.unique(indices).size != indices.size:
+            raise ValueError("Coefficients error: Some (l, m) pair is given more than once.")
 
-        :returns:
-        Returns stringified value. Can be a dictionary or list.
+        return indices
+
+    def indexCoefficients(self, data: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
         """
+        Method that pairs coefficients with their basis indices (see getCoefficientIndices).
+        Zero coefficients are dropped, since they add nothing.
 
-        # Brute force all potential values.
-        if isinstance(value, dict):
-            return {k: self.stringifyValue(v) for k, v in value.items()}
+        :param data:
+        (N, 3) or (N, 4) array of (l, m, coefficient[, uncertainty]) rows, in any order.
 
-        if isinstance(value, list):
-            return [self.stringifyValue(v) for v in value]
+        :return:
+        Returns (basis indices, coefficients), both sorted by index.
+        """
 
-        if isinstance(value, tuple):
-            return str(value)
+        indices = self.getCoefficientIndices(data)
 
-        if isinstance(value, bool):
-            return "True" if value else "False"
+        order = np.argsort(indices)
+        indices = indices[order]
+        coefficients = data[order, 2]
 
-        if isinstance(value, (int, float)):
-            return str(value)
+        non_zero = coefficients != 0
 
-        return value
+        return indices[non_zero], coefficients[non_zero]
 
-    def formatConfigToPythonDatastructures(self, config: dict) -> dict:
+    def getSpectralWindow(self, config: dict) -> np.ndarray or None:
         """
-        Method that formats the stringified config dictionary into config dictionary with correct python datatypes.
+        Method that builds the spectral filter of a config (see Calculator.calculateSpectralWindow).
 
         :param config:
-        Given config to format.
-        Note: It is assumed that the config is a valid config dictionary.
+        Config with "max_l_to_cache" and optionally "filter_beam_fwhm", "filter_l_min", "filter_l_max" and
+        "filter_l_weights".
 
         :return:
-        Returns config dictionary formatted to correct python datastructures.
+        Returns the (max_l + 1,) weights of degrees, or None if the config sets no filter, so unfiltered maps
+        are not touched at all.
         """
 
-        # Agreed schema of config datatypes.
-        config_types_schema = {
-            "map_accuracy": int,
-            "max_l_to_cache": int,
-            "rotate": bool,
-            "central_point": tuple[float, float],
-            "meridian_point": tuple[float, float],
-            "show_negative_values": bool,
-            "map_features_type_checking": bool
-        }
+        beam_fwhm = config.get("filter_beam_fwhm", 0.0)
+        l_min = config.get("filter_l_min", 0)
+        l_max = config.get("filter_l_max", 0)
+        l_weights = config.get("filter_l_weights", [])
 
-        # Initializing formatted config dictionary.
-        formatted_config = {}
+        if beam_fwhm == 0 and l_min == 0 and l_max == 0 and not l_weights:
+            return None
 
-        # Loop over both key and value and try to parse it into the correct datatype using another handler method.
-        for key, value in config.items():
+        return self.calculator.calculateSpectralWindow(config["max_l_to_cache"], beam_fwhm, l_min, l_max, l_weights)
 
-            # Get the expected type from schema
-            expected_type = config_types_schema.get(key, str)
+    def filterCoefficients(self, data: np.ndarray, window: np.ndarray) -> np.ndarray:
+        """
+        Method that applies a spectral filter to coefficient rows.
 
-            try:
+        :param data:
+        (N, 3) or (N, 4) array of (l, m, coefficient[, uncertainty]) rows.
 
-                # Use parseStringsToPythonDatastructures to parse data.
-                formatted_config[key] = self.parseStringsToPythonDatastructures(value, expected_type)
+        :param window:
+        Weights of degrees, see getSpectralWindow.
 
-            except Exception as e:
+        :return:
+        Returns a filtered copy of data. Uncertainties are scaled like their coefficients.
+        """
 
-                # If the parser is written correctly, this shouldn't fire even once.
-                raise ValueError(f"Error parsing key '{key}' with value '{value}': {e}")
+        filtered = np.array(data, dtype=np.float64)
+        weights = window[np.rint(filtered[:, 0]).astype(np.int64)]
+        filtered[:, 2:] *= weights[:, np.newaxis]
 
-        return formatted_config
+        return filtered
 
-    def formatMapFeaturesToPythonDatastructures(self, features: dict) -> dict:
+    def processUserDataset(self, dpi: int, target_max_l: int, data: np.ndarray, engine: str = "full",
+                           band_size: int or None = None, workers: int = 1, precision: str = "float64") -> np.ndarray:
         """
-        Formats the stringified map features JSON into proper Python datatypes.
+        Main function that generates data for heatmap before configuration is applied.
 
-        :param features: Map features a dictionary.
-        :return: The parsed map features a dictionary.
+        :param dpi:
+        Resolution of the map. Ranges from 0 to infinity, but generally speaking, the intended accuracy is around 720.
+
+        :param target_max_l:
+        Caching parameter (related to spherical harmonics). Ranges from 0 to infinity. Determines how deep will
+        calculator calculate the spherical harmonics for. The intended value is one that the user sets as default in the config.
+
+        :param data:
+        Matrix of (N, 4) size. Rows are matched to the basis by their l and m (first two columns), so they
+        may be unordered or sparse. The 3rd column holds the coefficients.
+
+        :param engine:
+        "full" (basis held in memory) or "chunked" (basis built, memory mapped and summed in latitude bands),
+        see ResourcePlanner.
+
+        :param band_size:
+        Colatitude columns per band of the chunked engine.
+
+        :param workers:
+        Threads calculating the basis if it is not cached, see getSphericalHarmonicsBasis.
+
+        :param precision:
+        "float64" or "float32", type of the basis and of the synthesis.
+
+        :returns:
+        Returns (dpi, dpi) size matrix of data for heatmap.
         """
 
-        # Defines feature schema.
-        # Note: all "str" values are not defined here, since no conversion is needed for them.
-        feature_type_schemas = {
-            "points": {
-                "coordinates": tuple[float, float],
-                "show_text": bool,
-                "hollow": bool
-            },
-            "circles": {
-                "coordinates": tuple[float, float],
-                "alpha": int,
-            },
-            "texts": {
-                "coordinates": tuple[float, float],
-                "font_size": int,
-                "tilt_angle": int,
-            },
-            "heatmap_scale": tuple[float, float],
-        }
+        indices, coefficients = self.indexCoefficients(data)
 
-        # Initializing an empty map features a dictionary.
-        formatted_map_features = {}
+        # Nothing to sum, the map is flat zero.
+        if indices.size == 0:
+            return np.zeros((dpi, dpi), dtype=precision)
 
-        # Processing the non-array features first.
-        for key, value in features.items():
-            if key not in ["points", "circles", "texts"]:
+        spherical_harmonics_matrices = self.getSphericalHarmonicsBasis(dpi, target_max_l, engine, band_size, workers,
+                                                                       precision)
 
-                # Get the expected type.
-                expected_type = feature_type_schemas.get(key, str)
-                try:
+        # In app.py there is data sanitization that checks whether the file max l is lower or equal to the
+        # basis max l, so every index is in the basis.
+        used_span = int(indices[-1]) + 1
 
-                    # Again, uses parseStringsToPythonDatastructures method to parse the value.
-                    formatted_map_features[key] = self.parseStringsToPythonDatastructures(value, expected_type)
+        if engine == "chunked":
+            # Only one band of the used basis functions is read from the mapped file at a time.
+            return self.calculator.calculateMainMatrixInBands(
+                coefficients, spherical_harmonics_matrices, indices, dpi, band_size or dpi)
 
-                except Exception as e:
+        if 2 * indices.size >= used_span:
+            # Mostly complete files: one contiguous slice of the basis (a view, nothing is copied), with missing
+            # and zero coefficients filled with zeros.
+            dense_coefficients = np.zeros(used_span, dtype=precision)
+            dense_coefficients[indices] = coefficients
 
-                    # Also again, this shouldn't fire once if the parser is written correctly.
-                    raise ValueError(f"Error parsing root key '{key}' with value '{value}': {e}")
+            return self.calculator.calculateMainMatrixFromCoefficients(
+                dense_coefficients, spherical_harmonics_matrices[:used_span], dpi)
 
-        # Now we process all the arrays in the map features dictionary.
-        for group_key in ["points", "circles", "texts"]:
+        # Sparse files: only the basis functions that are actually used are gathered and summed, a few rows at a
+        # time by every block.
+        return self.calculator.calculateMainMatrixFromCoefficients(
+            coefficients, spherical_harmonics_matrices, dpi, indices)
 
-            # Getting the array to process first.
-            group_items = features.get(group_key, [])
+    def processUncertainties(self, dpi: int, target_max_l: int, data: np.ndarray, engine: str = "full",
+                             band_size: int or None = None, workers: int = 1, precision: str = "float64",
+                             samples: int = 0, seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray or None]:
+        """
+        Same as processUserDataset, plus the uncertainty map of the 4th column, synthesized in the same pass over
+        the basis (see Calculator.calculateMainAndVarianceMatrices).
 
-            # Getting all expected types.
-            schema = feature_type_schemas.get(group_key, {})
+        :param data:
+        Matrix of (N, 4) size, (l, m, coefficient, uncertainty) rows in any order.
 
-            # Initializing parsed array.
-            parsed_group = []
+        :param samples:
+        Number of Monte Carlo maps (see Calculator.calculateMonteCarloDeviationMatrix), 0 for none.
 
-            # Now we process them one by one, the same logic as with non-array keys.
-            for item in group_items:
-                parsed_item = {}
-                for item_key, item_value in item.items():
-                    expected_type = schema.get(item_key, str)
-                    try:
-                        parsed_item[item_key] = self.parseStringsToPythonDatastructures(item_value, expected_type)
-                    except Exception as e:
-                        raise ValueError(
-                            f"Error parsing '{group_key}' item key '{item_key}' with value '{item_value}': {e}"
-                        )
-                parsed_group.append(parsed_item)
+        :param seed:
+        Seed of the Monte Carlo draws.
 
-            formatted_map_features[group_key] = parsed_group
+        :returns:
+        Returns (heatmap data, analytic standard deviation map, Monte Carlo standard deviation map or None), all of
+        (dpi, dpi) size.
+        """
+
+        indices = self.getCoefficientIndices(data)
+        order = np.argsort(indices)
+        indices, coefficients, uncertainties = indices[order], data[order, 2], np.abs(data[order, 3])
+
+        # Rows with a zero coefficient still add to the uncertainty, rows with neither add nothing.
+        used = (coefficients != 0) | (uncertainties != 0)
+        indices, coefficients, uncertainties = indices[used], coefficients[used], uncertainties[used]
+
+        if indices.size == 0:
+            zeros = np.zeros((dpi, dpi), dtype=precision)
+            return zeros, zeros.copy(), zeros.copy() if samples else None
+
+        spherical_harmonics_matrices = self.getSphericalHarmonicsBasis(dpi, target_max_l, engine, band_size, workers,
+                                                                       precision)
+        used_span = int(indices[-1]) + 1
+
+        # Dense vectors over the contiguous span of the basis that is used, for the Monte Carlo matrix products and
+        # for mostly complete files.
+        dense_coefficients = np.zeros(used_span)
+        dense_uncertainties = np.zeros(used_span)
+        dense_coefficients[indices] = coefficients
+        dense_uncertainties[indices] = uncertainties
+
+        if engine == "chunked":
+            heatmap_data, variance = self.calculator.calculateMainAndVarianceMatrices(
+                coefficients, uncertainties ** 2, spherical_harmonics_matrices, indices, dpi, band_size or dpi)
+        elif 2 * indices.size >= used_span:
+            heatmap_data, variance = self.calculator.calculateMainAndVarianceMatrices(
+                dense_coefficients, dense_uncertainties ** 2, spherical_harmonics_matrices, slice(0, used_span), dpi)
+        else:
+            # Sparse files: every block gathers only the used basis functions, a few rows at a time.
+            heatmap_data, variance = self.calculator.calculateMainAndVarianceMatrices(
+                coefficients, uncertainties ** 2, spherical_harmonics_matrices, indices, dpi)
+
+        monte_carlo = None
 
-        return formatted_map_features
+        if samples:
+            monte_carlo = self.calculator.calculateMonteCarloDeviationMatrix(
+                dense_coefficients, dense_uncertainties, spherical_harmonics_matrices[:used_span], dpi, samples, seed)
 
-    def parseStringsToPythonDatastructures(self, value, expected_type) -> any:
+        return heatmap_data, np.sqrt(variance), monte_carlo
+
+    def processCoefficientSlab(self, dpi: int, target_max_l: int, coefficients: np.ndarray, engine: str = "full",
+                               band_size: int or None = None, workers: int = 1,
+                               precision: str = "float64") -> np.ndarray:
         """
-        Method that parsed the validated, stringified config dictionary values into correct values
-        with correct python datastructures.
+        Method that generates heatmap data of many maps at once, from dense coefficient vectors in basis order
+        (for example a slab of a coefficient container).
+
+        :param dpi:
+        Resolution of the maps.
 
-        :param value:
-        Value to parse.
-        Note: value is assumed to be validated.
+        :param target_max_l:
+        Max l of the basis, must be at least the max l of the coefficients.
 
-        :param expected_type:
-        Expected type to parse correctly.
+        :param coefficients:
+        (M, K) array, one row of coefficients per map.
+
+        :param engine:
+        "full" or "chunked", see processUserDataset. A memory mapped basis is streamed by the matrix product.
+
+        :param band_size:
+        Colatitude columns per band when the chunked engine builds the basis.
+
+        :param workers:
+        Threads calculating the basis if it is not cached.
+
+        :param precision:
+        "float64" or "float32", type of the basis and of the synthesis.
 
         :return:
-        Returns parsed value.
+        Returns (M, dpi, dpi) array of heatmap data.
+        """
+
+        spherical_harmonics_matrices = self.getSphericalHarmonicsBasis(dpi, target_max_l, engine, band_size, workers,
+                                                                       precision)
+
+        return self.calculator.calculateMainMatricesFromCoefficients(
+            np.asarray(coefficients), spherical_harmonics_matrices[:coefficients.shape[1]], dpi)
+
+    def getSphericalHarmonicsBasis(self, dpi: int, target_max_l: int, engine: str = "full",
+                                   band_size: int or None = None, workers: int = 1,
+                                   precision: str = "float64") -> np.ndarray:
         """
+        Method that returns the spherical harmonics basis for given dpi and L. The last used basis is kept in memory
+        of this instance, otherwise it is loaded from the disk cache, or calculated and cached if there is none.
+        Note: Threads sharing this instance wait for each other here, so the basis is loaded only once.
 
-        # Brute forces all checks.
-        if expected_type == bool:
-            return str(value).lower() == "true"
+        :param dpi:
+        Resolution of the map.
+
+        :param target_max_l:
+        Max l of the basis.
 
-        if expected_type == int:
-            return int(value)
+        :param engine:
+        "full": the basis is calculated at once and loaded into memory.
+        "chunked": the basis is calculated in latitude bands straight into the cache file, and memory mapped
+        (read-only) instead of loaded, so neither the whole complex intermediate nor the whole basis is ever
+        held in memory.
 
-        if expected_type == float:
-            return float(value)
+        :param band_size:
+        Colatitude columns calculated at once by the chunked engine (by each of its workers). Defaults to all columns.
 
-        if expected_type == tuple[float, float]:
-            parsed = ast.literal_eval(value)
-            return tuple(float(x) for x in parsed)
+        :param workers:
+        Number of threads calculating latitude bands of the basis at once, if it has to be calculated.
+        The full engine splits the map into one band per worker.
 
+        :param precision:
+        "float64" or "float32". A float32 basis is calculated in float64 and rounded, and cached in its own file.
+
+        :return:
+        Returns (K, dpi, dpi) basis, where K = (L + 1)^2.
+        """
+
+        key = (dpi, target_max_l, precision)
+
+        with self.basis_lock:
+            if key in self.basis_cache:
+                self.metrics.increment("ibex_mapper_basis_cache_hits_total")
+                return self.basis_cache[key]
+
+            # Generating file paths for potential caching
+            file_path = self.getSphericalHarmonicsCachePath(dpi, target_max_l, precision)
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+
+            if engine == "chunked":
+                if self.checkForCachedSphericalHarmonics(file_path):
+                    self.metrics.increment("ibex_mapper_basis_cache_misses_total", source="disk")
+                else:
+                    self.metrics.increment("ibex_mapper_basis_cache_misses_total", source="computed")
+
+                    with self.instrumentation.span("basis.compute"):
+                        self.cacheSphericalHarmonicsInBands(file_path, dpi, target_max_l, band_size or dpi, workers,
+                                                            precision)
+
+                # Pages are read on demand and belong to the page cache, not to this process.
+                spherical_harmonics_matrices = np.load(file_path, mmap_mode="r")
+            elif self.checkForCachedSphericalHarmonics(file_path):
+                with self.instrumentation.span("basis.load"):
+                    spherical_harmonics_matrices = self.loadSphericalHarmonicsFromCache(file_path)
+
+                self.metrics.increment("ibex_mapper_basis_cache_misses_total", source="disk")
+                self.metrics.increment("ibex_mapper_bytes_loaded_total", spherical_harmonics_matrices.nbytes,
+                                       kind="basis")
+            else:
+                self.metrics.increment("ibex_mapper_basis_cache_misses_total", source="computed")
+
+                with self.instrumentation.span("basis.compute"):
+                    if workers > 1 or precision != "float64":
+                        # Bands of the same total size as the serial path, so it takes no extra memory. They are
+                        # rounded into a preallocated basis, so a float32 one never exists in float64.
+                        spherical_harmonics_matrices = self.calculator.calculateSphericalHarmonicsInBands(
+                            dpi, target_max_l, -(-dpi // workers), workers, dtype=precision)
+                    else:
+                        spherical_harmonics_matrices = np.asarray(
+                            self.calculator.calculateSphericalHarmonicsDataForSetDPI(dpi, target_max_l))
+
+                with self.instrumentation.span("basis.cache_write"):
+                    self.cacheSphericalHarmonics(file_path, spherical_harmonics_matrices)
+
+            self.keepBasis(key, spherical_harmonics_matrices)
+
+            return spherical_harmonics_matrices
+
+    def keepBasis(self, key: tuple, basis: np.ndarray) -> None:
+        # Only the last used large basis is kept, they are large. Small ones are kept as well (the oldest are
+        # dropped beyond MAX_SMALL_BASES), so switching between a preview and the full map does not reload either.
+        # Note: Called with basis_lock held.
+        if basis.nbytes > self.SMALL_BASIS_BYTES:
+            for cached_key in [cached_key for cached_key, cached_basis in self.basis_cache.items()
+                               if cached_basis.nbytes > self.SMALL_BASIS_BYTES]:
+                del self.basis_cache[cached_key]
         else:
-            return value
+            small_keys = [cached_key for cached_key, cached_basis in self.basis_cache.items()
+                          if cached_basis.nbytes <= self.SMALL_BASIS_BYTES]
+
+            for cached_key in small_keys[:max(0, len(small_keys) - self.MAX_SMALL_BASES + 1)]:
+                del self.basis_cache[cached_key]
+
+        self.basis_cache[key] = basis
+
+    def getSphericalHarmonicsCachePath(self, dpi: int, target_max_l: int, precision: str = "float64") -> Path:
+        # float64 caches keep their original names, other precisions get a suffix (e.g. DPI400L30f32.npy).
+        suffix = "" if precision == "float64" else f"f{np.dtype(precision).itemsize * 8}"
+        return Path(self.storage.cache_dir) / f"DPI{dpi}L{target_max_l}{suffix}.npy"
+
+    def attachSharedBasis(self, descriptor: dict) -> None:
+        """
+        Method that makes this instance use a basis published by a BasisServer (in another process) instead of
+        loading its own copy. The attached view replaces the in-memory basis of this instance.
+
+        :param descriptor:
+        Descriptor returned by BasisServer.publish.
+        """
+
+        # Imported here, the basis server module imports this one.
+        from .basis_server import BasisServer
+
+        basis, handle = BasisServer.attach(descriptor)
+
+        with self.basis_lock:
+            self.basis_cache.clear()
+            self.basis_cache[(descriptor["dpi"], descriptor["max_l"], np.dtype(descriptor["dtype"]).name)] = basis
+
+            # Keeps the shared memory block open for as long as the view is used.
+            self.basis_handle = handle
+
+    def releaseBasis(self) -> None:
+        # Drops the in-memory (or attached) basis of this instance. The next map loads it again.
+        with self.basis_lock:
+            self.basis_cache.clear()
+
+            if self.basis_handle is not None:
+                self.basis_handle.close()
+                self.basis_handle = None
+
+    def checkForCachedSphericalHarmonics(self, file_path) -> bool:
+        return file_path.exists()
+
+    def cacheSphericalHarmonics(self, file_path, spherical_harmonics_matrices) -> None:
+        # Saves as .npy file, through a temporary file so other instances never load a half-written cache.
+        temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            np.save(f, spherical_harmonics_matrices, allow_pickle=True)
+        os.replace(temporary_path, file_path)
+
+    def cacheSphericalHarmonicsInBands(self, file_path, dpi: int, target_max_l: int, band_size: int,
+                                       workers: int = 1, precision: str = "float64") -> None:
+        # The cache file is allocated on disk (memory mapped) and filled band by band, through a temporary file
+        # like cacheSphericalHarmonics. The result is the same .npy file.
+        temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        basis = np.lib.format.open_memmap(temporary_path, mode="w+", dtype=precision,
+                                          shape=((target_max_l + 1) ** 2, dpi, dpi))
+
+        self.calculator.calculateSphericalHarmonicsInBands(dpi, target_max_l, band_size, workers, basis)
+
+        basis.flush()
+        del basis
+        os.replace(temporary_path, file_path)
+
+    def loadSphericalHarmonicsFromCache(self, file_path: Path) -> np.ndarray:
+        return np.load(file_path, allow_pickle=True)
+
+    def formatConfigToPythonDatastructures(self, config: dict) -> dict:
+        """
+        Method that formats a stored config dictionary (native or legacy stringified values) into config dictionary
+        with correct python datatypes.
+
+        :param config:
+        Given config to format.
+        Note: It is assumed that the config is a valid config dictionary.
+
+        :return:
+        Returns config dictionary formatted to correct python datastructures.
+        """
+
+        # Uses the config schema compiled once at import, no per-field evaluation is done here.
+        return self.storage.config_schema.decodeValues(config)
+
+    def formatMapFeaturesToPythonDatastructures(self, features: dict) -> dict:
+        """
+        Formats the stored map features dictionary (native or legacy stringified values) into proper Python datatypes.
+
+        :param features: Map features a dictionary.
+        :return: The parsed map features a dictionary.
+        """
+
+        # Same as with config, the compiled map features schema does all the work.
+        return self.storage.map_features_schema.decodeValues(features)
 
     # ----------------------------------------------
     # Getters for all the map features related stuff.
     # ----------------------------------------------
     def getMapFeatures(self) -> dict:
-
-        with open(self.FEATURES_FILE, "r") as features_file:
-            map_features = json.load(features_file)
-
-        return self.formatMapFeaturesToPythonDatastructures(map_features)
+        return self.storage.loadMapFeatures()
 
     def getPointsList(self) -> list:
         return self.getMapFeatures().get("points", [])
@@ -315,7 +587,18 @@ class Handler:
             "show_negative_values",
             "central_point",
             "meridian_point",
-            "map_features_type_checking"
+            "map_features_type_checking",
+            "map_features_encoding",
+            "instrumentation",
+            "basis_engine",
+            "memory_budget_mb",
+            "basis_workers",
+            "threads",
+            "precision",
+            "filter_beam_fwhm",
+            "filter_l_min",
+            "filter_l_max",
+            "filter_l_weights"
         }
 
         # Asserts that a given config only contains config dictionary keys.
@@ -368,6 +651,67 @@ class Handler:
             elif not isinstance(map_features_type_checking, bool):
                 raise ValueError("Map features type checking must be a boolean.")
 
+        # Asserts that map features encoding is one of the supported encodings.
+        if "map_features_encoding" in config:
+            if config["map_features_encoding"] not in ("json", "binary"):
+                raise ValueError("Map features encoding must be 'json' or 'binary'.")
+
+        # Asserts that the instrumentation switch is boolean.
+        if "instrumentation" in config:
+            if not isinstance(config["instrumentation"], bool):
+                raise ValueError("Instrumentation must be a boolean.")
+
+        # Asserts that the basis engine is one of the engines of the resource planner.
+        if "basis_engine" in config:
+            if config["basis_engine"] not in ("auto", "full", "chunked"):
+                raise ValueError("Basis engine must be 'auto', 'full' or 'chunked'.")
+
+        # Asserts that the memory budget is a non-negative integer (0 means a part of the physical memory).
+        if "memory_budget_mb" in config:
+            memory_budget_mb = config["memory_budget_mb"]
+            if isinstance(memory_budget_mb, bool) or not isinstance(memory_budget_mb, int) or memory_budget_mb < 0:
+                raise ValueError("Memory budget must be a non-negative integer of megabytes.")
+
+        # Asserts that the number of basis workers is a non-negative integer (0 means one per core).
+        if "basis_workers" in config:
+            basis_workers = config["basis_workers"]
+            if isinstance(basis_workers, bool) or not isinstance(basis_workers, int) or basis_workers < 0:
+                raise ValueError("Basis workers must be a non-negative integer.")
+
+        # Asserts that the thread count is a non-negative integer (0 means one per core).
+        if "threads" in config:
+            threads = config["threads"]
+            if isinstance(threads, bool) or not isinstance(threads, int) or threads < 0:
+                raise ValueError("Threads must be a non-negative integer.")
+
+        # Asserts that the precision is one of the supported floating point types.
+        if "precision" in config:
+            if config["precision"] not in ("float64", "float32"):
+                raise ValueError("Precision must be 'float64' or 'float32'.")
+
+        # Asserts that the beam width of the spectral filter is a non-negative number of degrees.
+        if "filter_beam_fwhm" in config:
+            beam_fwhm = config["filter_beam_fwhm"]
+            if isinstance(beam_fwhm, bool) or not isinstance(beam_fwhm, (int, float)) or not 0 <= beam_fwhm <= 360:
+                raise ValueError("Filter beam FWHM must be a number of degrees in [0, 360].")
+
+        # Asserts that degree limits of the spectral filter are non-negative integers.
+        for key, name in (("filter_l_min", "Filter l min"), ("filter_l_max", "Filter l max")):
+            if key in config:
+                value = config[key]
+                if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                    raise ValueError(f"{name} must be a non-negative integer.")
+
+        if config.get("filter_l_max", 0) > 0 and config.get("filter_l_min", 0) > config["filter_l_max"]:
+            raise ValueError("Filter l min must not be greater than filter l max.")
+
+        # Asserts that custom weights of degrees are a list of numbers.
+        if "filter_l_weights" in config:
+            l_weights = config["filter_l_weights"]
+            if not isinstance(l_weights, (list, tuple)) or \
+                    any(isinstance(weight, bool) or not isinstance(weight, (int, float)) for weight in l_weights):
+                raise ValueError("Filter l weights must be a list of numbers, one per degree from l = 0.")
+
         # Asserts that given points are valid elliptical points.
         if "central_point" in config:
             self.assertCoordinates(config["central_point"], "Central point")
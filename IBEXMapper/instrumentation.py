@@ -0,0 +1,246 @@
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from .metrics import MetricsRegistry
+
+
+class Instrumentation:
+    """
+    Class that measures named spans of the pipeline (parse, basis, synthesis, rotation, interpolation, graticule,
+    features, save...): wall time, CPU time of the running thread and bytes allocated (peak, by tracemalloc).
+    Spans nest, so time of a span includes time of spans inside it.
+
+    tracemalloc has one peak for the whole process, so bytes are only counted for spans that did not overlap spans of
+    other threads (server threads, async stages, iterMaps, basis workers). Overlapped spans record None.
+
+    It is disabled (silent, only the wall time of every span is counted in the metrics) by default. It is enabled by:
+    - IBEX_MAPPER_INSTRUMENT=1 environment variable, or "instrumentation": True in the default config,
+    - IBEX_MAPPER_PROFILE_DIR=<folder>, which also dumps a cProfile file for every top-level call into the folder,
+    - IBEX_MAPPER_REPORT=<file>, which also writes the JSON run report to the file when the process exits,
+    - or the enable method.
+
+    Cumulative metrics of the process (counters and latency histograms, see MetricsRegistry) are kept in metrics,
+    whether instrumentation is enabled or not.
+    """
+
+    # Last spans kept in the report, older ones only count in the totals.
+    MAX_RECENT_SPANS = 1000
+
+    # Histogram that receives the wall time of every span.
+    STAGE_HISTOGRAM = "ibex_mapper_stage_seconds"
+
+    def __init__(self, metrics: MetricsRegistry or None = None):
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.enabled = False
+        self.profile_dir = None
+        self.report_path = None
+
+        # {span name: totals}, see getReport.
+        self.totals = {}
+        self.recent_spans = deque(maxlen=self.MAX_RECENT_SPANS)
+        self.lock = threading.Lock()
+
+        # Stack of open spans of every thread.
+        self.local = threading.local()
+
+        # Threads with open spans, and how many times a thread opened a span while another one had open spans.
+        self.active_threads = 0
+        self.overlaps = 0
+
+        # cProfile can profile only one call at a time.
+        self.profile_lock = threading.Lock()
+        self.exit_hook_registered = False
+
+        if os.environ.get("IBEX_MAPPER_INSTRUMENT", "") not in ("", "0") \
+                or os.environ.get("IBEX_MAPPER_PROFILE_DIR") or os.environ.get("IBEX_MAPPER_REPORT"):
+            self.enable(os.environ.get("IBEX_MAPPER_REPORT"), os.environ.get("IBEX_MAPPER_PROFILE_DIR"))
+
+    def enable(self, report_path: str or None = None, profile_dir: str or None = None) -> None:
+        """
+        Method that switches instrumentation on.
+
+        :param report_path:
+        If given, the JSON run report is written to this file when the process exits.
+
+        :param profile_dir:
+        If given, every top-level call (computeHeatmap, renderHeatmap...) is profiled with cProfile and dumped
+        into this folder as "{call}-{time}-{pid}.prof".
+        """
+
+        self.enabled = True
+        self.report_path = report_path or self.report_path
+        self.profile_dir = profile_dir or self.profile_dir
+
+        # Tracing allocations slows Python code down, so it is only started when it is needed.
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        if self.report_path is not None and not self.exit_hook_registered:
+            atexit.register(self.writeReport)
+            self.exit_hook_registered = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def span(self, name: str):
+        """
+        Method that returns a context manager measuring the code inside it under the given name.
+        """
+
+        if not self.enabled:
+            return self.metrics.timer(self.STAGE_HISTOGRAM, stage=name)
+
+        return self.measure(name)
+
+    def call(self, name: str):
+        """
+        Same as span, for top-level calls. The call is also profiled with cProfile if a profile folder is set.
+        """
+
+        if not self.enabled:
+            return self.metrics.timer(self.STAGE_HISTOGRAM, stage=name)
+
+        if self.profile_dir is None:
+            return self.measure(name)
+
+        return self.measureAndProfile(name)
+
+    @contextlib.contextmanager
+    def measure(self, name: str):
+        stack = self.getSpanStack()
+
+        with self.lock:
+            if not stack:
+                self.active_threads += 1
+
+                if self.active_threads > 1:
+                    self.overlaps += 1
+
+            overlapped = self.active_threads > 1
+            start_overlaps = self.overlaps
+
+        # The peak since the start of the parent span is saved before the peak is reset for this span.
+        # Note: The reset is process wide, so it is skipped while spans of other threads are open.
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+
+        start_memory = tracemalloc.get_traced_memory()[0]
+
+        if not overlapped:
+            tracemalloc.reset_peak()
+
+        span = {"name": name, "peak": start_memory}
+        stack.append(span)
+
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+
+            stack.pop()
+            peak = max(span["peak"], tracemalloc.get_traced_memory()[1])
+
+            # The parent span keeps the peak of this span, since the next reset would lose it.
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+
+            with self.lock:
+                # Another thread had open spans at the start, or opened some meanwhile: the peak is not this span's.
+                overlapped = overlapped or self.overlaps != start_overlaps
+
+                if not stack:
+                    self.active_threads -= 1
+
+            self.record(name, wall, cpu, None if overlapped else peak - start_memory, len(stack))
+
+    @contextlib.contextmanager
+    def measureAndProfile(self, name: str):
+        # Another call is being profiled (or this one is nested in it), so this one is only measured.
+        if not self.profile_lock.acquire(blocking=False):
+            with self.measure(name):
+                yield
+            return
+
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+        try:
+            with self.measure(name):
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{name}-{time.time():.6f}-{os.getpid()}.prof"))
+        finally:
+            self.profile_lock.release()
+
+    def getSpanStack(self) -> list:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+
+        return self.local.stack
+
+    def record(self, name: str, wall: float, cpu: float, allocated_bytes: int or None, depth: int) -> None:
+        self.metrics.observe(self.STAGE_HISTOGRAM, wall, stage=name)
+
+        with self.lock:
+            totals = self.totals.setdefault(name, {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                   "max_wall_seconds": 0.0, "max_allocated_bytes": 0})
+            totals["count"] += 1
+            totals["wall_seconds"] += wall
+            totals["cpu_seconds"] += cpu
+            totals["max_wall_seconds"] = max(totals["max_wall_seconds"], wall)
+
+            if allocated_bytes is not None:
+                totals["max_allocated_bytes"] = max(totals["max_allocated_bytes"], allocated_bytes)
+
+            self.recent_spans.append({"name": name, "wall_seconds": wall, "cpu_seconds": cpu,
+                                      "allocated_bytes": allocated_bytes, "depth": depth,
+                                      "thread": threading.current_thread().name, "end": time.time()})
+
+    def getReport(self) -> dict:
+        """
+        :return:
+        Returns the run report: {"pid", "spans": {name: {"count", "wall_seconds", "cpu_seconds", "mean_wall_seconds",
+        "max_wall_seconds", "max_allocated_bytes"}}, "recent": [last spans, oldest first]}.
+        """
+
+        with self.lock:
+            spans = {name: dict(totals, mean_wall_seconds=totals["wall_seconds"] / totals["count"])
+                     for name, totals in self.totals.items()}
+
+            return {"pid": os.getpid(), "spans": spans, "recent": list(self.recent_spans)}
+
+    def writeReport(self, file_path: str or None = None) -> None:
+        """
+        Method that writes the run report as JSON.
+
+        :param file_path:
+        Report file. Defaults to the report path given when enabling.
+        """
+
+        file_path = file_path or self.report_path
+
+        if file_path is None:
+            raise ValueError("No report path given.")
+
+        with open(file_path, "w") as file:
+            json.dump(self.getReport(), file, indent=4)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.totals.clear()
+            self.recent_spans.clear()
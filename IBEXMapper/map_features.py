@@ -1,6 +1,5 @@
-import json
-import os
 from .handler import Handler
+from .storage import Storage
 
 
 class MapFeatures:
@@ -9,16 +8,12 @@ class MapFeatures:
     
     This class provides methods to add, remove, and manage different types of map features
     such as points, circles, text annotations, and heatmap settings. All features are
-    stored in a JSON file for persistence.
+    stored as a typed document (JSON or compact binary) for persistence.
     """
-    # Initializing map_features folder using os package to ensure OS compatibility.
-    CONFIG_DIR = "config"
-    FEATURES_DIR = "map_features"
-    CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
-    FEATURES_FILE = os.path.join(FEATURES_DIR, "map_features.json")
-    
-    def __init__(self, handler: Handler):
+
+    def __init__(self, handler: Handler, storage: Storage):
         self.handler = handler
+        self.storage = storage
 
     # ----------------------------------------
     #                  POINTS
@@ -59,23 +54,23 @@ class MapFeatures:
         if self.getMapFeaturesTypeCheckingValue():
             self.handler.assertPoint(coordinates, color, show_text, point_type,  hollow)
         
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        # Lock keeps load-modify-save atomic when this instance is shared between threads.
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        if any(p['name'] == point_name for p in data.get("points", [])):
-            print(f"Point with name '{point_name}' already exists. Overwriting...")
+            if any(p['name'] == point_name for p in data.get("points", [])):
+                print(f"Point with name '{point_name}' already exists. Overwriting...")
           
-        data["points"].append({
-            "name": point_name,
-            "coordinates": self.handler.stringifyValue(coordinates),
-            "color": color,
-            "show_text": self.handler.stringifyValue(show_text),
-            "point_type": point_type,
-            "hollow": self.handler.stringifyValue(hollow)
-        })
-
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            data["points"].append({
+                "name": point_name,
+                "coordinates": coordinates,
+                "color": color,
+                "show_text": show_text,
+                "point_type": point_type,
+                "hollow": hollow
+            })
+
+            self.storage.saveMapFeatures(data)
 
     def removePoint(self, point_name: str) -> None:
         """
@@ -88,23 +83,22 @@ class MapFeatures:
         If a point with the specified name does not exist, a message will be printed.
         """
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        points = data.get("points", [])
+            points = data.get("points", [])
 
-        for i, point in enumerate(points):
-            if point["name"] == point_name:
-                del points[i]
-                break
-        else:
-            print(f"Point with name '{point_name}' does not exist.")
-            return
+            for i, point in enumerate(points):
+                if point["name"] == point_name:
+                    del points[i]
+                    break
+            else:
+                print(f"Point with name '{point_name}' does not exist.")
+                return
 
-        data["points"] = points
+            data["points"] = points
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     def removeAllPoints(self) -> None:
         """
@@ -113,13 +107,12 @@ class MapFeatures:
         This method clears all points from the map features file.
         """
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        data["points"] = []
+            data["points"] = []
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     # ----------------------------------------
     #                  CIRCLES
@@ -154,22 +147,21 @@ class MapFeatures:
         if self.getMapFeaturesTypeCheckingValue():
             self.handler.assertCircle(coordinates, alpha, color, linestyle)
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        if any(p['name'] == circle_name for p in data.get("circles", [])):
-            print(f"Circle with name '{circle_name}' already exists. Overwriting...")
+            if any(p['name'] == circle_name for p in data.get("circles", [])):
+                print(f"Circle with name '{circle_name}' already exists. Overwriting...")
 
-        data["circles"].append({
-            "name": circle_name,
-            "coordinates": self.handler.stringifyValue(coordinates),
-            "alpha": self.handler.stringifyValue(alpha),
-            "color": color,
-            "linestyle": linestyle
-        })
+            data["circles"].append({
+                "name": circle_name,
+                "coordinates": coordinates,
+                "alpha": alpha,
+                "color": color,
+                "linestyle": linestyle
+            })
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
             
     def removeCircle(self, circle_name: str) -> None:
         """
@@ -182,23 +174,22 @@ class MapFeatures:
         If a circle with the specified name does not exist, a message will be printed.
         """
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        circles = data.get("circles", [])
+            circles = data.get("circles", [])
 
-        for i, circle in enumerate(circles):
-            if circle["name"] == circle_name:
-                del circles[i]
-                break
-        else:
-            print(f"Point with name '{circle_name}' does not exist.")
-            return
+            for i, circle in enumerate(circles):
+                if circle["name"] == circle_name:
+                    del circles[i]
+                    break
+            else:
+                print(f"Point with name '{circle_name}' does not exist.")
+                return
 
-        data["points"] = circles
+            data["points"] = circles
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     def removeAllCircles(self) -> None:
         """
@@ -207,13 +198,12 @@ class MapFeatures:
         This method clears all circles from the map features file.
         """
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        data["circles"] = []
+            data["circles"] = []
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     # ----------------------------------------
     #                  TEXTS
@@ -250,22 +240,21 @@ class MapFeatures:
         if self.getMapFeaturesTypeCheckingValue():
             self.handler.assertText(coordinates, color, font_size, tilt_angle)
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
             if any(p['name'] == text_name for p in data.get("texts", [])):
                 print(f"Text with name '{text_name}' already exists. Overwriting...")
 
             data["texts"].append({
                 "name": text_name,
-                "coordinates": self.handler.stringifyValue(coordinates),
+                "coordinates": coordinates,
                 "color": color,
-                "font_size": self.handler.stringifyValue(font_size),
-                "tilt_angle": self.handler.stringifyValue(tilt_angle),
+                "font_size": font_size,
+                "tilt_angle": tilt_angle,
             })
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     def removeMapText(self, text_name: str) -> None:
         """
@@ -278,23 +267,22 @@ class MapFeatures:
         If a text with the specified name does not exist, a message will be printed.
         """
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        texts = data.get("texts", [])
+            texts = data.get("texts", [])
 
-        for i, text in enumerate(texts):
-            if text["name"] == text_name:
-                del texts[i]
-                break
-        else:
-            print(f"Point with name '{text_name}' does not exist.")
-            return
+            for i, text in enumerate(texts):
+                if text["name"] == text_name:
+                    del texts[i]
+                    break
+            else:
+                print(f"Point with name '{text_name}' does not exist.")
+                return
 
-        data["texts"] = texts
+            data["texts"] = texts
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     def removeAllMapText(self) -> None:
         """
@@ -303,13 +291,12 @@ class MapFeatures:
         This method clears all text annotations from the map features file.
         """
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        data["texts"] = []
+            data["texts"] = []
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     # ----------------------------------------
     #         HEATMAP SCALE AND COLOR
@@ -327,25 +314,23 @@ class MapFeatures:
         if self.getMapFeaturesTypeCheckingValue():
             self.handler.assertHeatmapScale(scale)
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        data["heatmap_scale"] = self.handler.stringifyValue(scale)
+            data["heatmap_scale"] = scale
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     def resetHeatmapScaleToDefault(self):
         """
         Method that resets the heatmap scale to the default value.
         """
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        data["heatmap_scale"] = self.handler.stringifyValue((0, 0))
+            data["heatmap_scale"] = (0, 0)
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     def selectHeatmapColorPalette(self, color: str) -> None:
         """
@@ -360,28 +345,26 @@ class MapFeatures:
             self.handler.assertHeatmapColor(color)
 
         # We load the file here.
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        # Change the color.
-        data["heatmap_color"] = color
+            # Change the color.
+            data["heatmap_color"] = color
 
-        # Dump it back.
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            # Dump it back.
+            self.storage.saveMapFeatures(data)
 
     def resetHeatmapColorPalette(self):
         """
         Method that resets the color palette back to the default value, which is "magma".
         """
 
-        with open(self.FEATURES_FILE, 'r') as f:
-            data = json.load(f)
+        with self.storage.lock:
+            data = self.storage.loadMapFeatures()
 
-        data["heatmap_color"] = "magma"
+            data["heatmap_color"] = "magma"
 
-        with open(self.FEATURES_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+            self.storage.saveMapFeatures(data)
 
     def cleanMap(self) -> None:
         """
@@ -398,10 +381,6 @@ class MapFeatures:
         Helper method that returns current value of type checking flag and enforces it in all map features methods.
         """
 
-        # Load the file.
-        with open(self.CONFIG_FILE, 'r') as f:
-            config = json.load(f)
-
-        # We cannot access getConfig method in map_features so we need to manually check if the value is True or False.
-        value = config.get("map_features_type_checking", "False")
-        return value.lower() == "true"
+        # Config comes back already typed, so the flag is a real boolean.
+        config = self.storage.loadConfig()
+        return config.get("map_features_type_checking", False)
@@ -0,0 +1,327 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+# Not available on Windows, peak RSS is then not reported.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class MetricsRegistry:
+    """
+    Class that keeps cumulative metrics of a mapper for the whole life of the process: counters, gauges and
+    histograms, optionally split by labels. The pipeline updates them on every call, whether instrumentation is
+    enabled or not, since updating a metric only costs a dictionary update.
+
+    Metrics are exported on demand (getMetrics, exportPrometheus) or written to a file on an interval (startExport),
+    in Prometheus text format (e.g. for node_exporter's textfile collector) or as JSON.
+    """
+
+    # Upper bounds of latency histogram buckets, in seconds.
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    # (name, type, help) of metrics updated by the pipeline.
+    STANDARD_METRICS = (
+        ("ibex_mapper_basis_cache_hits_total", "counter",
+         "Basis requests served from the in-memory basis."),
+        ("ibex_mapper_basis_cache_misses_total", "counter",
+         "Basis requests that loaded the basis from the disk cache or computed it (source label)."),
+        ("ibex_mapper_bytes_loaded_total", "counter",
+         "Bytes loaded from disk, by kind (basis, coefficients)."),
+        ("ibex_mapper_maps_rendered_total", "counter",
+         "Maps drawn, by output format."),
+        ("ibex_mapper_stage_seconds", "histogram",
+         "Wall time of pipeline stages and top-level calls, by stage."),
+        ("ibex_mapper_interpolation_nan_total", "counter",
+         "Pixels left without a value (NaN) by the rotation interpolation."),
+        ("ibex_mapper_interpolated_pixels_total", "counter",
+         "Pixels resampled by the rotation interpolation."),
+        ("ibex_mapper_peak_rss_bytes", "gauge",
+         "Peak resident set size of the process."),
+        ("ibex_mapper_uptime_seconds", "gauge",
+         "Seconds since the registry was created."),
+    )
+
+    def __init__(self):
+        # {name: {"type", "help", "values": {labels: value}}}, where labels is a sorted tuple of (label, value) pairs
+        # and the value of a histogram is [bucket counts..., sum, count].
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+        # Functions called before every export, to refresh metrics that are read rather than counted.
+        self.collectors = [self.collectProcessMetrics]
+
+        # Background export, see startExport.
+        self.export_thread = None
+        self.export_stop = None
+        self.export_target = None
+
+        for name, metric_type, help_text in self.STANDARD_METRICS:
+            self.declare(name, metric_type, help_text)
+
+    def declare(self, name: str, metric_type: str, help_text: str) -> None:
+        """
+        Method that registers a metric. Registering an existing metric again keeps its values.
+
+        :param name:
+        Prometheus metric name.
+
+        :param metric_type:
+        "counter", "gauge" or "histogram" (with DEFAULT_BUCKETS).
+
+        :param help_text:
+        Description exported with the metric.
+        """
+
+        if metric_type not in ("counter", "gauge", "histogram"):
+            raise ValueError(f"Invalid metric type '{metric_type}'. Must be 'counter', 'gauge' or 'histogram'.")
+
+        with self.lock:
+            self.metrics.setdefault(name, {"type": metric_type, "help": help_text, "values": {}})
+
+    def addCollector(self, collector) -> None:
+        """
+        Method that adds a function without arguments, called before every export to refresh metrics
+        (for example from statistics kept elsewhere).
+        """
+
+        self.collectors.append(collector)
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        labels = tuple(sorted(labels.items()))
+
+        with self.lock:
+            values = self.getMetric(name)["values"]
+            values[labels] = values.get(labels, 0) + value
+
+    def setValue(self, name: str, value: float, **labels) -> None:
+        # Sets a gauge, or a counter that is counted elsewhere (see addCollector).
+        labels = tuple(sorted(labels.items()))
+
+        with self.lock:
+            self.getMetric(name)["values"][labels] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        labels = tuple(sorted(labels.items()))
+
+        with self.lock:
+            values = self.getMetric(name)["values"]
+
+            if labels not in values:
+                values[labels] = [0] * (len(self.DEFAULT_BUCKETS) + 2)
+
+            counts = values[labels]
+
+            # Counts are stored per bucket and accumulated on export.
+            for i, bound in enumerate(self.DEFAULT_BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+
+            counts[-2] += value
+            counts[-1] += 1
+
+    def timer(self, name: str, **labels) -> "_Timer":
+        """
+        Method that returns a context manager observing the wall time of the code inside it in a histogram.
+        """
+
+        return _Timer(self, name, labels)
+
+    def getMetric(self, name: str) -> dict:
+        metric = self.metrics.get(name)
+
+        if metric is None:
+            raise KeyError(f"Unknown metric '{name}'. Declare it first.")
+
+        return metric
+
+    def collect(self) -> None:
+        for collector in self.collectors:
+            collector()
+
+    def collectProcessMetrics(self) -> None:
+        self.setValue("ibex_mapper_uptime_seconds", time.time() - self.start_time)
+
+        if resource is not None:
+            # Kilobytes on Linux, bytes on macOS.
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.setValue("ibex_mapper_peak_rss_bytes", peak_rss if sys.platform == "darwin" else peak_rss * 1024)
+
+    def getMetrics(self) -> dict:
+        """
+        :return:
+        Returns {"timestamp", "metrics": {name: {"type", "help", "samples": [...]}}}. A sample is
+        {"labels", "value"}, or {"labels", "buckets": {upper bound: cumulative count}, "sum", "count"} for
+        a histogram.
+        """
+
+        self.collect()
+
+        metrics = {}
+
+        with self.lock:
+            for name, metric in self.metrics.items():
+                samples = []
+
+                for labels, value in metric["values"].items():
+                    if metric["type"] == "histogram":
+                        samples.append({"labels": dict(labels), "buckets": self.getCumulativeBuckets(value),
+                                        "sum": value[-2], "count": value[-1]})
+                    else:
+                        samples.append({"labels": dict(labels), "value": value})
+
+                metrics[name] = {"type": metric["type"], "help": metric["help"], "samples": samples}
+
+        return {"timestamp": time.time(), "metrics": metrics}
+
+    def getCumulativeBuckets(self, counts: list) -> dict:
+        buckets = {}
+        total = 0
+
+        for bound, count in zip(self.DEFAULT_BUCKETS, counts):
+            total += count
+            buckets[self.formatNumber(bound)] = total
+
+        buckets["+Inf"] = counts[-1]
+
+        return buckets
+
+    def exportPrometheus(self) -> str:
+        """
+        :return:
+        Returns all metrics in Prometheus text exposition format.
+        """
+
+        lines = []
+
+        for name, metric in self.getMetrics()["metrics"].items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+
+            for sample in metric["samples"]:
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{self.formatLabels(sample['labels'])} {self.formatNumber(sample['value'])}")
+                    continue
+
+                for bound, count in sample["buckets"].items():
+                    labels = self.formatLabels(dict(sample["labels"], le=bound))
+                    lines.append(f"{name}_bucket{labels} {count}")
+
+                labels = self.formatLabels(sample["labels"])
+                lines.append(f"{name}_sum{labels} {self.formatNumber(sample['sum'])}")
+                lines.append(f"{name}_count{labels} {sample['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def formatLabels(labels: dict) -> str:
+        if not labels:
+            return ""
+
+        escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+                   for value in labels.values())
+
+        return "{" + ",".join(f"{label}=\"{value}\"" for label, value in zip(labels, escaped)) + "}"
+
+    @staticmethod
+    def formatNumber(value: float) -> str:
+        if isinstance(value, float) and math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+
+        return repr(value) if isinstance(value, float) else str(value)
+
+    def writeFile(self, file_path: str, file_format: str or None = None) -> None:
+        """
+        Method that writes all metrics to a file. The file is replaced atomically, so a collector reading it
+        never sees a half-written file.
+
+        :param file_path:
+        Output file.
+
+        :param file_format:
+        "prometheus" or "json". Defaults to "json" for .json files and "prometheus" otherwise.
+        """
+
+        if file_format is None:
+            file_format = "json" if str(file_path).endswith(".json") else "prometheus"
+
+        if file_format == "json":
+            contents = json.dumps(self.getMetrics(), indent=4)
+        elif file_format == "prometheus":
+            contents = self.exportPrometheus()
+        else:
+            raise ValueError(f"Invalid metrics format '{file_format}'. Must be 'prometheus' or 'json'.")
+
+        directory = os.path.dirname(os.path.abspath(file_path))
+        os.makedirs(directory, exist_ok=True)
+
+        temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(contents)
+        os.replace(temporary_path, file_path)
+
+    def startExport(self, file_path: str, interval: float = 15.0, file_format: str or None = None) -> None:
+        """
+        Method that writes metrics to a file every interval seconds on a background thread, until stopExport
+        is called. A previous export is stopped first.
+        """
+
+        if interval <= 0:
+            raise ValueError("Metrics export interval must be positive.")
+
+        self.stopExport()
+
+        stop = threading.Event()
+
+        def export():
+            while not stop.wait(interval):
+                self.writeFile(file_path, file_format)
+
+        self.writeFile(file_path, file_format)
+
+        # The last state is also written when the export stops.
+        self.export_target = (file_path, file_format)
+        self.export_stop = stop
+        self.export_thread = threading.Thread(target=export, name="ibex-mapper-metrics", daemon=True)
+        self.export_thread.start()
+
+    def stopExport(self) -> None:
+        if self.export_thread is None:
+            return
+
+        self.export_stop.set()
+        self.export_thread.join()
+        self.export_thread = None
+        self.export_stop = None
+
+        self.writeFile(*self.export_target)
+
+    def reset(self) -> None:
+        with self.lock:
+            for metric in self.metrics.values():
+                metric["values"].clear()
+
+
+class _Timer:
+    # Plain class instead of a generator context manager, since it wraps every pipeline stage.
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry: MetricsRegistry, name: str, labels: dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
@@ -0,0 +1,278 @@
+import os
+import shutil
+from .calculator import Calculator
+from .threads import ThreadController
+
+
+class ResourcePlanner:
+    """
+    Class that predicts the peak memory, disk cache size and runtime of a map for a config, for every basis engine,
+    and picks the engine that fits into the memory budget:
+    - "full": the basis is calculated at once (SciPy returns all complex (l, m) harmonics in one array, which is
+      about (2L + 1) / (L + 1) times bigger than the real basis) and held in memory,
+    - "chunked": the basis is calculated in latitude bands straight into the cache file, memory mapped and summed
+      band by band, so only one band per worker is held in memory at a time.
+    Both engines calculate the basis on "basis_workers" threads, one latitude band each at a time.
+
+    Predictions come from a simple cost model (array sizes are exact, per element times were measured on one core
+    of a typical x86 machine), so runtimes are rough, within about a factor of two.
+    """
+
+    ENGINES = ("full", "chunked")
+
+    # Seconds per element of the main operations.
+    HARMONICS_SECONDS = 70e-9  # sph_harm_y_all, per pixel and (l, m) pair of the (L + 1, 2L + 1) output
+    FILTER_SECONDS = 20e-9  # transform to real harmonics, per pixel and basis function
+    SYNTHESIS_SECONDS = 1e-9  # tensor dot product, per pixel and basis function
+    ROTATION_SECONDS = 250e-9  # rotated grid and linear interpolation, per pixel
+    RENDER_SECONDS = 5e-6  # pcolormesh and PDF, per pixel
+    RENDER_OVERHEAD_SECONDS = 0.3
+    DISK_BYTES_PER_SECOND = 1e9
+
+    # Bytes held per pixel by the rotate stage (grids, cartesian coordinates, interpolator) and by rendering.
+    ROTATION_BYTES_PER_PIXEL = 160
+    RENDER_BYTES_PER_PIXEL = 400
+    RENDER_OVERHEAD_BYTES = 60 * 1024 * 1024
+
+    # Bigger bands of the chunked engine are not faster, only use more memory.
+    MAX_BAND_BYTES = 256 * 1024 * 1024
+
+    # Part of the physical memory used as the budget when the config sets none (memory_budget_mb = 0).
+    DEFAULT_BUDGET_FRACTION = 0.8
+
+    def __init__(self, cache_dir: str):
+        """
+        :param cache_dir:
+        Folder of the basis cache, whose free disk space is reported.
+        """
+
+        self.cache_dir = cache_dir
+
+    def estimateCost(self, config: dict, render: bool = True) -> dict:
+        """
+        Method that predicts the cost of one map for the config.
+
+        :param config:
+        Config with "map_accuracy", "max_l_to_cache", "rotate" and optionally "memory_budget_mb", "basis_engine",
+        "basis_workers", "threads" and "precision".
+
+        :param render:
+        Whether the map is also rendered. If not, the peak memory (and so the engine that fits) only covers the
+        basis, synthesis and rotation, as for computeHeatmap.
+
+        :return:
+        Returns {"dpi", "max_l", "rotate", "precision", "basis_bytes", "cache_bytes", "disk_free_bytes",
+        "memory_budget_bytes", "render_memory_bytes", "basis_workers", "threads", "blas_control",
+        "engines": {engine: {"peak_memory_bytes", "band_size", "basis_seconds", "load_seconds", "synthesis_seconds",
+        "rotation_seconds", "render_seconds", "cold_seconds", "warm_seconds", "fits"}}, "selected_engine", "refusal"},
+        where "cold_seconds" is a map with an empty basis cache and "warm_seconds" one with the basis on disk.
+        "selected_engine" is None and "refusal" says why if no allowed engine fits into the budget.
+        """
+
+        dpi, max_l = config["map_accuracy"], config["max_l_to_cache"]
+        budget = self.getMemoryBudget(config)
+        workers = self.getBasisWorkers(config)
+        threads = ThreadController.resolveThreads(config.get("threads", 0))
+        cores = ThreadController.getAvailableCores()
+        precision = config.get("precision", "float64")
+        itemsize = self.getItemSize(config)
+
+        pixels = dpi * dpi
+        basis_functions = (max_l + 1) ** 2
+        harmonics = (max_l + 1) * (2 * max_l + 1)
+        basis_bytes = itemsize * basis_functions * pixels
+
+        # Stages after synthesis are the same for every engine. Interpolation runs in pixel blocks on threads.
+        rotation_seconds = self.ROTATION_SECONDS * pixels / min(threads, cores) if config["rotate"] else 0.0
+        render_seconds = self.RENDER_OVERHEAD_SECONDS + self.RENDER_SECONDS * pixels
+        after_synthesis_bytes = self.getStageBytes(config)
+        render_bytes = self.RENDER_OVERHEAD_BYTES + self.RENDER_BYTES_PER_PIXEL * pixels
+
+        # Bands are independent, so basis calculation scales with the cores that run the workers.
+        basis_seconds = ((self.HARMONICS_SECONDS * harmonics + self.FILTER_SECONDS * basis_functions) * pixels
+                         / min(workers, cores))
+        write_seconds = basis_bytes / self.DISK_BYTES_PER_SECOND
+        # float32 halves the bytes read per element, and doubles the elements per vector instruction.
+        synthesis_element_seconds = self.SYNTHESIS_SECONDS * itemsize / 8
+        synthesis_seconds = synthesis_element_seconds * basis_functions * pixels / min(threads, cores)
+
+        engines = {}
+
+        # Full engine: the complex harmonics and the growing list of real ones coexist, then the list and its
+        # stacked copy (bands of several workers or of a float32 basis are written straight into the basis instead).
+        # The basis stays in memory for later stages.
+        if workers > 1 or precision != "float64":
+            build_peak = 16 * harmonics * dpi * -(-dpi // workers) * min(workers, dpi) + basis_bytes
+        else:
+            build_peak = max(16 * harmonics * pixels + basis_bytes, 2 * basis_bytes)
+
+        # Synthesis of a sparse file gathers the used basis functions, a few rows per thread (at most half the basis).
+        gather_bytes = min(threads * Calculator.GATHER_BYTES, basis_bytes // 2)
+        full_peak = max(build_peak, basis_bytes + after_synthesis_bytes + gather_bytes)
+
+        if render:
+            full_peak = max(full_peak, basis_bytes + render_bytes)
+
+        engines["full"] = self.buildEstimate(full_peak, None, basis_seconds + write_seconds,
+                                             basis_bytes / self.DISK_BYTES_PER_SECOND, synthesis_seconds,
+                                             rotation_seconds, render_seconds, budget)
+
+        # Chunked engine: one band of complex harmonics and real ones per worker, the basis is memory mapped.
+        band_size = self.getBandSize(config, budget, workers)
+        band_peak = (16 * harmonics + 16 * basis_functions) * dpi * band_size * min(workers, -(-dpi // band_size))
+        chunked_peak = max(band_peak + after_synthesis_bytes, render_bytes) if render else \
+            band_peak + after_synthesis_bytes
+        # Synthesis reads the mapped basis from the page cache or disk, band by band on one thread.
+        engines["chunked"] = self.buildEstimate(chunked_peak, band_size, basis_seconds + write_seconds, 0.0,
+                                                1.5 * synthesis_element_seconds * basis_functions * pixels
+                                                + basis_bytes / self.DISK_BYTES_PER_SECOND,
+                                                rotation_seconds, render_seconds, budget)
+
+        estimate = {
+            "dpi": dpi,
+            "max_l": max_l,
+            "rotate": config["rotate"],
+            "precision": precision,
+            "basis_bytes": basis_bytes,
+            # .npy header included.
+            "cache_bytes": basis_bytes + 128,
+            "disk_free_bytes": self.getFreeDiskSpace(),
+            "memory_budget_bytes": budget,
+            "render_memory_bytes": render_bytes,
+            "basis_workers": workers,
+            "threads": threads,
+            # False if threads do not limit BLAS (threadpoolctl is not installed).
+            "blas_control": ThreadController.hasLibraryControl(),
+            "engines": engines,
+            "selected_engine": None,
+            "refusal": None
+        }
+
+        allowed = self.getAllowedEngines(config)
+        fitting = [engine for engine in allowed if engines[engine]["fits"]]
+
+        if fitting:
+            estimate["selected_engine"] = fitting[0]
+        else:
+            estimate["refusal"] = (
+                f"Map with dpi {dpi} and L {max_l} needs about "
+                f"{min(engines[engine]['peak_memory_bytes'] for engine in allowed) / 1024 ** 2:.0f} MB "
+                f"with engine {' or '.join(allowed)}, over the memory budget of {budget / 1024 ** 2:.0f} MB. "
+                f"Lower map_accuracy or max_l_to_cache, or raise memory_budget_mb"
+                + (", or set basis_engine to 'auto'." if len(allowed) == 1 else "."))
+
+        return estimate
+
+    def selectEngine(self, config: dict) -> tuple[str, int or None, int]:
+        """
+        Method that picks the basis engine for the config: the one set by "basis_engine", or with "auto" the full
+        engine if it fits into the memory budget, otherwise the chunked one. Called by the synthesize stage, so
+        only the basis, synthesis and rotation count, rendering is a separate step that may never happen.
+
+        :return:
+        Returns (engine, band size, basis workers), band size is None for the full engine.
+        Raises MemoryError if no allowed engine fits into the budget, before anything is allocated.
+        """
+
+        estimate = self.estimateCost(config, render=False)
+
+        if estimate["selected_engine"] is None:
+            raise MemoryError(estimate["refusal"])
+
+        engine = estimate["selected_engine"]
+
+        return engine, estimate["engines"][engine]["band_size"], estimate["basis_workers"]
+
+    def getBandSize(self, config: dict, budget: int or None, workers: int = 1) -> int:
+        """
+        :return:
+        Returns the most colatitude columns per band of the chunked engine whose intermediate results (of all
+        workers) fit into the memory budget left after the other stages, and into MAX_BAND_BYTES per worker.
+        """
+
+        dpi, max_l = config["map_accuracy"], config["max_l_to_cache"]
+
+        column_bytes = (16 * (max_l + 1) * (2 * max_l + 1) + 16 * (max_l + 1) ** 2) * dpi
+        available = self.MAX_BAND_BYTES
+
+        if budget is not None:
+            available = min(available, (budget - self.getStageBytes(config)) // workers)
+
+        return max(1, min(dpi, available // column_bytes))
+
+    def getStageBytes(self, config: dict) -> int:
+        # Bytes held by the heatmap and, if the config rotates, the rotate stage.
+        pixels = config["map_accuracy"] ** 2
+        rotation_bytes = self.ROTATION_BYTES_PER_PIXEL * pixels if config["rotate"] else 0
+        return 3 * self.getItemSize(config) * pixels + rotation_bytes
+
+    @staticmethod
+    def getItemSize(config: dict) -> int:
+        # Bytes per element of the basis and the heatmap.
+        return 4 if config.get("precision", "float64") == "float32" else 8
+
+    def getMemoryBudget(self, config: dict) -> int or None:
+        """
+        :return:
+        Returns the memory budget in bytes: "memory_budget_mb" of the config, or DEFAULT_BUDGET_FRACTION of
+        the physical memory if it is 0 or missing, or None (no budget) if the physical memory is unknown.
+        """
+
+        budget_mb = config.get("memory_budget_mb", 0)
+
+        if budget_mb > 0:
+            return budget_mb * 1024 * 1024
+
+        physical_memory = self.getPhysicalMemory()
+
+        return int(physical_memory * self.DEFAULT_BUDGET_FRACTION) if physical_memory else None
+
+    @staticmethod
+    def getBasisWorkers(config: dict) -> int:
+        # 0 (default) means as many workers as the "threads" setting.
+        workers = config.get("basis_workers", 0)
+        return workers if workers > 0 else ThreadController.resolveThreads(config.get("threads", 0))
+
+    @staticmethod
+    def getAllowedEngines(config: dict) -> list:
+        engine = config.get("basis_engine", "auto")
+        return list(ResourcePlanner.ENGINES) if engine == "auto" else [engine]
+
+    @staticmethod
+    def getPhysicalMemory() -> int or None:
+        # Available on Linux and macOS.
+        try:
+            return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    def getFreeDiskSpace(self) -> int or None:
+        # The cache folder may not exist yet, its closest existing parent is on the same disk.
+        path = os.path.abspath(self.cache_dir)
+
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+
+        try:
+            return shutil.disk_usage(path).free
+        except OSError:
+            return None
+
+    @staticmethod
+    def buildEstimate(peak_memory: int, band_size: int or None, basis_seconds: float, load_seconds: float,
+                      synthesis_seconds: float, rotation_seconds: float, render_seconds: float,
+                      budget: int or None) -> dict:
+        after_basis_seconds = synthesis_seconds + rotation_seconds + render_seconds
+
+        return {
+            "peak_memory_bytes": int(peak_memory),
+            "band_size": band_size,
+            "basis_seconds": basis_seconds,
+            "load_seconds": load_seconds,
+            "synthesis_seconds": synthesis_seconds,
+            "rotation_seconds": rotation_seconds,
+            "render_seconds": render_seconds,
+            "cold_seconds": basis_seconds + after_basis_seconds,
+            "warm_seconds": load_seconds + after_basis_seconds,
+            "fits": budget is None or peak_memory <= budget
+        }
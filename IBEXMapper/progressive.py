@@ -0,0 +1,201 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+
+
+class ProgressiveRenderer:
+    """
+    Class that computes a map in two steps, for interactive use:
+    - a preview with coefficients truncated to a low max l, synthesized at a low dpi, which is returned right away
+      (its basis is tiny, so it is calculated once and then kept in memory next to the full one, see Handler),
+    - the map at the configured map_accuracy and max_l_to_cache, refined on a background thread.
+    The caller gets a ProgressiveMap handle with the preview, that can be polled or awaited for the refined map.
+    Both maps go through the usual memoized stages, so refining a map that was already computed is instant.
+    """
+
+    # Preview resolution and max l, when not given.
+    PREVIEW_ACCURACY = 100
+    PREVIEW_MAX_L = 10
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+
+        # One background thread, so refinements run in the order they were requested and leave the other cores to
+        # the threads of the map itself (see ThreadController). Created on first use and shut down by close().
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    def getExecutor(self) -> ThreadPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ibex-refine")
+
+            return self.executor
+
+    def computeProgressive(self, source, config: dict or None = None, output_path: str or None = None,
+                           render: bool = False, preview_accuracy: int or None = None,
+                           preview_max_l: int or None = None) -> "ProgressiveMap":
+        """
+        Method that computes (and optionally renders) the preview of a map, and starts refining it in the background.
+
+        :param source:
+        Path to the .txt file with coefficients, or an already loaded coefficient array (see computeHeatmap).
+
+        :param config:
+        Config of the refined map. Defaults to the default config.
+
+        :param output_path:
+        Folder for PDF files, if rendered. Defaults to the output folder.
+
+        :param render:
+        Whether to save the preview and the refined map as PDF (never shown). Both are named after the source, the
+        preview with a "_preview" suffix, so they do not overwrite each other (even at the same dpi).
+
+        :param preview_accuracy:
+        Dpi of the preview, at most the map_accuracy of config. Defaults to PREVIEW_ACCURACY.
+
+        :param preview_max_l:
+        Coefficients with a higher l are left out of the preview, at most the max_l_to_cache of config.
+        Defaults to PREVIEW_MAX_L.
+
+        :return:
+        Returns a ProgressiveMap, whose preview is ready.
+        """
+
+        if config is None:
+            config = self.mapper.getDefaultConfig()
+
+        preview_accuracy = self.PREVIEW_ACCURACY if preview_accuracy is None else preview_accuracy
+        preview_max_l = self.PREVIEW_MAX_L if preview_max_l is None else preview_max_l
+
+        if preview_accuracy < 1 or preview_max_l < 0:
+            raise ValueError("Preview accuracy must be positive and preview max l non-negative.")
+
+        with self.mapper.instrumentation.call("computeHeatmapProgressive"):
+            imported_data, coefficients_key = self.mapper.parseCoefficients(source)
+            source_name = str(source) if isinstance(source, (str, os.PathLike)) else None
+
+            # The preview config differs only in resolution and max l, it is never wider than the refined map.
+            preview_config = dict(config)
+            preview_config["map_accuracy"] = min(preview_accuracy, config["map_accuracy"])
+            preview_config["max_l_to_cache"] = min(preview_max_l, config["max_l_to_cache"])
+
+            # Truncating the coefficients is exact for the degrees that are kept, the preview just lacks detail.
+            kept = imported_data[:, 0] <= preview_config["max_l_to_cache"]
+            preview_data = imported_data[kept]
+
+            if preview_data.shape[0] == 0:
+                # Every coefficient is above the preview max l, so the preview is flat zero.
+                preview_data = np.zeros((1, imported_data.shape[1]))
+
+            preview_key = self.mapper.stage_cache.hashKey(coefficients_key, "preview",
+                                                          preview_config["max_l_to_cache"])
+
+            preview = self.mapper.computeParsedHeatmap(preview_data, preview_key, preview_config, source_name)
+            # Named like the refined map (file name with its extension) plus a suffix, so both sort together.
+            preview_name = os.path.basename(source_name or "heatmap") + "_preview"
+            preview_output = self.mapper.renderHeatmap(preview, output_path, preview_name, False) if render else None
+
+        if preview_config["map_accuracy"] == config["map_accuracy"] and kept.all():
+            # Nothing to refine, the preview is already the full map.
+            future = Future()
+            future.set_result((preview, preview_output))
+        else:
+            future = self.getExecutor().submit(self.refine, imported_data, coefficients_key, config, source_name,
+                                               output_path, render)
+
+        return ProgressiveMap(preview, preview_output, future)
+
+    def refine(self, imported_data, coefficients_key: str, config: dict, source_name: str or None,
+               output_path: str or None, render: bool) -> tuple[dict, str or None]:
+        # Background step of computeProgressive: the full map, and its PDF if rendered.
+        heatmap = self.mapper.computeParsedHeatmap(imported_data, coefficients_key, config, source_name)
+        output = self.mapper.renderHeatmap(heatmap, output_path, None, False) if render else None
+
+        return heatmap, output
+
+    def close(self) -> None:
+        """
+        Method that shuts the background thread down, after the refinements already requested finish.
+        A later call starts a new thread.
+        """
+
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+
+class ProgressiveMap:
+    """
+    Handle of a map computed by ProgressiveRenderer. The preview is available right away, the refined map once
+    the background step finishes: poll it with done(), block on result(), or await the handle from asyncio code.
+    """
+
+    def __init__(self, preview: dict, preview_output: str or None, future: Future):
+        """
+        :param preview:
+        Result dictionary of computeHeatmap for the preview.
+
+        :param preview_output:
+        Path of the saved preview PDF, or None if not rendered.
+
+        :param future:
+        Future of the background step, resolving to (refined result dictionary, refined PDF path or None).
+        """
+
+        self.preview = preview
+        self.preview_output = preview_output
+        self.future = future
+
+    def done(self) -> bool:
+        # True once the refined map is ready, failed or the refinement was cancelled.
+        return self.future.done()
+
+    def cancel(self) -> bool:
+        """
+        Method that cancels the refinement, if it has not started yet (e.g. it waits for an earlier one).
+
+        :return:
+        Returns True if it was cancelled.
+        """
+
+        return self.future.cancel()
+
+    def cancelled(self) -> bool:
+        return self.future.cancelled()
+
+    def result(self, timeout: float or None = None) -> dict:
+        """
+        Method that waits for the refined map.
+
+        :param timeout:
+        Seconds to wait, None waits until it is ready. Raises TimeoutError if it is not ready in time.
+
+        :return:
+        Returns the result dictionary of computeHeatmap for the refined map.
+        Raises the error of the refinement if it failed, and CancelledError if it was cancelled.
+        """
+
+        return self.future.result(timeout)[0]
+
+    def output(self, timeout: float or None = None) -> str or None:
+        """
+        Method that waits for the refined map like result.
+
+        :return:
+        Returns the path of the refined PDF, or None if maps are not rendered.
+        """
+
+        return self.future.result(timeout)[1]
+
+    def addDoneCallback(self, callback) -> None:
+        # Calls callback(handle) once the refinement is done, from the background thread (or right away if done).
+        self.future.add_done_callback(lambda _: callback(self))
+
+    def __await__(self):
+        # The event loop is not blocked while the refinement runs. Awaiting gives the refined result dictionary.
+        heatmap, _ = yield from asyncio.wrap_future(self.future).__await__()
+        return heatmap
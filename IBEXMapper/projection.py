@@ -1,13 +1,22 @@
-from matplotlib.axes import Axes
-from matplotlib.colors import Colormap
-import matplotlib.pyplot as plt
+from __future__ import annotations
+from typing import TYPE_CHECKING
 import numpy as np
-from matplotlib.colors import LinearSegmentedColormap
 from .configurator import Configurator
 from .calculator import Calculator
 from .handler import Handler
-from matplotlib.offsetbox import AnchoredText
+from .storage import Storage
+from .instrumentation import Instrumentation
 import os
+import threading
+
+# Palette files shipped with the app, resolved against the repository, not the current working directory.
+PUBLIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "public")
+
+# Matplotlib is only imported for type hints here. Real imports happen on first projection,
+# so importing the package does not pay the matplotlib startup cost.
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.colors import Colormap
 
 
 class Projection:
@@ -16,18 +25,21 @@ class Projection:
 
     This class provides functionality to create Mollweide projections of data,
     rotate coordinates, draw graticule, and visualize points of interest on maps.
+    Rendering goes through matplotlib's object-oriented Figure API (not pyplot's global state), so one instance
+    can render several maps at once from different threads.
     """
 
-    CONFIG_DIR = "config"
-    FEATURES_DIR = "map_features"
-    CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
-    FEATURES_FILE = os.path.join(FEATURES_DIR, "map_features.json")
-    OUTPUT_DIR = "output"
-
-    def __init__(self, calculator: Calculator, configurator: Configurator, handler: Handler):
+    def __init__(self, calculator: Calculator, configurator: Configurator, handler: Handler, storage: Storage,
+                 instrumentation: Instrumentation or None = None):
         self.calculator = calculator
         self.configurator = configurator
         self.handler = handler
+        self.storage = storage
+        self.instrumentation = instrumentation if instrumentation is not None else calculator.instrumentation
+
+        # Colormaps loaded from the public folder, {palette name: colormap}. Loaded once per instance.
+        self.colormaps = {}
+        self.colormaps_lock = threading.Lock()
 
     def projectDataOnMollweideProjection(self,
                                          heatmap_data: np.ndarray,
@@ -36,7 +48,8 @@ class Projection:
                                          rotate: bool,
                                          central_coords: np.ndarray,
                                          meridian_coords: np.ndarray,
-                                         output_path: str or None) -> None:
+                                         output_path: str or None,
+                                         show: bool = True) -> str:
         """
         Create a Mollweide projection map with the given data and parameters.
 
@@ -61,64 +74,217 @@ class Projection:
         :param output_path:
         Path to save the map to, defaults to the output directory.
 
+        :param show:
+        Whether to display the map in a window after saving. Only a shown map goes through pyplot,
+        so use False when rendering from worker threads.
+
+        :return:
+        Returns the path of the saved PDF file.
+        """
+
+        # Overlays of an unrotated map are drawn as they are, so the rotation is only built when needed.
+        if rotate:
+            final_rotation = self.configurator.buildFinalRotation(central_coords, meridian_coords)
+        else:
+            final_rotation = np.eye(3)
+
+        return self.drawMollweideMap(heatmap_data, dpi, filename, rotate, final_rotation, output_path, show)
+
+    def renderHeatmap(self, heatmap: dict, output_path: str or None, file_name: str or None = None,
+                      show: bool = True) -> str:
+        """
+        Draw a heatmap returned by IBEXMapper.computeHeatmap, reusing the rotation it was computed with.
+
+        :param heatmap:
+        Dictionary returned by IBEXMapper.computeHeatmap
+
+        :param output_path:
+        Path to save the map to, defaults to the output directory.
+
+        :param file_name:
+        Name used for the PDF file, defaults to the source file name (or "heatmap")
+
+        :param show:
+        Whether to display the map in a window after saving
+
+        :return:
+        Returns the path of the saved PDF file.
+        """
+
+        if file_name is None:
+            file_name = heatmap["source"] or "heatmap"
+
+        return self.drawMollweideMap(heatmap["heatmap"], heatmap["dpi"], file_name, heatmap["rotate"],
+                                     heatmap["rotation"], output_path, show)
+
+    def drawMollweideMap(self,
+                         heatmap_data: np.ndarray,
+                         dpi: int,
+                         filename: str,
+                         rotate: bool,
+                         final_rotation: np.ndarray,
+                         output_path: str or None,
+                         show: bool = True) -> str:
+        """
+        Draw the heatmap with graticule and map features on a Mollweide projection and save it.
+
+        :param heatmap_data:
+        2D array of data values to be plotted
+
+        :param dpi:
+        Resolution of the map (number of points in each dimension)
+
+        :param filename:
+        Name of the file to save the map to
+
+        :param rotate:
+        Whether the map is rotated
+
+        :param final_rotation:
+        3x3 rotation matrix the map was rotated with (identity if not rotated)
+
+        :param output_path:
+        Path to save the map to, defaults to the output directory.
+
+        :param show:
+        Whether to display the map in a window after saving
+
         :return:
-        The map is saved to a file and displayed
+        Returns the path of the saved PDF file.
         """
 
         filename = os.path.basename(filename)
 
+        fig = self.buildMollweideFigure(heatmap_data, dpi, rotate, final_rotation, show)
+
+        # If no output path is selected, it chooses the default directory, otherwise it selects chose one
+        output_file_path = self.getOutputFilePath(filename, dpi, output_path)
+        with self.instrumentation.span("save"):
+            fig.savefig(output_file_path, format='pdf', dpi=dpi)
+
+        if show:
+            import matplotlib.pyplot as plt
+            plt.show()
+
+        return output_file_path
+
+    def renderHeatmapToBytes(self, heatmap: dict, file_format: str = "pdf") -> bytes:
+        """
+        Draw a heatmap returned by IBEXMapper.computeHeatmap into memory instead of a file.
+
+        :param heatmap:
+        Dictionary returned by IBEXMapper.computeHeatmap
+
+        :param file_format:
+        Any format matplotlib can save, e.g. "pdf", "png" or "svg"
+
+        :return:
+        Returns the contents of the image file.
+        """
+
+        import io
+
+        fig = self.buildMollweideFigure(heatmap["heatmap"], heatmap["dpi"], heatmap["rotate"], heatmap["rotation"],
+                                        False)
+
+        buffer = io.BytesIO()
+        with self.instrumentation.span("save"):
+            fig.savefig(buffer, format=file_format, dpi=heatmap["dpi"])
+
+        return buffer.getvalue()
+
+    def buildMollweideFigure(self,
+                             heatmap_data: np.ndarray,
+                             dpi: int,
+                             rotate: bool,
+                             final_rotation: np.ndarray,
+                             pyplot: bool = False):
+        """
+        Build the figure of a map: heatmap, graticule and map features on a Mollweide projection.
+
+        :param heatmap_data:
+        2D array of data values to be plotted
+
+        :param dpi:
+        Resolution of the map (number of points in each dimension)
+
+        :param rotate:
+        Whether the map is rotated
+
+        :param final_rotation:
+        3x3 rotation matrix the map was rotated with (identity if not rotated)
+
+        :param pyplot:
+        Whether to create the figure through pyplot (needed to show it), instead of a standalone Figure
+
+        :return:
+        Returns the matplotlib figure, ready to be saved.
+        """
+
         heatmap_data = self.changeMapScale(heatmap_data)
 
         lon = np.linspace(-np.pi, np.pi, dpi)
         lat = np.linspace(np.pi / 2, -np.pi / 2, dpi)
         lon, lat = np.meshgrid(lon, lat)
 
-        fig = plt.figure(figsize=(8, 5))
-        ax = fig.add_subplot(111, projection="mollweide")
-
-        rotation1 = self.configurator.buildCenteringRotation(central_coords)
-        rotation2 = self.configurator.buildMeridianRotation(meridian_coords, rotation1)
-
-
-        final_rotation = np.array([])
-        
-        if np.allclose(central_coords, meridian_coords) or np.allclose(meridian_coords, [0.0, 0.0]):
-            final_rotation = rotation1
+        if pyplot:
+            import matplotlib.pyplot as plt
+            fig = plt.figure(figsize=(8, 5))
         else:
-            final_rotation = rotation2 @ rotation1
+            from matplotlib.figure import Figure
+            fig = Figure(figsize=(8, 5))
 
-        if rotate:
+        ax = fig.add_subplot(111, projection="mollweide")
+
+        with self.instrumentation.span("graticule"):
             self.drawGraticuleOnMap(ax, final_rotation)
-        else:
-            self.drawGraticuleOnMap(ax, np.eye(3))
 
-        plt.tight_layout()
+        fig.tight_layout()
         ax.set_xticks([])
         ax.set_yticks([])
         ax.tick_params(left=False, bottom=False, labelleft=False, labelbottom=False)
         ax.grid(False)
 
-        selected_cmap = self.getMapColorPaletteToProject()
+        with self.instrumentation.span("heatmap"):
+            selected_cmap = self.getMapColorPaletteToProject()
 
-        pcm = ax.pcolormesh(lon, lat, heatmap_data, cmap=selected_cmap, shading="auto",
-                            rasterized=True)
-        cbar = fig.colorbar(pcm, ax=ax, orientation="horizontal", pad=0.05)
-        cbar.set_label(r'ENA flux (cm$^{-2}$s$^{-1}$sr$^{-1}$keV$^{-1}$)', fontsize=16)
-        cbar.ax.tick_params(labelsize=16)
+            pcm = ax.pcolormesh(lon, lat, heatmap_data, cmap=selected_cmap, shading="auto",
+                                rasterized=True)
+            cbar = fig.colorbar(pcm, ax=ax, orientation="horizontal", pad=0.05)
+            cbar.set_label(r'ENA flux (cm$^{-2}$s$^{-1}$sr$^{-1}$keV$^{-1}$)', fontsize=16)
+            cbar.ax.tick_params(labelsize=16)
 
         # Adds Central and Meridian Point to the map
-        self.addPointsToMap(ax, rotate, final_rotation)
-        self.addCirclesToMap(ax, rotate, final_rotation)
-        self.addTextsToMap(ax)
-        self.drawSelectedCoordinatesAlongsideGraticule(ax, rotate, final_rotation)
+        with self.instrumentation.span("features"):
+            self.addPointsToMap(ax, rotate, final_rotation)
+            self.addCirclesToMap(ax, rotate, final_rotation)
+            self.addTextsToMap(ax)
+            self.drawSelectedCoordinatesAlongsideGraticule(ax, rotate, final_rotation)
 
-        # If no output path is selected, it chooses the default directory, otherwise it selects chose one
-        plt.tight_layout()
-        if output_path is None:
-            plt.savefig(os.path.join(self.OUTPUT_DIR, f"file_{filename}__res{dpi}.pdf"), format='pdf', dpi=dpi)
-        else:
-            plt.savefig(os.path.join(output_path, f"file_{filename}__res{dpi}.pdf"), format='pdf', dpi=dpi)
-        plt.show()
+        fig.tight_layout()
+
+        return fig
+
+    def getOutputFilePath(self, filename: str, dpi: int, output_path: str or None) -> str:
+        """
+        Method that builds the path of the PDF file for a given data file.
+
+        :param filename:
+        Name of (or path to) the data file.
+
+        :param dpi:
+        Resolution of the map.
+
+        :param output_path:
+        Output folder. If None, the output folder of the workspace is used.
+
+        :return:
+        Returns the full path of the PDF file.
+        """
+
+        filename = os.path.basename(filename)
+        output_dir = self.storage.output_dir if output_path is None else output_path
+        return os.path.join(output_dir, f"file_{filename}__res{dpi}.pdf")
 
     def cutDataForMollweideProjection(self, lon_r, lat_r, thresh=np.pi):
         """
@@ -390,9 +556,11 @@ class Projection:
         The requested colormap
         """
 
-        batlow_path = os.path.join("public", "batlow.txt")
-        batlowk_path = os.path.join("public", "batlowK.txt")
-        batloww_path = os.path.join("public", "batlowW.txt")
+        from matplotlib.colors import LinearSegmentedColormap
+
+        batlow_path = os.path.join(PUBLIC_DIR, "batlow.txt")
+        batlowk_path = os.path.join(PUBLIC_DIR, "batlowK.txt")
+        batloww_path = os.path.join(PUBLIC_DIR, "batlowW.txt")
 
         cmap_type = self.handler.getHeatmapColor()
 
@@ -408,10 +576,13 @@ class Projection:
 
         if cmap_type in ["viridis", "magma", "plasma", "inferno", "cividis"]:
             return cmap_type
-        else:
-            cm_data = np.loadtxt(cmaps[cmap_type])
-            colormap = LinearSegmentedColormap.from_list('batlow', cm_data)
-            return colormap
+
+        with self.colormaps_lock:
+            if cmap_type not in self.colormaps:
+                cm_data = np.loadtxt(cmaps[cmap_type])
+                self.colormaps[cmap_type] = LinearSegmentedColormap.from_list('batlow', cm_data)
+
+            return self.colormaps[cmap_type]
 
     def drawSelectedCoordinatesAlongsideGraticule(self, ax: Axes, rotate: bool,
                                                   final_rotation: np.ndarray):
@@ -0,0 +1,211 @@
+import numpy as np
+
+
+class Schema:
+    """
+    Class that describes a typed, versioned document (config or map features) and compiles it once into
+    per-field decoders and encoders.
+    Decoders accept both native JSON values (current format) and the old stringified values (legacy format),
+    so the same schema is used to read current files and to migrate legacy ones.
+    """
+
+    # Key under which the schema version is stored in every persisted document.
+    VERSION_KEY = "schema_version"
+
+    def __init__(self, version: int, fields: dict):
+        """
+        :param version:
+        Version of the persisted format. Documents without this version are treated as legacy and migrated.
+
+        :param fields:
+        Dictionary of {key: type} pairs. Supported types are bool, int, float, str, tuple[float, float],
+        list[float] and a nested Schema, which describes a list of dictionaries (for example, list of points).
+        Note: Keys not defined here are passed through untouched.
+        """
+
+        self.version = version
+        self.fields = fields
+
+        # Compile the schema once, so reading a document is a single dictionary lookup per key.
+        self.decoders = {key: self.compileDecoder(field_type) for key, field_type in fields.items()}
+        self.encoders = {key: self.compileEncoder(field_type) for key, field_type in fields.items()}
+
+    def compileDecoder(self, field_type: any) -> callable:
+        """
+        Method that builds the decoder function for a single field type.
+
+        :param field_type:
+        Type from the schema definition.
+
+        :return:
+        Returns a function that turns a stored (native or legacy stringified) value into the python value.
+        """
+
+        if isinstance(field_type, Schema):
+            return lambda items: [field_type.decodeValues(item) for item in items]
+
+        if field_type == bool:
+            return self.decodeBool
+
+        if field_type == int:
+            return int
+
+        if field_type == float:
+            return float
+
+        if field_type == tuple[float, float]:
+            return self.decodePair
+
+        if field_type == list[float]:
+            return self.decodeList
+
+        return lambda value: value
+
+    def compileEncoder(self, field_type: any) -> callable:
+        """
+        Method that builds the encoder function for a single field type.
+
+        :param field_type:
+        Type from the schema definition.
+
+        :return:
+        Returns a function that turns a python value into a native JSON value.
+        """
+
+        if isinstance(field_type, Schema):
+            return lambda items: [field_type.encodeValues(item) for item in items]
+
+        if field_type == bool:
+            # Not the builtin bool, which would turn the string "False" into True.
+            return self.decodeBool
+
+        if field_type == int:
+            return int
+
+        if field_type == float:
+            return float
+
+        if field_type == tuple[float, float] or field_type == list[float]:
+            return lambda value: [float(x) for x in value]
+
+        return lambda value: value
+
+    def decodeBool(self, value: any) -> bool:
+        # Native booleans are returned directly, legacy "True"/"False" strings are compared case-insensitive.
+        if isinstance(value, (bool, np.bool_)):
+            return bool(value)
+
+        if isinstance(value, str) and value.lower() in ("true", "false"):
+            return value.lower() == "true"
+
+        raise ValueError("Expected a boolean or a string 'True'/'False'.")
+
+    def decodePair(self, value: any) -> tuple[float, float]:
+        # Native JSON arrays (and numpy arrays) are converted directly.
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return tuple(float(x) for x in value)
+
+        # Legacy "(x, y)" string, split without evaluating it.
+        return tuple(float(x) for x in value.strip().strip("()[]").split(","))
+
+    def decodeList(self, value: any) -> list[float]:
+        # Native JSON arrays, or a "[x, y, ...]" string (e.g. typed in the CLI). An empty string is an empty list.
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return [float(x) for x in value]
+
+        return [float(x) for x in value.strip().strip("()[]").split(",") if x.strip()]
+
+    def decodeValues(self, values: dict) -> dict:
+        """
+        Method that decodes a dictionary of stored values using the compiled decoders.
+
+        :param values:
+        Stored dictionary (native or legacy format). The version key is dropped.
+
+        :return:
+        Returns the dictionary with correct python datastructures.
+        """
+
+        decoded = {}
+        for key, value in values.items():
+            if key == self.VERSION_KEY:
+                continue
+
+            decoder = self.decoders.get(key)
+            try:
+                decoded[key] = value if decoder is None else decoder(value)
+            except Exception as e:
+                raise ValueError(f"Error parsing key '{key}' with value '{value}': {e}")
+
+        return decoded
+
+    def encodeValues(self, values: dict) -> dict:
+        """
+        Method that encodes a dictionary of python values into native JSON values using the compiled encoders.
+
+        :param values:
+        Dictionary with python datastructures.
+
+        :return:
+        Returns the dictionary ready to be dumped (without the version key).
+        """
+
+        encoded = {}
+        for key, value in values.items():
+            if key == self.VERSION_KEY:
+                continue
+
+            encoder = self.encoders.get(key)
+            encoded[key] = value if encoder is None else encoder(value)
+
+        return encoded
+
+    def encodeDocument(self, values: dict) -> dict:
+        # Encoded values with the version stamp in front.
+        return {self.VERSION_KEY: self.version, **self.encodeValues(values)}
+
+    def isCurrent(self, document: dict) -> bool:
+        # Documents written before versioning (stringified JSON) have no version key.
+        return document.get(self.VERSION_KEY) == self.version
+
+
+# Schemas are compiled once at import and shared by all storages.
+CONFIG_SCHEMA = Schema(2, {
+    "map_accuracy": int,
+    "max_l_to_cache": int,
+    "rotate": bool,
+    "central_point": tuple[float, float],
+    "meridian_point": tuple[float, float],
+    "show_negative_values": bool,
+    "map_features_type_checking": bool,
+    "map_features_encoding": str,
+    "instrumentation": bool,
+    "basis_engine": str,
+    "memory_budget_mb": int,
+    "basis_workers": int,
+    "threads": int,
+    "precision": str,
+    "filter_beam_fwhm": float,
+    "filter_l_min": int,
+    "filter_l_max": int,
+    "filter_l_weights": list[float]
+})
+
+MAP_FEATURES_SCHEMA = Schema(2, {
+    "points": Schema(2, {
+        "coordinates": tuple[float, float],
+        "show_text": bool,
+        "hollow": bool
+    }),
+    "circles": Schema(2, {
+        "coordinates": tuple[float, float],
+        "alpha": float
+    }),
+    "texts": Schema(2, {
+        "coordinates": tuple[float, float],
+        "font_size": int,
+        "tilt_angle": float
+    }),
+    "heatmap_scale": tuple[float, float],
+    "heatmap_color": str
+})
@@ -0,0 +1,264 @@
+import io
+import json
+import os
+import socketserver
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+
+
+class MapServer:
+    """
+    Class that serves maps over local HTTP (TCP or a Unix socket), using only the standard library.
+    The mapper, its basis and colormaps stay loaded between requests, so a request pays only for the render itself,
+    not for starting Python, importing SciPy and matplotlib and loading the basis.
+
+    Endpoints:
+    - POST /render?format=pdf|png|npy: renders coefficients and returns the file. The body is either
+      a JSON object {"coefficients": [[l, m, c, s], ...] or "<text of a data file>", "config": {...}, "format": ...},
+      or the raw contents of a data file (.txt or .npy), with config given as JSON in the "config" query parameter.
+      Config is partial, missing keys are taken from the default config.
+    - GET /health: returns request statistics as JSON.
+    - GET /metrics: returns cumulative metrics of the mapper in Prometheus text format (see MetricsRegistry).
+
+    Identical requests (same coefficients, config and format) that arrive while the first one is still rendering
+    are coalesced: they wait for it and get the same bytes, so the map is rendered once.
+    """
+
+    CONTENT_TYPES = {"pdf": "application/pdf", "png": "image/png", "npy": "application/octet-stream"}
+
+    def __init__(self, mapper, host: str = "127.0.0.1", port: int = 8765, unix_socket: str or None = None,
+                 verbose: bool = False):
+        """
+        :param mapper:
+        IBEXMapper instance used for all requests.
+
+        :param host:
+        Address to listen on. Only local addresses are intended.
+
+        :param port:
+        TCP port. 0 picks a free port (see address).
+
+        :param unix_socket:
+        Path of a Unix socket to listen on instead of TCP.
+
+        :param verbose:
+        Whether to log every request.
+        """
+
+        self.mapper = mapper
+        self.verbose = verbose
+
+        # {request key: Future} of renders in progress, used for coalescing.
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        self.statistics = {"requests": 0, "renders": 0, "coalesced": 0, "errors": 0}
+
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            self.http_server = _ThreadingUnixHTTPServer(unix_socket, _RequestHandler)
+        else:
+            self.http_server = ThreadingHTTPServer((host, port), _RequestHandler)
+
+        self.http_server.daemon_threads = True
+        self.http_server.map_server = self
+        self.thread = None
+
+    @property
+    def address(self):
+        # (host, port) for TCP, socket path for a Unix socket.
+        return self.http_server.server_address
+
+    def warmUp(self, config: dict or None = None) -> None:
+        """
+        Method that loads everything a render needs before the first request: the basis for the config
+        (default config if not given), the colormap and the rendering modules.
+        """
+
+        config = self.mapper.getDefaultConfig() if config is None else config
+
+        # The same engine renders will use, so a basis over the memory budget is never loaded.
+        engine, band_size, workers = self.mapper.planner.selectEngine(config)
+        self.mapper.handler.getSphericalHarmonicsBasis(config["map_accuracy"], config["max_l_to_cache"], engine,
+                                                      band_size, workers, config.get("precision", "float64"))
+        self.mapper.projection.getMapColorPaletteToProject()
+
+        import matplotlib.figure  # noqa: F401
+        import matplotlib.backends.backend_pdf  # noqa: F401
+        import matplotlib.backends.backend_agg  # noqa: F401
+        import scipy.interpolate  # noqa: F401
+        import scipy.spatial.transform  # noqa: F401
+
+    def serveForever(self) -> None:
+        try:
+            self.http_server.serve_forever()
+        finally:
+            self.close()
+
+    def start(self) -> None:
+        """
+        Method that starts serving on a background thread (for embedding and tests). Stop it with shutdown().
+        """
+
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def shutdown(self) -> None:
+        self.http_server.shutdown()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.close()
+
+    def close(self) -> None:
+        self.http_server.server_close()
+
+        if isinstance(self.http_server, _ThreadingUnixHTTPServer) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def render(self, body: bytes, content_type: str, query: dict) -> tuple[bytes, str]:
+        """
+        Method that handles one render request.
+
+        :return:
+        Returns (file contents, content type).
+        """
+
+        with self.in_flight_lock:
+            self.statistics["requests"] += 1
+
+        coefficients, partial_config, file_format = self.parseRenderRequest(body, content_type, query)
+
+        if file_format not in self.CONTENT_TYPES:
+            raise ValueError(f"Invalid format '{file_format}'. Must be one of: {list(self.CONTENT_TYPES)}")
+
+        # Decoded like a stored config (JSON lists become tuples), then validated and merged with the default config.
+        config = self.mapper.generateValidConfigFromPartialInfo(
+            self.mapper.storage.config_schema.decodeValues(partial_config))
+
+        request_key = self.mapper.stage_cache.hashKey(coefficients, sorted(config.items()), file_format)
+
+        with self.in_flight_lock:
+            future = self.in_flight.get(request_key)
+            is_leader = future is None
+
+            if is_leader:
+                future = Future()
+                self.in_flight[request_key] = future
+            else:
+                self.statistics["coalesced"] += 1
+
+        # The first request renders, identical requests arriving meanwhile wait for its result.
+        if is_leader:
+            try:
+                heatmap = self.mapper.computeHeatmap(coefficients, config)
+                future.set_result(self.mapper.renderHeatmapToBytes(heatmap, file_format))
+
+                with self.in_flight_lock:
+                    self.statistics["renders"] += 1
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.in_flight_lock:
+                    del self.in_flight[request_key]
+
+        return future.result(), self.CONTENT_TYPES[file_format]
+
+    def parseRenderRequest(self, body: bytes, content_type: str, query: dict) -> tuple[np.ndarray, dict, str]:
+        file_format = query.get("format", ["pdf"])[0]
+        partial_config = json.loads(query["config"][0]) if "config" in query else {}
+
+        if content_type.startswith("application/json"):
+            request = json.loads(body.decode("utf-8"))
+            coefficients = request["coefficients"]
+            partial_config = request.get("config", partial_config)
+            file_format = request.get("format", file_format)
+
+            if isinstance(coefficients, str):
+                coefficients = np.loadtxt(io.StringIO(coefficients), comments="#", ndmin=2)
+        elif body.startswith(b"\x93NUMPY"):
+            coefficients = np.load(io.BytesIO(body), allow_pickle=False)
+        else:
+            coefficients = np.loadtxt(io.StringIO(body.decode("utf-8")), comments="#", ndmin=2)
+
+        return self.mapper.handler.loadCoefficients(coefficients), partial_config, file_format
+
+    def getHealth(self) -> dict:
+        with self.in_flight_lock:
+            return {"status": "ok", "in_flight": len(self.in_flight), **self.statistics}
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = "IBEXMapper"
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+
+        if path == "/metrics":
+            contents = self.server.map_server.mapper.exportMetrics().encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(contents)))
+            self.end_headers()
+            self.wfile.write(contents)
+            return
+
+        if path != "/health":
+            return self.sendJSON(404, {"error": "Not found."})
+
+        self.sendJSON(200, self.server.map_server.getHealth())
+
+    def do_POST(self):
+        url = urlparse(self.path)
+
+        if url.path != "/render":
+            return self.sendJSON(404, {"error": "Not found."})
+
+        map_server = self.server.map_server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        try:
+            contents, content_type = map_server.render(body, self.headers.get("Content-Type", ""),
+                                                       parse_qs(url.query))
+        except (ValueError, KeyError, TypeError, AssertionError, MemoryError) as e:
+            # Invalid coefficients, config or request, or a map over the memory budget.
+            with map_server.in_flight_lock:
+                map_server.statistics["errors"] += 1
+            return self.sendJSON(400, {"error": f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            with map_server.in_flight_lock:
+                map_server.statistics["errors"] += 1
+            return self.sendJSON(500, {"error": f"{type(e).__name__}: {e}"})
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(contents)))
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def sendJSON(self, status: int, payload: dict) -> None:
+        contents = json.dumps(payload).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(contents)))
+        self.end_headers()
+        self.wfile.write(contents)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else "unix-socket"
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.map_server.verbose:
+            super().log_message(format, *args)
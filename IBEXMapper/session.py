@@ -0,0 +1,209 @@
+import os
+import threading
+import numpy as np
+
+
+class MapSession:
+    """
+    Class that holds one map and its coefficient vector, for editing a few coefficients at a time.
+
+    The map is synthesized once. After that, changed coefficients only add their difference, map += dc * Y_lm,
+    which costs one (dpi, dpi) multiply-add per changed coefficient instead of a sum over all K basis functions.
+    A rotated map is updated the same way: the rotation is built once as a sparse interpolation matrix (see
+    Calculator.calculateInterpolationMatrix), and rotated map += R @ (dc * Y_lm), 4 multiply-adds per pixel.
+
+    Rounding of the updates adds up, so the map is synthesized from scratch every RESYNTHESIS_UPDATES updates
+    (and whenever a single update changes more than RESYNTHESIS_FRACTION of all coefficients, where that is
+    cheaper anyway).
+    """
+
+    RESYNTHESIS_UPDATES = 1000
+    RESYNTHESIS_FRACTION = 0.25
+
+    def __init__(self, mapper, source=None, config: dict or None = None):
+        """
+        :param mapper:
+        IBEXMapper instance whose basis, planner and rotation are used.
+
+        :param source:
+        Path to the .txt file with coefficients or a coefficient array (see computeHeatmap) to start from.
+        None starts from all coefficients at zero.
+
+        :param config:
+        Config of the map. Defaults to the default config.
+        """
+
+        self.mapper = mapper
+        self.config = dict(mapper.getDefaultConfig() if config is None else config)
+        self.config["central_point"] = tuple(float(value) for value in self.config["central_point"])
+        self.config["meridian_point"] = tuple(float(value) for value in self.config["meridian_point"])
+        self.source = str(source) if isinstance(source, (str, os.PathLike)) else None
+        self.lock = threading.Lock()
+
+        dpi, max_l = self.config["map_accuracy"], self.config["max_l_to_cache"]
+
+        # The basis is held by the session, so evicting it from the handler (e.g. for another map) does not
+        # unload it while the session is edited.
+        self.engine, self.band_size, workers = mapper.planner.selectEngine(self.config)
+        self.basis = mapper.handler.getSphericalHarmonicsBasis(dpi, max_l, self.engine, self.band_size, workers,
+                                                               self.config.get("precision", "float64"))
+
+        # Dense coefficient vector, index l^2 + l + m like the basis. Coefficients are kept unfiltered, a spectral
+        # filter of the config is applied to every sum (weights of the degree of every index).
+        self.coefficients = np.zeros((max_l + 1) ** 2)
+        window = mapper.handler.getSpectralWindow(self.config)
+        self.weights = None if window is None else window[np.floor(np.sqrt(np.arange(self.coefficients.size)))
+                                                         .astype(np.int64)]
+
+        if source is not None:
+            imported_data, _ = mapper.parseCoefficients(source)
+            mapper.checkFor_L_Mismatch(imported_data[:, 0].max(), max_l)
+            self.coefficients[mapper.handler.getCoefficientIndices(imported_data)] = imported_data[:, 2]
+
+        self.lon = np.linspace(np.pi, -np.pi, dpi)
+        self.lat = np.linspace(np.pi / 2, -np.pi / 2, dpi)
+        self.rotation = np.eye(3)
+        self.interpolation_matrix = None
+        self.outside = None
+
+        if self.config["rotate"]:
+            rotated_lat, rotated_lon, self.rotation = mapper.getRotatedGrid(
+                self.lon, self.lat, self.config["central_point"], self.config["meridian_point"], self.basis.dtype)
+            self.interpolation_matrix, self.outside = mapper.calculator.calculateInterpolationMatrix(
+                dpi, rotated_lat, rotated_lon)
+
+        self.heatmap = None
+        self.rotated_heatmap = None
+        self.updates = 0
+
+        self.resynthesize()
+
+    def resynthesize(self) -> None:
+        """
+        Method that synthesizes (and rotates) the map from the whole coefficient vector, dropping rounding errors
+        of earlier updates.
+        """
+
+        with self.lock:
+            self.heatmap = self.synthesize(np.arange(self.coefficients.size), self.coefficients)
+            self.rotated_heatmap = self.rotate(self.heatmap) if self.config["rotate"] else None
+            self.updates = 0
+
+    def updateCoefficients(self, rows) -> int:
+        """
+        Method that sets new values of some coefficients and updates the map by their differences only.
+
+        :param rows:
+        (N, 3) array (or list) of (l, m, new coefficient) rows, a 4th uncertainty column is ignored.
+
+        :return:
+        Returns the number of coefficients whose value changed.
+        """
+
+        rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+        indices = self.mapper.handler.getCoefficientIndices(rows)
+
+        if indices.size and indices.max() >= self.coefficients.size:
+            raise ValueError("Coefficients error: Session max l should be greater or equal to max l of the rows.")
+
+        with self.lock:
+            differences = rows[:, 2] - self.coefficients[indices]
+            changed = differences != 0
+            indices, differences = indices[changed], differences[changed]
+
+            if indices.size == 0:
+                return 0
+
+            self.coefficients[indices] = rows[changed, 2]
+            self.updates += 1
+
+            resynthesize = (self.updates >= self.RESYNTHESIS_UPDATES
+                            or indices.size > self.RESYNTHESIS_FRACTION * self.coefficients.size)
+
+            if not resynthesize:
+                # Only the changed basis functions are read and summed.
+                difference_map = self.synthesize(indices, differences)
+                self.heatmap += difference_map
+
+                if self.config["rotate"]:
+                    self.rotated_heatmap += self.rotate(difference_map)
+
+        if resynthesize:
+            self.resynthesize()
+
+        return int(indices.size)
+
+    def setCoefficient(self, l: int, m: int, value: float) -> None:
+        # Sets one coefficient, see updateCoefficients.
+        self.updateCoefficients([(l, m, value)])
+
+    def getCoefficients(self) -> np.ndarray:
+        """
+        :return:
+        Returns the (K, 3) array of (l, m, coefficient) rows of the session, in basis order, zeros included.
+        """
+
+        with self.lock:
+            index = np.arange(self.coefficients.size)
+            l_values = np.floor(np.sqrt(index)).astype(np.int64)
+            return np.column_stack((l_values, index - l_values * l_values - l_values, self.coefficients))
+
+    def getHeatmap(self) -> dict:
+        """
+        :return:
+        Returns the current map as the result dictionary of computeHeatmap (rotated and clipped by config).
+        The heatmap is a copy, later updates do not change it.
+        """
+
+        with self.lock:
+            heatmap_data = (self.rotated_heatmap if self.config["rotate"] else self.heatmap).copy()
+
+        if not self.config["show_negative_values"]:
+            heatmap_data = np.where(heatmap_data < 0, 0, heatmap_data)
+
+        return {
+            "heatmap": heatmap_data,
+            "lon": self.lon,
+            "lat": self.lat,
+            "dpi": self.config["map_accuracy"],
+            "max_l": self.config["max_l_to_cache"],
+            "rotate": self.config["rotate"],
+            "central_point": self.config["central_point"],
+            "meridian_point": self.config["meridian_point"],
+            "rotation": self.rotation,
+            "source": self.source
+        }
+
+    def render(self, output_path: str or None = None, file_name: str or None = None, show: bool = False) -> str:
+        """
+        Method that draws and saves the current map, see IBEXMapper.renderHeatmap.
+
+        :return:
+        Returns the path of the saved PDF file.
+        """
+
+        return self.mapper.renderHeatmap(self.getHeatmap(), output_path, file_name, show)
+
+    def synthesize(self, indices: np.ndarray, coefficients: np.ndarray) -> np.ndarray:
+        # Sum of (filtered) coefficients times their basis functions, as a writable (dpi, dpi) map.
+        dpi = self.config["map_accuracy"]
+
+        if self.weights is not None:
+            coefficients = coefficients * self.weights[indices]
+
+        with self.mapper.threads.limit(self.config.get("threads", 0)):
+            if self.engine == "chunked":
+                # The memory mapped basis is read band by band.
+                return self.mapper.calculator.calculateMainMatrixInBands(coefficients, self.basis, indices, dpi,
+                                                                         self.band_size or dpi)
+
+            basis = self.basis if indices.size == self.coefficients.size else self.basis[indices]
+            return self.mapper.calculator.calculateMainMatrixFromCoefficients(coefficients, basis, dpi)
+
+    def rotate(self, heatmap_data: np.ndarray) -> np.ndarray:
+        # Applies the interpolation matrix, pixels outside of the original grid are NaN like in the rotate stage.
+        dpi = self.config["map_accuracy"]
+        rotated = (self.interpolation_matrix @ heatmap_data.ravel()).reshape(dpi, dpi).astype(heatmap_data.dtype)
+        rotated[self.outside] = np.nan
+
+        return rotated
@@ -0,0 +1,156 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class StageCache:
+    """
+    Class that memoizes results of the map pipeline stages (parse -> synthesize -> rotate -> clip), so a map
+    that only differs in styling (palette, scale, overlays) skips straight to rendering.
+
+    Every result is stored under (stage, key), where key is a content hash of everything the stage depends on
+    (coefficient bytes, dpi, L, rotation points, negative values flag...). Least recently used results are dropped
+    once the stored arrays exceed the byte budget.
+    Note: Stored arrays are made read-only, since the same array is handed out to every caller.
+    """
+
+    # Default byte budget, about 16 maps at 720 dpi for every stage.
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        :param max_bytes:
+        Byte budget for stored arrays. 0 disables memoization.
+        """
+
+        self.max_bytes = max_bytes
+
+        # {(stage, key): (value, size in bytes)}, ordered from least to most recently used.
+        self.entries = OrderedDict()
+        self.stored_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def hashKey(*parts) -> str:
+        """
+        Method that builds a content hash of given stage inputs.
+
+        :param parts:
+        NumPy arrays (hashed by dtype, shape and bytes) or any values with a stable repr (numbers, strings, tuples).
+
+        :return:
+        Returns the hex digest.
+        """
+
+        digest = hashlib.blake2b(digest_size=16)
+
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(f"{part.dtype.str}{part.shape}".encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(repr(part).encode())
+
+            # Separator, so ("ab", "c") and ("a", "bc") give different hashes.
+            digest.update(b"\x00")
+
+        return digest.hexdigest()
+
+    def getOrCompute(self, stage: str, key: str, compute):
+        """
+        Method that returns the stored result of a stage, or computes and stores it.
+
+        :param stage:
+        Name of the stage.
+
+        :param key:
+        Content hash of the stage inputs (see hashKey).
+
+        :param compute:
+        Function without arguments that computes the result on a miss.
+
+        :return:
+        Returns the (possibly stored) result.
+        """
+
+        value = self.get(stage, key)
+
+        if value is not None:
+            return value
+
+        # Computed outside the lock, so different stages and maps do not wait for each other.
+        value = compute()
+        self.put(stage, key, value)
+
+        return value
+
+    def get(self, stage: str, key: str):
+        """
+        Method that returns the stored result of a stage, or None if there is none.
+        Used when results of many keys are computed together (see IBEXMapper.computeHeatmapsFromContainer).
+        """
+
+        with self.lock:
+            entry = self.entries.get((stage, key))
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end((stage, key))
+            self.hits += 1
+            return entry[0]
+
+    def put(self, stage: str, key: str, value) -> None:
+        arrays = self.findArrays(value)
+        size = sum(array.nbytes for array in arrays)
+
+        # Results bigger than the whole budget are not stored at all.
+        if size > self.max_bytes:
+            return
+
+        for array in arrays:
+            array.flags.writeable = False
+
+        with self.lock:
+            previous = self.entries.pop((stage, key), None)
+            if previous is not None:
+                self.stored_bytes -= previous[1]
+
+            self.entries[(stage, key)] = (value, size)
+            self.stored_bytes += size
+
+            # Drop least recently used results until stored arrays fit into the budget.
+            while self.stored_bytes > self.max_bytes:
+                _, (_, dropped_size) = self.entries.popitem(last=False)
+                self.stored_bytes -= dropped_size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.stored_bytes = 0
+
+    def getStatistics(self) -> dict:
+        """
+        :return:
+        Returns {"hits", "misses", "entries", "bytes", "max_bytes"}.
+        """
+
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                    "bytes": self.stored_bytes, "max_bytes": self.max_bytes}
+
+    @staticmethod
+    def findArrays(value) -> list:
+        # Stage results are arrays, or tuples / dictionaries of arrays and plain values.
+        if isinstance(value, np.ndarray):
+            return [value]
+        if isinstance(value, (tuple, list)):
+            return [array for item in value for array in StageCache.findArrays(item)]
+        if isinstance(value, dict):
+            return [array for item in value.values() for array in StageCache.findArrays(item)]
+        return []
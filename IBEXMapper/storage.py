@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import zlib
+from .schema import CONFIG_SCHEMA, MAP_FEATURES_SCHEMA
+
+
+class Storage:
+    """
+    This class is responsible for persisting config and map features as typed, versioned documents.
+    Config is always stored as JSON. Map features are stored either as JSON or, for large feature sets,
+    in a compact binary encoding (columnar rows, zlib compressed).
+    Files written by older versions of the app (stringified JSON) are migrated on first load.
+    """
+
+    # Header of binary map features files, followed by one byte of format version.
+    BINARY_MAGIC = b"IBXF"
+    BINARY_VERSION = 1
+
+    # Map features keys that hold lists of dictionaries (stored column-wise in the binary encoding).
+    FEATURE_GROUPS = ("points", "circles", "texts")
+
+    # Spherical harmonics cache shared by all workspaces unless a workspace sets its own.
+    DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+    def __init__(self, root: str = ".", cache_dir: str or None = None):
+        """
+        :param root:
+        Workspace root. Config, map features and default output folders live inside it.
+        Note: The root is resolved to an absolute path once, so later changes of the working directory
+        do not move the workspace.
+
+        :param cache_dir:
+        Folder for cached spherical harmonics. Defaults to the cache folder inside the package.
+        """
+
+        self.root = os.path.abspath(root)
+        self.config_dir = os.path.join(self.root, "config")
+        self.features_dir = os.path.join(self.root, "map_features")
+        self.output_dir = os.path.join(self.root, "output")
+        self.config_file = os.path.join(self.config_dir, "config.json")
+        self.features_file = os.path.join(self.features_dir, "map_features.json")
+        self.features_binary_file = os.path.join(self.features_dir, "map_features.bin")
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir is not None else self.DEFAULT_CACHE_DIR
+
+        self.config_schema = CONFIG_SCHEMA
+        self.map_features_schema = MAP_FEATURES_SCHEMA
+
+        # Guards read-modify-write sequences on workspace files when one instance is used from many threads.
+        # Reentrant, because map features operations load and save while holding it.
+        self.lock = threading.RLock()
+
+    def createWorkspaceDirectories(self) -> None:
+        os.makedirs(self.config_dir, exist_ok=True)
+        os.makedirs(self.features_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    # ----------------------------------------
+    #                  CONFIG
+    # ----------------------------------------
+
+    def loadConfig(self) -> dict:
+        """
+        Method that loads config/config.json and returns it with correct python datastructures.
+        Note: Legacy stringified config is rewritten in the current format on first load.
+        """
+
+        with self.lock:
+            document = self.readJSONDocument(self.config_file)
+
+            config = self.config_schema.decodeValues(document)
+
+            if not self.config_schema.isCurrent(document):
+                self.saveConfig(config)
+
+        return config
+
+    def saveConfig(self, config: dict) -> None:
+        """
+        Method that writes a config dictionary with native JSON values to config/config.json.
+
+        :param config:
+        Config dictionary with python datastructures.
+        """
+
+        self.writeJSONDocument(self.config_file, self.config_schema.encodeDocument(config))
+
+    # ----------------------------------------
+    #               MAP FEATURES
+    # ----------------------------------------
+
+    def loadMapFeatures(self) -> dict:
+        """
+        Method that loads map features with correct python datastructures, from whichever encoding is on disk.
+        If the stored encoding differs from the one selected in config (or the file is a legacy stringified one),
+        the file is rewritten in the selected, current format.
+        """
+
+        with self.lock:
+            use_binary = self.isBinaryMapFeaturesSelected()
+
+            # Read from the selected encoding first, fall back to the other one (migration between encodings).
+            if use_binary and os.path.exists(self.features_binary_file):
+                document, migrate = self.readBinaryDocument(self.features_binary_file), False
+            elif not use_binary and os.path.exists(self.features_file):
+                document, migrate = self.readJSONDocument(self.features_file), False
+            elif os.path.exists(self.features_binary_file):
+                document, migrate = self.readBinaryDocument(self.features_binary_file), True
+            else:
+                document, migrate = self.readJSONDocument(self.features_file), True
+
+            map_features = self.map_features_schema.decodeValues(document)
+
+            if migrate or not self.map_features_schema.isCurrent(document):
+                self.saveMapFeatures(map_features)
+
+        return map_features
+
+    def saveMapFeatures(self, map_features: dict) -> None:
+        """
+        Method that writes map features in the encoding selected in config and removes the file of the other encoding.
+
+        :param map_features:
+        Map features dictionary with python datastructures.
+        """
+
+        document = self.map_features_schema.encodeDocument(map_features)
+
+        with self.lock:
+            if self.isBinaryMapFeaturesSelected():
+                self.writeBinaryDocument(self.features_binary_file, document)
+                stale_file = self.features_file
+            else:
+                self.writeJSONDocument(self.features_file, document)
+                stale_file = self.features_binary_file
+
+            # Only one encoding is kept on disk, so there is never a question which file is up to date.
+            if os.path.exists(stale_file):
+                os.remove(stale_file)
+
+    def mapFeaturesExist(self) -> bool:
+        return os.path.exists(self.features_file) or os.path.exists(self.features_binary_file)
+
+    def isBinaryMapFeaturesSelected(self) -> bool:
+        # Config is read raw here to avoid migrating it as a side effect of a map features operation.
+        if not os.path.exists(self.config_file):
+            return False
+
+        document = self.readJSONDocument(self.config_file)
+
+        return document.get("map_features_encoding", "json") == "binary"
+
+    # ----------------------------------------
+    #             ENCODINGS ON DISK
+    # ----------------------------------------
+
+    def readJSONDocument(self, file_path: str) -> dict:
+        with open(file_path, "r") as f:
+            return json.load(f)
+
+    def writeJSONDocument(self, file_path: str, document: dict) -> None:
+        self.writeFileAtomically(file_path, json.dumps(document, indent=4).encode("utf-8"))
+
+    def readBinaryDocument(self, file_path: str) -> dict:
+        """
+        Method that reads a binary map features file.
+
+        :param file_path:
+        Path to the binary file.
+
+        :return:
+        Returns the stored document with the feature groups expanded back into lists of dictionaries.
+        """
+
+        with open(file_path, "rb") as f:
+            raw = f.read()
+
+        header_size = len(self.BINARY_MAGIC) + 1
+        if raw[:len(self.BINARY_MAGIC)] != self.BINARY_MAGIC:
+            raise ValueError(f"File '{file_path}' is not a binary map features file.")
+        if raw[len(self.BINARY_MAGIC)] != self.BINARY_VERSION:
+            raise ValueError(f"Unsupported binary map features version: {raw[len(self.BINARY_MAGIC)]}")
+
+        document = json.loads(zlib.decompress(raw[header_size:]).decode("utf-8"))
+
+        # Groups are stored as {"columns": [...], "rows": [[...], ...]} to avoid repeating keys on every item.
+        for group in self.FEATURE_GROUPS:
+            if group in document:
+                columns = document[group]["columns"]
+                document[group] = [{column: value for column, value in zip(columns, row) if value is not None}
+                                   for row in document[group]["rows"]]
+
+        return document
+
+    def writeBinaryDocument(self, file_path: str, document: dict) -> None:
+        """
+        Method that writes a document in the compact binary encoding.
+
+        :param file_path:
+        Path to the binary file.
+
+        :param document:
+        Encoded (native JSON values) document.
+        """
+
+        compact_document = dict(document)
+
+        for group in self.FEATURE_GROUPS:
+            if group in compact_document:
+                items = compact_document[group]
+
+                # Union of keys in insertion order, so items with missing keys still fit in the table.
+                columns = list(dict.fromkeys(key for item in items for key in item))
+                compact_document[group] = {
+                    "columns": columns,
+                    "rows": [[item.get(column) for column in columns] for item in items]
+                }
+
+        payload = json.dumps(compact_document, separators=(",", ":")).encode("utf-8")
+
+        self.writeFileAtomically(file_path, self.BINARY_MAGIC + bytes([self.BINARY_VERSION]) + zlib.compress(payload, 6))
+
+    def writeFileAtomically(self, file_path: str, content: bytes) -> None:
+        """
+        Method that writes the file to a temporary sibling and then swaps it in, so readers in other threads
+        (or processes) never see a half-written file.
+
+        :param file_path:
+        Destination path.
+
+        :param content:
+        Bytes to write.
+        """
+
+        temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+
+        os.replace(temporary_path, file_path)
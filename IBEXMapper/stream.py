@@ -0,0 +1,185 @@
+import queue
+import threading
+import time
+
+# Marks the end of a queue.
+_END = object()
+
+
+class StreamRenderer:
+    """
+    Class that streams maps of many files through a pipeline of three threads:
+    - a reader thread parses the next files ahead of time,
+    - the consuming thread synthesizes, rotates and clips the current map,
+    - a writer thread draws and saves finished maps.
+    So disk reads and PDF writes overlap with the calculation instead of leaving the CPU idle.
+    Queues between the threads are bounded, so at most a few maps are held in memory no matter how many files
+    are streamed.
+    """
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+
+    def iterMaps(self, file_paths, output_path: str or None = None, config: dict or None = None,
+                 render: bool = True, prefetch: int = 2):
+        """
+        Generator that yields one result per file, in the order of given files. A failing file does not stop it.
+
+        :param file_paths:
+        Iterable of paths to coefficient files. It is consumed lazily, so it may be a generator itself.
+
+        :param output_path:
+        Folder for PDF files. Defaults to the output folder of the mapper's workspace.
+
+        :param config:
+        Config used for all files. Defaults to the default config.
+
+        :param render:
+        Whether to draw and save maps. If False, only heatmaps are calculated (nothing is drawn).
+
+        :param prefetch:
+        Depth of both queues: how many files are parsed ahead, and how many finished maps may wait for the writer.
+
+        :return:
+        Yields {"file", "heatmap", "output", "success", "error", "seconds"} dictionaries, where "heatmap" is
+        the result of computeHeatmap (None on failure) and "output" is the saved PDF (None if not rendered).
+        """
+
+        if prefetch < 1:
+            raise ValueError("Prefetch must be at least 1.")
+
+        if config is None:
+            config = self.mapper.getDefaultConfig()
+
+        stop = threading.Event()
+        parsed_queue = queue.Queue(maxsize=prefetch)
+        written_queue = queue.Queue(maxsize=prefetch)
+        finished_queue = queue.Queue()
+
+        reader = threading.Thread(target=self.readFiles, args=(file_paths, parsed_queue, stop), daemon=True)
+        writer = threading.Thread(target=self.writeMaps, args=(written_queue, finished_queue, output_path, stop),
+                                  daemon=True)
+        reader.start()
+
+        if render:
+            writer.start()
+
+        try:
+            while True:
+                item = parsed_queue.get()
+
+                if item is _END:
+                    break
+
+                result = self.computeMap(item, config)
+
+                if not render:
+                    yield result
+                    continue
+
+                # Blocks while the writer is behind, which keeps memory flat.
+                self.putUnlessStopped(written_queue, result, stop)
+
+                # Hand over whatever the writer has finished in the meantime.
+                while not finished_queue.empty():
+                    yield finished_queue.get()
+
+            if render:
+                self.putUnlessStopped(written_queue, _END, stop)
+
+                while True:
+                    result = finished_queue.get()
+
+                    if result is _END:
+                        break
+
+                    yield result
+        finally:
+            # Also runs when the consumer stops iterating early. Both threads notice the stop event
+            # within a fraction of a second.
+            stop.set()
+            reader.join()
+
+            if render:
+                writer.join()
+
+    def readFiles(self, file_paths, parsed_queue: queue.Queue, stop: threading.Event) -> None:
+        try:
+            for file_path in file_paths:
+                if stop.is_set():
+                    return
+
+                file_path = str(file_path)
+                start = time.perf_counter()
+
+                try:
+                    parsed = self.mapper.parseCoefficients(file_path)
+                    error = None
+                except Exception as e:
+                    parsed = None
+                    error = f"{type(e).__name__}: {e}"
+
+                item = {"file": file_path, "parsed": parsed, "error": error, "seconds": time.perf_counter() - start}
+
+                if not self.putUnlessStopped(parsed_queue, item, stop):
+                    return
+        finally:
+            # The end is always marked, even if iterating the given paths fails, so the consumer never waits forever.
+            self.putUnlessStopped(parsed_queue, _END, stop)
+
+    def computeMap(self, item: dict, config: dict) -> dict:
+        result = {"file": item["file"], "heatmap": None, "output": None, "success": False, "error": item["error"],
+                  "seconds": item["seconds"]}
+
+        if item["parsed"] is None:
+            return result
+
+        start = time.perf_counter()
+
+        try:
+            imported_data, coefficients_key = item["parsed"]
+            result["heatmap"] = self.mapper.computeParsedHeatmap(imported_data, coefficients_key, config, item["file"])
+            result["success"] = True
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+
+        result["seconds"] += time.perf_counter() - start
+
+        return result
+
+    def writeMaps(self, written_queue: queue.Queue, finished_queue: queue.Queue, output_path: str or None,
+                  stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                result = written_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if result is _END:
+                finished_queue.put(_END)
+                return
+
+            if result["success"]:
+                start = time.perf_counter()
+
+                try:
+                    result["output"] = self.mapper.renderHeatmap(result["heatmap"], output_path, show=False)
+                except Exception as e:
+                    result["success"] = False
+                    result["error"] = f"{type(e).__name__}: {e}"
+
+                result["seconds"] += time.perf_counter() - start
+
+            finished_queue.put(result)
+
+    @staticmethod
+    def putUnlessStopped(target_queue: queue.Queue, item, stop: threading.Event) -> bool:
+        # Bounded put that gives up once the stream is stopped, so no thread stays blocked on a full queue.
+        while not stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
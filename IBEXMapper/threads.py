@@ -0,0 +1,267 @@
+import os
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+
+class ThreadController:
+    """
+    Class that controls how many threads the numerical stages use, with one setting (the "threads" config key):
+    - the managed thread pool that runs pixel blocks of synthesis and interpolation,
+    - BLAS and OpenMP thread pools of NumPy and SciPy (through threadpoolctl, if it is installed),
+    - threads of worker processes (see BatchRenderer), which share the cores between them.
+
+    The thread count is set per call with limit, and is local to the calling thread, so maps with different settings
+    may run at once. BLAS limits are process wide, so with such maps the last limit wins.
+    Without threadpoolctl, BLAS threads can only be set by environment variables before NumPy is imported, and
+    limits warn once that they do not apply to BLAS.
+    """
+
+    # Overrides the default thread count (e.g. in worker processes, or set by a batch scheduler).
+    ENVIRONMENT_VARIABLE = "IBEX_MAPPER_THREADS"
+
+    # Environment variables read by BLAS and OpenMP libraries when they are loaded.
+    LIBRARY_ENVIRONMENT_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+    # Blocks with fewer pixels are not worth handing over to another thread.
+    MIN_BLOCK_PIXELS = 16384
+
+    # Whether the missing threadpoolctl was already warned about, once per process.
+    library_warning_shown = False
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.executor_size = 0
+        self.executor_pid = None
+
+        # Single threaded BLAS while pixel blocks run: number of running blocks and the limiter of the first one.
+        self.block_lock = threading.Lock()
+        self.running_blocks = 0
+        self.block_limiter = None
+
+    # ----------------------------------------
+    #              THREAD COUNTS
+    # ----------------------------------------
+
+    @staticmethod
+    def getAvailableCores() -> int:
+        # Cores this process may run on (e.g. limited by a batch scheduler), not all cores of the machine.
+        try:
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return os.cpu_count() or 1
+
+    @classmethod
+    def resolveThreads(cls, threads: int = 0) -> int:
+        """
+        :param threads:
+        Thread count of the config, 0 means the default.
+
+        :return:
+        Returns the thread count to use: threads if positive, otherwise IBEX_MAPPER_THREADS if it is set, otherwise
+        the number of available cores.
+        """
+
+        if threads > 0:
+            return threads
+
+        try:
+            default_threads = int(os.environ.get(cls.ENVIRONMENT_VARIABLE, "0"))
+        except ValueError:
+            default_threads = 0
+
+        return default_threads if default_threads > 0 else cls.getAvailableCores()
+
+    def getThreads(self) -> int:
+        # Thread count of the innermost limit of the calling thread, or the default outside of any.
+        threads = getattr(self.local, "threads", None)
+        return threads if threads is not None else self.resolveThreads()
+
+    @contextmanager
+    def limit(self, threads: int = 0):
+        """
+        Context manager that sets the thread count of everything called inside it from the calling thread:
+        pixel blocks and BLAS.
+
+        :param threads:
+        Thread count, 0 means the default (see resolveThreads).
+        """
+
+        previous_threads = getattr(self.local, "threads", None)
+        self.local.threads = self.resolveThreads(threads)
+
+        try:
+            with self.limitLibraries(self.local.threads, warn=threads > 0):
+                yield self.local.threads
+        finally:
+            self.local.threads = previous_threads
+
+    @classmethod
+    def hasLibraryControl(cls) -> bool:
+        # True if BLAS and OpenMP thread pools can be limited at run time (threadpoolctl is installed).
+        try:
+            import threadpoolctl  # noqa: F401
+        except ImportError:
+            return False
+
+        return True
+
+    @classmethod
+    def limitLibraries(cls, threads: int, warn: bool = False):
+        """
+        :param threads:
+        Thread count of BLAS and OpenMP pools inside the returned context.
+
+        :param warn:
+        Whether to warn (once per process) if the limit cannot be applied, for limits the user asked for.
+
+        :return:
+        Returns the threadpoolctl limiter, or an empty context if threadpoolctl is not installed.
+        """
+
+        # threadpoolctl is optional. Without it, BLAS threads can only be set by environment variables before
+        # NumPy is imported (see workerEnvironment).
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            if warn and not cls.library_warning_shown:
+                cls.library_warning_shown = True
+                warnings.warn("threadpoolctl is not installed, so the threads setting does not limit BLAS and OpenMP "
+                              "threads. Install threadpoolctl, or set OMP_NUM_THREADS / OPENBLAS_NUM_THREADS / "
+                              "MKL_NUM_THREADS before NumPy is imported.", RuntimeWarning, stacklevel=4)
+            return nullcontext()
+
+        return threadpool_limits(limits=threads)
+
+    # ----------------------------------------
+    #                WORKERS
+    # ----------------------------------------
+
+    @classmethod
+    def getWorkerThreads(cls, processes: int) -> int:
+        # Threads of each of the worker processes sharing the cores of this process.
+        return max(1, cls.resolveThreads() // max(processes, 1))
+
+    @classmethod
+    def limitProcess(cls, threads: int) -> None:
+        """
+        Method that sets the default thread count of the whole (worker) process, for the pool and BLAS.
+        """
+
+        os.environ[cls.ENVIRONMENT_VARIABLE] = str(threads)
+
+        # Kept until the process ends, so the returned limiter is not needed. The count is derived, not asked for
+        # by the user, so nothing is warned without threadpoolctl (spawned workers got it from workerEnvironment).
+        # A "threads" setting of a config still warns, when the map applies it (see limit).
+        cls.limitLibraries(threads)
+
+    @classmethod
+    @contextmanager
+    def workerEnvironment(cls, threads: int):
+        """
+        Context manager that sets BLAS and OpenMP environment variables (where they are not set by the user) for
+        processes started inside it, so spawned workers load their libraries with the given thread count.
+        """
+
+        previous = {name: os.environ.get(name) for name in cls.LIBRARY_ENVIRONMENT_VARIABLES}
+
+        for name, value in previous.items():
+            if value is None:
+                os.environ[name] = str(threads)
+
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+
+    # ----------------------------------------
+    #                 BLOCKS
+    # ----------------------------------------
+
+    def getBlocks(self, size: int, pixels_per_item: int = 1) -> list:
+        """
+        :param size:
+        Number of items (e.g. rows) to split.
+
+        :param pixels_per_item:
+        Pixels of every item, blocks get at least MIN_BLOCK_PIXELS pixels.
+
+        :return:
+        Returns a list of (start, stop) ranges, one per thread, covering range(size).
+        """
+
+        min_items = -(-self.MIN_BLOCK_PIXELS // max(pixels_per_item, 1))
+        block_count = max(1, min(self.getThreads(), size // max(min_items, 1)))
+        block_size = -(-size // block_count)
+
+        return [(start, min(start + block_size, size)) for start in range(0, size, block_size)]
+
+    def map(self, function, blocks: list) -> list:
+        """
+        Method that calls function on every block, on the managed pool if there is more than one block.
+        Blocks run with single threaded BLAS, since the blocks are the parallelism (see runBlock).
+
+        :return:
+        Returns the results in the order of blocks.
+        """
+
+        if len(blocks) <= 1:
+            return [function(block) for block in blocks]
+
+        # Submitted under the lock, so a pool is never shut down (see getExecutor) while blocks are submitted to it.
+        with self.lock:
+            executor = self.getExecutor(len(blocks))
+            futures = [executor.submit(self.runBlock, function, block) for block in blocks]
+
+        return [future.result() for future in futures]
+
+    def runBlock(self, function, block: tuple):
+        """
+        Method that runs one block on a pool thread with single threaded BLAS.
+        Note: BLAS libraries only have process wide limits, so the limit is set when the first of all running blocks
+        starts and restored when the last one ends. Other threads are only limited while blocks run.
+        """
+
+        with self.block_lock:
+            self.running_blocks += 1
+
+            if self.running_blocks == 1:
+                self.block_limiter = self.limitLibraries(1)
+                self.block_limiter.__enter__()
+
+        try:
+            return function(block)
+        finally:
+            with self.block_lock:
+                self.running_blocks -= 1
+
+                if self.running_blocks == 0:
+                    self.block_limiter.__exit__(None, None, None)
+                    self.block_limiter = None
+
+    def getExecutor(self, threads: int) -> ThreadPoolExecutor:
+        # One pool shared by all calls, grown when a call needs more threads. Forked children (see BatchRenderer)
+        # inherit the pool without its threads, so they start their own. Called with the lock held.
+        if self.executor is None or self.executor_size < threads or self.executor_pid != os.getpid():
+            # Blocks already submitted to the previous pool still run, its idle threads end after them.
+            if self.executor is not None and self.executor_pid == os.getpid():
+                self.executor.shutdown(wait=False)
+
+            self.executor = ThreadPoolExecutor(threads, thread_name_prefix="ibex-block")
+            self.executor_size = threads
+            self.executor_pid = os.getpid()
+
+        return self.executor
+
+    def close(self) -> None:
+        with self.lock:
+            if self.executor is not None and self.executor_pid == os.getpid():
+                self.executor.shutdown(wait=True)
+
+            self.executor = None
+            self.executor_size = 0
@@ -0,0 +1,373 @@
+import copy
+import os
+import statistics
+import time
+import numpy as np
+from .stage_cache import StageCache
+
+
+class ValidationHarness:
+    """
+    Class that checks alternative (faster) engines of pipeline stages against the reference implementation,
+    on the same inputs, and reports their error next to their speedup.
+
+    The reference of every stage is the plain, unoptimized path:
+    - basis:     Calculator.calculateSphericalHarmonicsDataForSetDPI,
+    - synthesis: Calculator.calculateMainMatrixFromData with coefficients in basis order,
+    - rotation:  Configurator.buildFinalRotation, Calculator.rotateGridByRotation and
+                 Calculator.interpolateDataForNewGrid,
+    - pipeline:  synthesis, rotation (if the config rotates) and clipping of negative values (if the config clips).
+
+    Engines register themselves with the register decorator. An engine is a function (mapper, inputs) -> array,
+    where inputs is a dictionary with "data" (coefficient rows), "config", "dpi", "max_l", "basis" (reference basis)
+    and "heatmap" (reference synthesized heatmap). It is compared to the reference output of its stage.
+    """
+
+    STAGES = ("basis", "synthesis", "rotation", "pipeline")
+
+    # Default tolerances of the max error relative to the max absolute value of the reference output.
+    # Engines that are not exact (e.g. reduced precision) register their own.
+    DEFAULT_TOLERANCES = {"basis": 1e-10, "synthesis": 1e-10, "rotation": 1e-10, "pipeline": 1e-10}
+
+    # {stage: {engine name: (function, tolerance)}}, filled by register.
+    engines = {stage: {} for stage in STAGES}
+
+    @classmethod
+    def register(cls, stage: str, name: str, tolerance: float or None = None):
+        """
+        Decorator that registers an engine of a stage.
+
+        :param stage:
+        One of STAGES.
+
+        :param name:
+        Name of the engine, unique within the stage.
+
+        :param tolerance:
+        Allowed max error relative to the max absolute value of the reference. Defaults to DEFAULT_TOLERANCES.
+        """
+
+        if stage not in cls.STAGES:
+            raise ValueError(f"Invalid stage '{stage}'. Must be one of: {list(cls.STAGES)}")
+
+        def decorator(function):
+            cls.engines[stage][name] = (function, cls.DEFAULT_TOLERANCES[stage] if tolerance is None else tolerance)
+            return function
+
+        return decorator
+
+    def __init__(self, mapper, repeats: int = 3, error_maps_dir: str or None = None):
+        """
+        :param mapper:
+        IBEXMapper instance whose engines (and basis cache) are validated.
+
+        :param repeats:
+        Timed runs of every reference stage and engine, the median is reported. Every one is run once untimed
+        before, so lazy imports and cold caches are not counted. The reference basis is timed once, after a
+        tiny warm-up basis.
+
+        :param error_maps_dir:
+        If given, the per-pixel absolute error of every engine is saved there as .npy files.
+        """
+
+        self.mapper = mapper
+        self.repeats = repeats
+        self.error_maps_dir = error_maps_dir
+
+    def validate(self, sources: list, config: dict or None = None, stages: list or None = None,
+                 engines: list or None = None) -> dict:
+        """
+        Method that runs the reference and every registered engine on every source.
+
+        :param sources:
+        List of coefficient sources (paths to data files or (N, 3) / (N, 4) arrays), or (name, source) pairs.
+
+        :param config:
+        Config of the maps (dpi, L, rotation, clipping). Defaults to the default config. Rotation stages are
+        skipped when it does not rotate.
+
+        :param stages:
+        Stages to validate. Defaults to all of them.
+
+        :param engines:
+        Names of engines to validate. Defaults to all registered engines.
+
+        :return:
+        Returns {"passed", "results": [...]}, with one result per source, stage and engine:
+        {"input", "stage", "engine", "max_abs_error", "rms_error", "max_relative_error", "max_error_pixel",
+        "nan_mismatches", "tolerance", "passed", "seconds", "reference_seconds", "speedup"}.
+        """
+
+        config = self.mapper.getDefaultConfig() if config is None else dict(config)
+        stages = list(self.STAGES) if stages is None else stages
+        dpi, max_l = config["map_accuracy"], config["max_l_to_cache"]
+
+        if not config["rotate"]:
+            stages = [stage for stage in stages if stage != "rotation"]
+
+        # The reference basis is shared by all sources, it is the expensive part. It is not run twice, a tiny
+        # basis does the imports instead.
+        self.referenceBasis(8, 1)
+        basis, basis_seconds = self.measure(lambda: self.referenceBasis(dpi, max_l), 1, warm_up=False)
+
+        results = []
+
+        for index, source in enumerate(sources):
+            name, source = source if isinstance(source, tuple) else (self.getSourceName(source, index), source)
+            data = self.mapper.handler.loadCoefficients(source)
+
+            inputs = {"data": data, "config": config, "dpi": dpi, "max_l": max_l, "basis": basis}
+
+            synthesized, synthesis_seconds = self.measure(lambda: self.referenceSynthesis(inputs), self.repeats)
+            inputs["heatmap"] = synthesized
+
+            references = {"basis": (basis, basis_seconds), "synthesis": (synthesized, synthesis_seconds)}
+
+            if config["rotate"]:
+                references["rotation"] = self.measure(lambda: self.referenceRotation(inputs), self.repeats)
+
+            references["pipeline"] = self.measure(lambda: self.referencePipeline(inputs), self.repeats)
+
+            for stage in stages:
+                reference, reference_seconds = references[stage]
+
+                for engine_name, (function, tolerance) in self.engines[stage].items():
+                    if engines is not None and engine_name not in engines:
+                        continue
+
+                    output, seconds = self.measure(lambda: function(self.mapper, inputs), self.repeats)
+
+                    result = {"input": name, "stage": stage, "engine": engine_name,
+                              **self.compare(reference, np.asarray(output)),
+                              "tolerance": tolerance, "seconds": seconds, "reference_seconds": reference_seconds,
+                              "speedup": reference_seconds / seconds if seconds > 0 else float("inf")}
+                    result["passed"] = bool(result["nan_mismatches"] == 0
+                                            and result["max_relative_error"] <= tolerance)
+
+                    if self.error_maps_dir is not None:
+                        self.saveErrorMap(reference, np.asarray(output), f"{name}-{stage}-{engine_name}")
+
+                    results.append(result)
+
+        return {"passed": all(result["passed"] for result in results), "results": results}
+
+    # ----------------------------------------
+    #                REFERENCE
+    # ----------------------------------------
+
+    def referenceBasis(self, dpi: int, max_l: int) -> np.ndarray:
+        return np.asarray(self.mapper.calculator.calculateSphericalHarmonicsDataForSetDPI(dpi, max_l))
+
+    def referenceSynthesis(self, inputs: dict) -> np.ndarray:
+        # Dense coefficients in basis order, missing (l, m) pairs are zero.
+        data = inputs["data"]
+        dense_data = np.zeros((inputs["basis"].shape[0], 3))
+        dense_data[self.mapper.handler.getCoefficientIndices(data), 2] = data[:, 2]
+
+        return self.mapper.calculator.calculateMainMatrixFromData(dense_data, inputs["basis"], inputs["dpi"])
+
+    def referenceRotation(self, inputs: dict, heatmap: np.ndarray or None = None) -> np.ndarray:
+        calculator = self.mapper.calculator
+        config = inputs["config"]
+        heatmap = inputs["heatmap"] if heatmap is None else heatmap
+
+        lon_axis = np.linspace(np.pi, -np.pi, inputs["dpi"])
+        lat_axis = np.linspace(np.pi / 2, -np.pi / 2, inputs["dpi"])
+
+        lon, lat = np.meshgrid(lon_axis, lat_axis)
+        x, y, z = calculator.convertSphericalToCartesian(lon, lat)
+
+        final_rotation = self.mapper.configurator.buildFinalRotation(
+            tuple(float(value) for value in config["central_point"]),
+            tuple(float(value) for value in config["meridian_point"]))
+
+        x_rot, y_rot, z_rot = calculator.rotateGridByRotation(x, y, z, final_rotation.T)
+        lon, lat = calculator.convertCartesianToSpherical(x_rot, y_rot, z_rot)
+
+        return calculator.interpolateDataForNewGrid(heatmap, lat, lon)
+
+    def referencePipeline(self, inputs: dict) -> np.ndarray:
+        heatmap = self.referenceSynthesis(inputs)
+
+        if inputs["config"]["rotate"]:
+            heatmap = self.referenceRotation(inputs, heatmap)
+
+        if not inputs["config"]["show_negative_values"]:
+            heatmap = np.where(heatmap < 0, 0, heatmap)
+
+        return heatmap
+
+    # ----------------------------------------
+    #                 HELPERS
+    # ----------------------------------------
+
+    @staticmethod
+    def measure(function, repeats: int, warm_up: bool = True) -> tuple:
+        # Returns (output of the last run, median seconds). The warm-up run is not timed.
+        if warm_up:
+            function()
+
+        samples = []
+
+        for _ in range(max(repeats, 1)):
+            start = time.perf_counter()
+            output = function()
+            samples.append(time.perf_counter() - start)
+
+        return output, statistics.median(samples)
+
+    @staticmethod
+    def compare(reference: np.ndarray, output: np.ndarray) -> dict:
+        """
+        :return:
+        Returns the errors of output against reference, over pixels that are finite in both. Pixels that are NaN
+        in only one of them are counted as NaN mismatches.
+        """
+
+        if output.shape != reference.shape:
+            raise ValueError(f"Engine output has shape {output.shape}, reference has shape {reference.shape}.")
+
+        reference_nan = np.isnan(reference)
+        output_nan = np.isnan(output)
+        valid = ~(reference_nan | output_nan)
+
+        error = np.where(valid, np.abs(output.astype(np.float64) - reference), 0.0)
+        scale = np.abs(reference[valid]).max() if valid.any() else 0.0
+
+        max_error_pixel = np.unravel_index(np.argmax(error), error.shape)
+        max_abs_error = float(error[max_error_pixel])
+
+        return {
+            "max_abs_error": max_abs_error,
+            "rms_error": float(np.sqrt(np.mean(error[valid] ** 2))) if valid.any() else 0.0,
+            "max_relative_error": max_abs_error / scale if scale > 0 else max_abs_error,
+            "max_error_pixel": [int(index) for index in max_error_pixel],
+            "nan_mismatches": int(np.count_nonzero(reference_nan != output_nan))
+        }
+
+    def saveErrorMap(self, reference: np.ndarray, output: np.ndarray, name: str) -> None:
+        os.makedirs(self.error_maps_dir, exist_ok=True)
+        np.save(os.path.join(self.error_maps_dir, f"{name}.npy"), np.abs(output.astype(np.float64) - reference))
+
+    @staticmethod
+    def getSourceName(source, index: int) -> str:
+        if isinstance(source, (str, os.PathLike)):
+            return os.path.splitext(os.path.basename(str(source)))[0]
+
+        return f"array{index}"
+
+
+# ----------------------------------------
+#        ENGINES OF THE PRODUCTION PATH
+# ----------------------------------------
+
+
+def loadFromDiskCache(mapper, dpi: int, max_l: int, precision: str = "float64") -> np.ndarray:
+    # The basis as maps get it when it is not in memory. The kept basis is dropped first, so every run loads the disk
+    # cache (written by the untimed run) instead of timing a lookup in memory.
+    with mapper.handler.basis_lock:
+        mapper.handler.basis_cache.pop((dpi, max_l, precision), None)
+
+    return mapper.handler.getSphericalHarmonicsBasis(dpi, max_l, precision=precision)
+
+
+@ValidationHarness.register("basis", "cached")
+def basisFromHandler(mapper, inputs: dict) -> np.ndarray:
+    # The basis loaded from the disk cache (calculated if there is none). Catches stale or corrupted caches.
+    return loadFromDiskCache(mapper, inputs["dpi"], inputs["max_l"])
+
+
+@ValidationHarness.register("synthesis", "handler")
+def synthesizeWithHandler(mapper, inputs: dict) -> np.ndarray:
+    # Dense slice or gather of used basis functions, whichever processUserDataset picks for the input.
+    return mapper.handler.processUserDataset(inputs["dpi"], inputs["max_l"], inputs["data"])
+
+
+@ValidationHarness.register("synthesis", "slab")
+def synthesizeAsSlab(mapper, inputs: dict) -> np.ndarray:
+    # One row slab of the coefficient container path.
+    data = inputs["data"]
+    coefficients = np.zeros((1, (inputs["max_l"] + 1) ** 2))
+    coefficients[0, mapper.handler.getCoefficientIndices(data)] = data[:, 2]
+
+    return mapper.handler.processCoefficientSlab(inputs["dpi"], inputs["max_l"], coefficients)[0]
+
+
+@ValidationHarness.register("rotation", "mapper")
+def rotateWithMapper(mapper, inputs: dict) -> np.ndarray:
+    config = inputs["config"]
+    heatmap, _ = mapper.rotateHeatmap(inputs["heatmap"], np.linspace(np.pi, -np.pi, inputs["dpi"]),
+                                      np.linspace(np.pi / 2, -np.pi / 2, inputs["dpi"]),
+                                      tuple(float(value) for value in config["central_point"]),
+                                      tuple(float(value) for value in config["meridian_point"]))
+    return heatmap
+
+
+def withPrivateStageCache(mapper):
+    # The mapper with an empty stage cache of its own, thrown away after one map. Memoized results would make
+    # the timing meaningless, and the stage cache of the mapper (the caller's) is left as it is.
+    private_mapper = copy.copy(mapper)
+    private_mapper.stage_cache = StageCache()
+    return private_mapper
+
+
+@ValidationHarness.register("pipeline", "computeHeatmap")
+def computeWithMapper(mapper, inputs: dict) -> np.ndarray:
+    return withPrivateStageCache(mapper).computeHeatmap(inputs["data"], inputs["config"])["heatmap"]
+
+
+@ValidationHarness.register("basis", "chunked")
+def basisInBands(mapper, inputs: dict) -> np.ndarray:
+    # Latitude bands of the chunked engine, four of them, assembled in memory.
+    return mapper.calculator.calculateSphericalHarmonicsInBands(inputs["dpi"], inputs["max_l"],
+                                                                -(-inputs["dpi"] // 4))
+
+
+@ValidationHarness.register("basis", "parallel")
+def basisOnThreads(mapper, inputs: dict) -> np.ndarray:
+    # Eight bands on four threads, so threads finish bands out of order.
+    return mapper.calculator.calculateSphericalHarmonicsInBands(inputs["dpi"], inputs["max_l"],
+                                                                -(-inputs["dpi"] // 8), 4)
+
+
+@ValidationHarness.register("synthesis", "chunked")
+def synthesizeInBands(mapper, inputs: dict) -> np.ndarray:
+    # Bands of the chunked engine summed over the in-memory reference basis.
+    indices, coefficients = mapper.handler.indexCoefficients(inputs["data"])
+
+    return mapper.calculator.calculateMainMatrixInBands(coefficients, inputs["basis"], indices, inputs["dpi"],
+                                                        -(-inputs["dpi"] // 4))
+
+
+# ----------------------------------------
+#         ENGINES OF FLOAT32 PRECISION
+# ----------------------------------------
+
+# Tolerances follow the error bound of the README ("Precision"): rounding of every basis value, plus rounding
+# of the sum over K basis functions and, when rotating, of the interpolation coordinates.
+
+
+@ValidationHarness.register("basis", "float32", tolerance=1e-6)
+def basisInFloat32(mapper, inputs: dict) -> np.ndarray:
+    return loadFromDiskCache(mapper, inputs["dpi"], inputs["max_l"], "float32")
+
+
+@ValidationHarness.register("synthesis", "float32", tolerance=1e-5)
+def synthesizeInFloat32(mapper, inputs: dict) -> np.ndarray:
+    return mapper.handler.processUserDataset(inputs["dpi"], inputs["max_l"], inputs["data"], precision="float32")
+
+
+@ValidationHarness.register("rotation", "float32", tolerance=1e-4)
+def rotateInFloat32(mapper, inputs: dict) -> np.ndarray:
+    config = inputs["config"]
+    heatmap, _ = mapper.rotateHeatmap(inputs["heatmap"].astype(np.float32), np.linspace(np.pi, -np.pi, inputs["dpi"]),
+                                      np.linspace(np.pi / 2, -np.pi / 2, inputs["dpi"]),
+                                      tuple(float(value) for value in config["central_point"]),
+                                      tuple(float(value) for value in config["meridian_point"]))
+    return heatmap
+
+
+@ValidationHarness.register("pipeline", "float32", tolerance=1e-4)
+def computeInFloat32(mapper, inputs: dict) -> np.ndarray:
+    return withPrivateStageCache(mapper).computeHeatmap(
+        inputs["data"], dict(inputs["config"], precision="float32"))["heatmap"]
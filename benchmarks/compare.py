@@ -0,0 +1,75 @@
+"""
+Compares two results files of pipeline.py (e.g. of two commits), case by case.
+
+Prints the median time and peak memory of every case present in both files with their ratio (new / old), and
+fails if any case got slower or bigger than the tolerance allows. Cases present in only one file are listed.
+
+Usage:
+    python benchmarks/compare.py old.json new.json [--tolerance 1.25] [--memory-tolerance 1.25] [--min-seconds 0.01]
+
+Exits with status 1 when any case regressed.
+"""
+import argparse
+import json
+import sys
+
+
+def loadCases(file_path: str) -> dict:
+    with open(file_path, "r") as f:
+        results = json.load(f)
+
+    # Only measured cases, skipped and failed ones have nothing to compare.
+    return {case["id"]: case for case in results["cases"] if "median_seconds" in case}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old", type=str)
+    parser.add_argument("new", type=str)
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--memory-tolerance", type=float, default=1.25)
+    parser.add_argument("--min-seconds", type=float, default=0.01,
+                        help="Cases faster than this in both files are too noisy to fail on.")
+    args = parser.parse_args()
+
+    old_cases = loadCases(args.old)
+    new_cases = loadCases(args.new)
+
+    failures = []
+
+    print(f"{'case':<60} {'old s':>10} {'new s':>10} {'ratio':>7} {'old MB':>9} {'new MB':>9} {'ratio':>7}")
+
+    for case_id in [case_id for case_id in old_cases if case_id in new_cases]:
+        old, new = old_cases[case_id], new_cases[case_id]
+
+        time_ratio = new["median_seconds"] / old["median_seconds"] if old["median_seconds"] else float("inf")
+        line = f"{case_id:<60} {old['median_seconds']:10.4f} {new['median_seconds']:10.4f} {time_ratio:7.2f}"
+
+        if time_ratio > args.tolerance and max(old["median_seconds"], new["median_seconds"]) >= args.min_seconds:
+            failures.append(f"{case_id}: {time_ratio:.2f}x slower")
+
+        # Import cases have no memory figure.
+        if old.get("peak_rss_bytes") and new.get("peak_rss_bytes"):
+            memory_ratio = new["peak_rss_bytes"] / old["peak_rss_bytes"]
+            line += (f" {old['peak_rss_bytes'] / 1024 ** 2:9.1f} {new['peak_rss_bytes'] / 1024 ** 2:9.1f}"
+                     f" {memory_ratio:7.2f}")
+
+            if memory_ratio > args.memory_tolerance:
+                failures.append(f"{case_id}: {memory_ratio:.2f}x more memory")
+
+        print(line)
+
+    for case_id in sorted(old_cases.keys() - new_cases.keys()):
+        print(f"only in {args.old}: {case_id}")
+
+    for case_id in sorted(new_cases.keys() - old_cases.keys()):
+        print(f"only in {args.new}: {case_id}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Regression benchmark for the import time of the IBEXMapper package.
+
+Every run imports the package in a fresh interpreter (inside an empty temporary directory) and checks that:
+- the median import time stays under the given limit (and, if given, within a tolerance of a saved baseline),
+- no heavy modules (matplotlib, scipy) are imported eagerly,
+- importing creates no files or directories.
+
+Usage:
+    python benchmarks/import_time.py [--repeats 15] [--max-seconds 0.5]
+                                     [--baseline results.json] [--tolerance 1.25] [--output results.json]
+
+Exits with status 1 when any of the checks fails.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ["matplotlib", "matplotlib.pyplot", "scipy.special", "scipy.interpolate", "scipy.spatial.transform"]
+
+# Code run in the fresh interpreter. It prints the import time and the heavy modules that got imported.
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import IBEXMapper
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "heavy": [m for m in %r if m in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+def measureImportOnce(working_dir: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT) + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=working_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=15)
+    parser.add_argument("--max-seconds", type=float, default=0.5)
+    parser.add_argument("--baseline", type=str, default=None)
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    failures = []
+
+    with tempfile.TemporaryDirectory() as working_dir:
+        samples = [measureImportOnce(working_dir) for _ in range(args.repeats)]
+        created_files = os.listdir(working_dir)
+
+    times = [sample["seconds"] for sample in samples]
+    heavy = sorted({module for sample in samples for module in sample["heavy"]})
+    median = statistics.median(times)
+
+    result = {
+        "benchmark": "import_time",
+        "repeats": args.repeats,
+        "median_seconds": median,
+        "min_seconds": min(times),
+        "max_seconds": max(times),
+        "heavy_modules_imported": heavy,
+        "files_created": created_files
+    }
+
+    print(json.dumps(result, indent=4))
+
+    if median > args.max_seconds:
+        failures.append(f"median import time {median:.3f}s exceeds limit {args.max_seconds:.3f}s")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        allowed = baseline["median_seconds"] * args.tolerance
+        if median > allowed:
+            failures.append(f"median import time {median:.3f}s regressed over baseline "
+                            f"{baseline['median_seconds']:.3f}s (allowed {allowed:.3f}s)")
+
+    if heavy:
+        failures.append(f"heavy modules imported eagerly: {heavy}")
+
+    if created_files:
+        failures.append(f"import created files: {created_files}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4)
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+Benchmark suite of the map pipeline: basis generation, synthesis, rotation, rendering and startup.
+
+Coefficients are synthetic (see synthetic.py), so runs are reproducible on any machine. Every case runs in a fresh
+interpreter with its own workspace, so cases do not share memory or caches and the peak resident memory of the
+process can be recorded for each case. Cases:
+- basis:   spherical harmonics basis (calculateSphericalHarmonicsDataForSetDPI), computed ("cold") or loaded from
+           the disk cache ("disk"). Cold builds run on every number of --basis-workers threads (0 = one per core),
+           to measure scaling,
+- compute: computeHeatmap with rotation off and on, with the basis not cached ("cold"), on disk ("disk"),
+           in memory ("memory") or with all stage results memoized ("memo"),
+- render:  renderHeatmap (the Mollweide projection and the PDF) with catalogs of 0, 10, 100... map features,
+- import:  import time of the package (see import_time.py).
+
+By default dpi is swept at a fixed L and L at a fixed dpi (--grid sweeps every pair). Cases whose basis would not
+fit into --max-basis-gb are recorded as skipped. Compare two results files with compare.py.
+
+Usage:
+    python benchmarks/pipeline.py [--dpi 200 400 720 1000 2000] [--max-l 10 20 30 45 60] [--grid]
+                                  [--base-dpi 400] [--base-max-l 20] [--features 0 10 100] [--repeats 3]
+                                  [--cases basis compute render import] [--basis-workers 1 2 4] [--threads 0]
+                                  [--max-basis-gb 2] [--quick]
+                                  [--output results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+ALL_CASES = ["basis", "compute", "render", "import"]
+
+# Rotation used by every rotated case, both rotations are applied.
+CENTRAL_POINT = (120.0, -30.0)
+MERIDIAN_POINT = (-160.0, 40.0)
+
+
+def getBasisBytes(dpi: int, max_l: int) -> int:
+    # (L + 1)^2 float64 maps of dpi x dpi.
+    return (max_l + 1) ** 2 * dpi * dpi * 8
+
+
+def getCaseId(case: dict) -> str:
+    # e.g. "compute cache=memory dpi=400 max_l=20 rotate=True", used to match cases between results files.
+    return " ".join([case["kind"]] + [f"{key}={case[key]}" for key in sorted(case) if key != "kind"])
+
+
+def buildCases(args) -> list:
+    """
+    :return:
+    Returns the list of case specifications, in the order they are run.
+    """
+
+    if args.grid:
+        points = [(dpi, max_l) for dpi in args.dpi for max_l in args.max_l]
+    else:
+        points = [(dpi, args.base_max_l) for dpi in args.dpi] + [(args.base_dpi, max_l) for max_l in args.max_l]
+
+    # Unique points, in the order they were given.
+    points = list(dict.fromkeys(points))
+
+    cases = []
+
+    if "import" in args.cases:
+        cases.append({"kind": "import"})
+
+    for dpi, max_l in points:
+        if "basis" in args.cases:
+            cases += [{"kind": "basis", "dpi": dpi, "max_l": max_l, "cache": "cold", "workers": workers}
+                      for workers in args.basis_workers]
+            cases.append({"kind": "basis", "dpi": dpi, "max_l": max_l, "cache": "disk"})
+
+        if "compute" in args.cases:
+            cases += [{"kind": "compute", "dpi": dpi, "max_l": max_l, "rotate": rotate, "cache": "memory"}
+                      for rotate in (False, True)]
+
+    # Cache states and feature catalogs are measured at the base point only.
+    if "compute" in args.cases:
+        cases += [{"kind": "compute", "dpi": args.base_dpi, "max_l": args.base_max_l, "rotate": True, "cache": cache}
+                  for cache in ("cold", "disk", "memo")]
+
+    if "render" in args.cases:
+        cases += [{"kind": "render", "dpi": args.base_dpi, "max_l": args.base_max_l, "features": features}
+                  for features in args.features]
+
+    return cases
+
+
+def runCase(case: dict, repeats: int, cache_dir: str, threads: int = 0) -> dict:
+    # Every case gets a fresh interpreter and an empty workspace.
+    env = dict(os.environ, MPLBACKEND="Agg",
+               PYTHONPATH=str(REPO_ROOT) + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+    with tempfile.TemporaryDirectory() as working_dir:
+        process = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--run-case", json.dumps(case),
+                                  "--repeats", str(repeats), "--cache-dir", cache_dir, "--threads", str(threads)],
+                                 cwd=working_dir, env=env, capture_output=True, text=True)
+
+    if process.returncode != 0:
+        return {"error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed"}
+
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+# ----------------------------------------
+#       CASES (run in the child process)
+# ----------------------------------------
+
+
+def measureCase(case: dict, repeats: int, cache_dir: str, threads: int = 0) -> dict:
+    if case["kind"] == "import":
+        # Sibling script, importable since this script's folder is on the path.
+        from import_time import measureImportOnce
+
+        with tempfile.TemporaryDirectory() as working_dir:
+            samples = [measureImportOnce(working_dir)["seconds"] for _ in range(repeats)]
+
+        return {"samples": samples}
+
+    import IBEXMapper
+    from synthetic import writeCoefficients
+
+    mapper = IBEXMapper.createMapper(".", cache_dir)
+
+    config = mapper.getDefaultConfig()
+    config.update(map_accuracy=case["dpi"], max_l_to_cache=case["max_l"], rotate=case.get("rotate", False),
+                  central_point=CENTRAL_POINT, meridian_point=MERIDIAN_POINT, show_negative_values=True,
+                  basis_workers=case.get("workers", 1), threads=threads)
+
+    data_path = writeCoefficients("coefficients.txt", case["max_l"])
+    basis_path = mapper.handler.getSphericalHarmonicsCachePath(case["dpi"], case["max_l"])
+
+    # Filling the disk cache runs in its own process (see main), so the peak memory of basis calculation is only
+    # recorded by "cold" cases.
+    if case["kind"] == "fill":
+        mapper.handler.getSphericalHarmonicsBasis(case["dpi"], case["max_l"])
+        return {"samples": []}
+
+    def prepare():
+        if case.get("cache") == "cold" and basis_path.exists():
+            basis_path.unlink()
+        if case.get("cache") in ("cold", "disk"):
+            mapper.handler.releaseBasis()
+        if case.get("cache") != "memo":
+            mapper.clearStageCache()
+
+    if case["kind"] == "basis":
+        def run():
+            mapper.handler.getSphericalHarmonicsBasis(case["dpi"], case["max_l"], "full", None,
+                                                      mapper.planner.getBasisWorkers(config))
+    elif case["kind"] == "compute":
+        def run():
+            mapper.computeHeatmap(data_path, config)
+    else:
+        addFeatures(mapper, case["features"])
+        heatmap = mapper.computeHeatmap(data_path, config)
+
+        def run():
+            mapper.renderHeatmap(heatmap, "output", show=False)
+
+    # One untimed call, so lazy imports (SciPy, Matplotlib) and first-touch page faults are not timed.
+    prepare()
+    run()
+
+    # Metrics of preparation are dropped, so stage times cover the timed calls only.
+    mapper.metrics.reset()
+
+    samples = []
+    for _ in range(repeats):
+        prepare()
+        start = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - start)
+
+    metrics = mapper.getMetrics()["metrics"]
+
+    # Mean seconds per timed call spent in every stage (spans nest, so they do not add up).
+    stages = {sample["labels"]["stage"]: sample["sum"] / repeats
+              for sample in metrics["ibex_mapper_stage_seconds"]["samples"]}
+
+    peak_rss = metrics["ibex_mapper_peak_rss_bytes"]["samples"]
+
+    return {"samples": samples, "stages": stages, "peak_rss_bytes": peak_rss[0]["value"] if peak_rss else None}
+
+
+def addFeatures(mapper, count: int) -> None:
+    # Points, circles and texts in equal parts, spread over the sphere by the golden angle.
+    for i in range(count):
+        lon = (i * 137.508) % 360.0 - 180.0
+        lat = float(-80.0 + 160.0 * (i + 0.5) / count)
+        name = f"feature{i}"
+
+        if i % 3 == 0:
+            mapper.map_features.addPoint(name, (lon, lat), "r", True, "o", False)
+        elif i % 3 == 1:
+            mapper.map_features.addCircle(name, (lon, lat), 10.0, "g", "-")
+        else:
+            mapper.map_features.addMapText(name, (lon, lat), "k", 8, 0.0)
+
+
+# ----------------------------------------
+#                  MAIN
+# ----------------------------------------
+
+
+def getEnvironment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    import numpy as np
+
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "machine": platform.machine(), "cpu_count": os.cpu_count(),
+            "timestamp": time.time()}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dpi", type=int, nargs="+", default=[200, 400, 720, 1000, 2000])
+    parser.add_argument("--max-l", type=int, nargs="+", default=[10, 20, 30, 45, 60])
+    parser.add_argument("--grid", action="store_true")
+    parser.add_argument("--base-dpi", type=int, default=400)
+    parser.add_argument("--base-max-l", type=int, default=20)
+    parser.add_argument("--features", type=int, nargs="+", default=[0, 10, 100])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--cases", type=str, nargs="+", default=ALL_CASES, choices=ALL_CASES)
+    parser.add_argument("--basis-workers", type=int, nargs="+", default=[1])
+    parser.add_argument("--threads", type=int, default=0, help="threads config of every case (0 = all cores).")
+    parser.add_argument("--max-basis-gb", type=float, default=2.0)
+    parser.add_argument("--quick", action="store_true", help="Small sweep for smoke runs.")
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument("--run-case", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: run one case and print its result as the last line.
+    if args.run_case is not None:
+        print(json.dumps(measureCase(json.loads(args.run_case), args.repeats, args.cache_dir, args.threads)))
+        return 0
+
+    if args.quick:
+        args.dpi, args.max_l, args.base_dpi, args.base_max_l = [100, 200], [5, 10], 100, 5
+        args.features, args.repeats = [0, 10], min(args.repeats, 2)
+
+    results = {"suite": "pipeline", "environment": getEnvironment(), "arguments": vars(args), "cases": []}
+    failed = False
+
+    with tempfile.TemporaryDirectory() as cache_root:
+        filled_cache_dirs = set()
+
+        for case in buildCases(args):
+            result = {"id": getCaseId(case), "case": case}
+
+            if "dpi" in case and getBasisBytes(case["dpi"], case["max_l"]) > args.max_basis_gb * 1024 ** 3:
+                result["skipped"] = f"basis needs {getBasisBytes(case['dpi'], case['max_l']) / 1024 ** 3:.1f} GB"
+            else:
+                # Cold cases delete the basis, so they get their own cache folder. Other cases share a filled one.
+                cache_dir = os.path.join(cache_root, f"DPI{case.get('dpi')}L{case.get('max_l')}")
+
+                if case.get("cache") == "cold":
+                    cache_dir += "cold"
+                elif "dpi" in case and cache_dir not in filled_cache_dirs:
+                    runCase({"kind": "fill", "dpi": case["dpi"], "max_l": case["max_l"]}, 1, cache_dir)
+                    filled_cache_dirs.add(cache_dir)
+
+                measured = runCase(case, args.repeats, cache_dir, args.threads)
+
+                if "error" in measured:
+                    result["error"] = measured["error"]
+                    failed = True
+                else:
+                    samples = measured["samples"]
+                    result.update(median_seconds=statistics.median(samples), min_seconds=min(samples),
+                                  max_seconds=max(samples), samples=samples,
+                                  peak_rss_bytes=measured.get("peak_rss_bytes"), stages=measured.get("stages", {}))
+
+            results["cases"].append(result)
+
+            if "median_seconds" in result:
+                rss = result["peak_rss_bytes"]
+                summary = f"{result['median_seconds']:10.4f} s" + (f" {rss / 1024 ** 2:10.1f} MB" if rss else "")
+            elif "skipped" in result:
+                summary = f"SKIPPED: {result['skipped']}"
+            else:
+                summary = f"FAILED: {result['error']}"
+
+            print(f"{result['id']:<60} {summary}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Synthetic spherical harmonics coefficients for benchmarks.
+
+Coefficients are drawn from a seeded generator with a power spectrum falling as (l + 1)^-slope, plus a positive
+monopole, so maps look like smooth ENA flux maps and runs with the same arguments produce identical files.
+
+Usage:
+    python benchmarks/synthetic.py --max-l 30 --output coefficients.txt [--seed 0] [--slope 2.0]
+"""
+import argparse
+import sys
+import numpy as np
+
+
+def generateCoefficients(max_l: int, seed: int = 0, slope: float = 2.0) -> np.ndarray:
+    """
+    :param max_l:
+    Max l of the coefficients.
+
+    :param seed:
+    Seed of the random generator.
+
+    :param slope:
+    Spectral slope, the standard deviation of coefficients of degree l is (l + 1)^-slope.
+
+    :return:
+    Returns (K, 4) array of (l, m, coefficient, uncertainty) rows in basis order, K = (max_l + 1)^2.
+    """
+
+    generator = np.random.default_rng(seed)
+
+    l_values = np.repeat(np.arange(max_l + 1), 2 * np.arange(max_l + 1) + 1)
+    m_values = np.concatenate([np.arange(-l, l + 1) for l in range(max_l + 1)])
+
+    scale = (l_values + 1.0) ** -slope
+    coefficients = generator.normal(0.0, 1.0, l_values.size) * scale
+
+    # Positive monopole, so the flux stays mostly positive.
+    coefficients[0] = 4.0
+
+    uncertainties = np.abs(coefficients) * 0.1 + 1e-3
+
+    return np.column_stack((l_values, m_values, coefficients, uncertainties))
+
+
+def writeCoefficients(file_path: str, max_l: int, seed: int = 0, slope: float = 2.0) -> str:
+    # Same text format as the data files of the app.
+    np.savetxt(file_path, generateCoefficients(max_l, seed, slope), fmt=["%d", "%d", "%.12e", "%.12e"])
+    return file_path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-l", type=int, required=True)
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slope", type=float, default=2.0)
+    args = parser.parse_args()
+
+    writeCoefficients(args.output, args.max_l, args.seed, args.slope)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Accuracy versus speed validation of pipeline engines (see IBEXMapper.validation.ValidationHarness).
+
+Runs the reference path and every registered engine of every stage on the same inputs and reports the max and RMS
+per-pixel error of each engine next to its speedup over the reference. Inputs are:
+- "synthetic": a complete, smooth coefficient set (see synthetic.py),
+- "real_style": rows in random order with missing (l, m) pairs, a few strong high-l modes and a negative region,
+  as real fitted maps have,
+- any data files given with --data.
+
+Usage:
+    python benchmarks/validate.py [--dpi 200] [--max-l 20] [--no-rotate] [--central 120 -30] [--meridian -160 40]
+                                  [--clip] [--data file.txt ...] [--stages basis synthesis rotation pipeline]
+                                  [--engines name ...] [--repeats 3] [--cache-dir DIR] [--error-maps DIR]
+                                  [--output validation.json]
+
+Exits with status 1 when any engine exceeds its tolerance.
+"""
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import numpy as np  # noqa: E402
+from synthetic import generateCoefficients  # noqa: E402
+
+
+def generateRealStyleCoefficients(max_l: int, seed: int = 1) -> np.ndarray:
+    generator = np.random.default_rng(seed)
+    data = generateCoefficients(max_l, seed)
+
+    # A few strong high-l modes make sharp features.
+    high_l = np.flatnonzero(data[:, 0] >= max_l * 3 // 4)
+    data[generator.choice(high_l, size=min(5, high_l.size), replace=False), 2] *= 50.0
+
+    # A dipole large enough to push part of the sky negative.
+    data[2, 2] = -6.0
+
+    # Missing pairs and unordered rows.
+    keep = generator.random(len(data)) > 0.3
+    keep[0] = True
+
+    return generator.permutation(data[keep])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--max-l", type=int, default=20)
+    parser.add_argument("--no-rotate", action="store_true")
+    parser.add_argument("--central", type=float, nargs=2, default=[120.0, -30.0])
+    parser.add_argument("--meridian", type=float, nargs=2, default=[-160.0, 40.0])
+    parser.add_argument("--clip", action="store_true", help="Filter out negative values.")
+    parser.add_argument("--data", type=str, nargs="+", default=[])
+    parser.add_argument("--stages", type=str, nargs="+", default=None)
+    parser.add_argument("--engines", type=str, nargs="+", default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--cache-dir", type=str, default=None,
+                        help="Basis cache to validate. Defaults to an empty temporary folder.")
+    parser.add_argument("--error-maps", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    import IBEXMapper
+
+    with tempfile.TemporaryDirectory() as workspace:
+        mapper = IBEXMapper.createMapper(workspace, args.cache_dir or str(Path(workspace) / "cache"))
+
+        config = mapper.getDefaultConfig()
+        config.update(map_accuracy=args.dpi, max_l_to_cache=args.max_l, rotate=not args.no_rotate,
+                      central_point=tuple(args.central), meridian_point=tuple(args.meridian),
+                      show_negative_values=not args.clip)
+
+        sources = [("synthetic", generateCoefficients(args.max_l)),
+                   ("real_style", generateRealStyleCoefficients(args.max_l))] + args.data
+
+        report = mapper.validateEngines(sources, config, args.stages, args.engines, args.repeats, args.error_maps)
+
+    print(f"{'input':<14} {'stage':<10} {'engine':<16} {'max abs':>10} {'rms':>10} {'max rel':>10} "
+          f"{'tolerance':>10} {'speedup':>8}  status")
+
+    for result in report["results"]:
+        status = "ok" if result["passed"] else "FAIL"
+        if result["nan_mismatches"]:
+            status += f" ({result['nan_mismatches']} NaN mismatches)"
+
+        print(f"{result['input']:<14} {result['stage']:<10} {result['engine']:<16} {result['max_abs_error']:10.2e} "
+              f"{result['rms_error']:10.2e} {result['max_relative_error']:10.2e} {result['tolerance']:10.1e} "
+              f"{result['speedup']:7.2f}x  {status}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(dict(report, config={key: list(value) if isinstance(value, tuple) else value
+                                           for key, value in config.items()}), f, indent=4)
+
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,6 @@
 from __future__ import annotations
 import ast
 import itertools
-import json
 import sys
 import threading
 import time
@@ -27,8 +26,8 @@ console = Console()
 app = typer.Typer(add_completion=False, help="IBEXMapper CLI")
 
 mapper = ibex.getObjectInstance()
-CONFIG_FILE = Path(mapper.CONFIG_FILE)
-FEATURES_FILE = Path(mapper.FEATURES_FILE)
+CONFIG_FILE = Path(mapper.storage.config_file)
+FEATURES_FILE = Path(mapper.storage.features_file)
 SESSION_CFG: dict | None = None
 
 def _spinner(msg: str, done: threading.Event, interval: float = 0.1) -> None:
@@ -81,6 +80,101 @@ def cmd_generate(
     console.print("[bold green]Map generated.[/bold green]")
 
 
+@app.command("uncertainty", help="Generate the flux and/or uncertainty map (4th column) of a data file in one pass.")
+def cmd_uncertainty(
+    link: Path = typer.Argument(..., exists=True, readable=True),
+    output: Optional[Path] = typer.Option(None, "--output", "-o"),
+    product: str = typer.Option("both", "--product", help="flux, uncertainty or both."),
+    samples: int = typer.Option(0, "--samples", help="Monte Carlo maps (0 = analytic uncertainty only)."),
+    seed: int = typer.Option(0, "--seed"),
+    use_saved_config: bool = typer.Option(True, "--config/--no-config"),
+):
+    cfg: Optional[Dict[str, Any]] = _current_cfg() if use_saved_config else None
+    paths = ibex.generateUncertaintyMap(str(link), str(output) if output else None, cfg, product, samples, seed)
+    for path in paths:
+        console.print(f"[bold green]Saved:[/bold green] {path}")
+
+
+@app.command("batch", help="Generate maps for every data file in a directory using a process pool.")
+def cmd_batch(
+    directory: Path = typer.Argument(..., exists=True, file_okay=False, readable=True),
+    output: Optional[Path] = typer.Option(None, "--output", "-o"),
+    jobs: int = typer.Option(0, "--jobs", "-j", help="Worker processes (0 = all cores)."),
+    pattern: str = typer.Option("*.txt", "--pattern"),
+    use_saved_config: bool = typer.Option(True, "--config/--no-config"),
+):
+    cfg: Optional[Dict[str, Any]] = _current_cfg() if use_saved_config else None
+    results = ibex.generateMapsFromDirectory(str(directory), str(output) if output else None, cfg, jobs, pattern)
+    tbl = Table(title="Batch results")
+    tbl.add_column("File", style="bold")
+    tbl.add_column("Status")
+    tbl.add_column("Seconds")
+    tbl.add_column("Output / error")
+    for r in results:
+        status = "[green]OK[/green]" if r["success"] else "[red]FAILED[/red]"
+        tbl.add_row(Path(r["file"]).name, status, f"{r['seconds']:.2f}", r["output"] if r["success"] else r["error"])
+    console.print(tbl)
+    if not all(r["success"] for r in results):
+        raise typer.Exit(code=1)
+
+
+@app.command("serve", help="Serve maps over local HTTP (or a Unix socket) with the basis kept warm.")
+def cmd_serve(
+    host: str = typer.Option("127.0.0.1", "--host"),
+    port: int = typer.Option(8765, "--port", "-p"),
+    unix_socket: Optional[Path] = typer.Option(None, "--socket", help="Listen on a Unix socket instead of TCP."),
+    warm: bool = typer.Option(True, "--warm/--no-warm", help="Load basis and colormap before the first request."),
+    verbose: bool = typer.Option(False, "--verbose", "-v"),
+    metrics_file: Optional[Path] = typer.Option(None, "--metrics-file",
+                                                help="Write metrics to this file (.json or Prometheus text)."),
+    metrics_interval: float = typer.Option(15.0, "--metrics-interval", help="Seconds between metrics writes."),
+):
+    server = ibex.createMapServer(host, port, str(unix_socket) if unix_socket else None, verbose)
+    if warm:
+        console.print("Warming up...")
+        server.warmUp(_current_cfg())
+    if metrics_file:
+        ibex.startMetricsExport(str(metrics_file), metrics_interval)
+    console.print(f"[bold green]Serving on {server.address}[/bold green] (Ctrl+C to stop)")
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        console.print("Server stopped.")
+    finally:
+        if metrics_file:
+            ibex.stopMetricsExport()
+
+
+@app.command("estimate", help="Predict memory, cache size and runtime of a map for each basis engine.")
+def cmd_estimate(
+    dpi: Optional[int] = typer.Option(None, "--dpi", help="Map accuracy (default: from config)."),
+    max_l: Optional[int] = typer.Option(None, "--max-l", help="Max l (default: from config)."),
+    rotate: Optional[bool] = typer.Option(None, "--rotate/--no-rotate"),
+    budget_mb: Optional[int] = typer.Option(None, "--budget-mb", help="Memory budget (0 = 80% of RAM)."),
+    engine: Optional[str] = typer.Option(None, "--engine", help="auto, full or chunked."),
+    workers: Optional[int] = typer.Option(None, "--workers", help="Basis threads (0 = one per core)."),
+    precision: Optional[str] = typer.Option(None, "--precision", help="float64 or float32."),
+    render: bool = typer.Option(True, "--render/--no-render", help="Include rendering in the peak memory."),
+):
+    overrides = {"map_accuracy": dpi, "max_l_to_cache": max_l, "rotate": rotate, "memory_budget_mb": budget_mb,
+                 "basis_engine": engine, "basis_workers": workers, "precision": precision}
+    est = ibex.estimateCost({k: v for k, v in overrides.items() if v is not None}, render)
+    gb = lambda b: "unknown" if b is None else f"{b / 1024 ** 3:.2f} GB"
+    tbl = Table(title=f"Estimate for dpi {est['dpi']}, L {est['max_l']}, rotate {est['rotate']}, {est['precision']}")
+    for col in ("Engine", "Peak memory", "Band", "Cold (s)", "Warm (s)", "Fits"):
+        tbl.add_column(col)
+    for name, e in est["engines"].items():
+        fits = "[green]yes[/green]" if e["fits"] else "[red]no[/red]"
+        tbl.add_row(name + (" (selected)" if name == est["selected_engine"] else ""), gb(e["peak_memory_bytes"]),
+                    str(e["band_size"] or "-"), f"{e['cold_seconds']:.1f}", f"{e['warm_seconds']:.1f}", fits)
+    console.print(tbl)
+    console.print(f"Cache on disk: {gb(est['cache_bytes'])} (free: {gb(est['disk_free_bytes'])}), "
+                  f"memory budget: {gb(est['memory_budget_bytes'])}, basis workers: {est['basis_workers']}")
+    if est["selected_engine"] is None:
+        console.print(f"[red]{est['refusal']}[/red]")
+        raise typer.Exit(code=1)
+
+
 @app.command("add-point")
 def cmd_add_point(
     name: str = typer.Argument(...),
@@ -100,10 +194,7 @@ def cmd_remove_point(name: str):
 
 @app.command("list-points")
 def cmd_list_points():
-    if not FEATURES_FILE.exists():
-        console.print("[italic]No points stored.[/italic]")
-        return
-    pts = json.loads(FEATURES_FILE.read_text()).get("points", [])
+    pts = ibex.getPointsList()
     if not pts:
         console.print("[italic]No points stored.[/italic]")
         return
@@ -113,7 +204,7 @@ def cmd_list_points():
     tbl.add_column("Lat")
     tbl.add_column("Color")
     for p in pts:
-        lon, lat = ast.literal_eval(p["coordinates"])
+        lon, lat = p["coordinates"]
         tbl.add_row(p["name"], str(lon), str(lat), p.get("color", "black"))
     console.print(tbl)
 
@@ -178,7 +269,8 @@ _MENU = """
 18 Set configuration fields  
 19 Reset configuration
 20 Set selected configuration as default  
-21 Exit  
+21 Generate map progressively (preview first)
+22 Exit  
 """
 
 def _prompt_point() -> Tuple[str, float, float, str]:
@@ -250,7 +342,7 @@ def _menu_loop() -> None:
                 tbl.add_column("Lat")
                 tbl.add_column("Color")
                 for c in circles:
-                    lon, lat = ast.literal_eval(c["coordinates"])
+                    lon, lat = c["coordinates"]
                     tbl.add_row(c["name"], str(lon), str(lat), c.get("color", "black"))
                 console.print(tbl)
             elif choice == 9: # remove all circles
@@ -284,7 +376,7 @@ def _menu_loop() -> None:
                 tbl.add_column("Color")
                 tbl.add_column("Content")
                 for t in texts:
-                    lon, lat = ast.literal_eval(t["coordinates"])
+                    lon, lat = t["coordinates"]
                     tbl.add_row(t["name"], str(lon), str(lat), t.get("color", "black"), t["content"])
                 console.print(tbl)
             elif choice == 13: # remove all texts
@@ -340,7 +432,25 @@ def _menu_loop() -> None:
                 console.print("[yellow]Configuration reset.[/yellow]")
             elif choice == 20: # set selected configuration as default
                 ibex.setDefaultConfig() # upd
-            elif choice == 21: # exit
+            elif choice == 21: # generate map progressively
+                p = typer.prompt("Path to data file", prompt_suffix=" -> ")
+                use_saved = typer.confirm("Use saved configuration?", default=True)
+                cfg = SESSION_CFG if use_saved and SESSION_CFG is not None else ibex.getDefaultConfig()
+                handle = ibex.computeHeatmapProgressive(p, cfg, render=True)
+                console.print(f"[green]Preview saved:[/green] {handle.preview_output}")
+
+                def _refined(h) -> None:
+                    if h.cancelled():
+                        return
+                    try:
+                        console.print(f"\n[bold green]Refined map saved:[/bold green] {h.output()}")
+                    except Exception as exc:
+                        console.print(f"\n[red]Refining failed:[/red] {exc}")
+
+                # The refined map is computed in the background, the menu stays usable meanwhile.
+                handle.addDoneCallback(_refined)
+                console.print("Refining in the background...")
+            elif choice == 22: # exit
                 console.print("[cyan]Goodbye[/cyan]")
                 break
             else:
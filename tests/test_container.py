@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from IBEXMapper import createMapper
+from IBEXMapper.container import CoefficientContainer
+
+
+@pytest.fixture
+def mapper(tmp_path):
+    return createMapper(str(tmp_path / "workspace"), str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def config(mapper):
+    return dict(mapper.getDefaultConfig(), map_accuracy=24, max_l_to_cache=3, rotate=True,
+                central_point=(30.0, 10.0), show_negative_values=True)
+
+
+def writeContainer(file_path, bands=2, intervals=3, max_l=3, seed=0):
+    generator = np.random.default_rng(seed)
+    coefficients = generator.normal(size=(bands, intervals, (max_l + 1) ** 2))
+    uncertainties = np.abs(generator.normal(size=coefficients.shape))
+    CoefficientContainer.write(str(file_path), coefficients, uncertainties, {"bands": ["low", "high"]})
+    return coefficients, uncertainties
+
+
+def test_write_and_read_round_trip(tmp_path):
+    coefficients, uncertainties = writeContainer(tmp_path / "data.ibxc")
+
+    container = CoefficientContainer(str(tmp_path / "data.ibxc"))
+
+    assert (container.max_l, container.bands, container.intervals) == (3, 2, 3)
+    assert container.metadata == {"bands": ["low", "high"]}
+    assert container.header["coefficients_offset"] % CoefficientContainer.ALIGNMENT == 0
+    np.testing.assert_array_equal(container.coefficients, coefficients)
+    np.testing.assert_array_equal(container.uncertainties, uncertainties)
+    np.testing.assert_array_equal(container.getCoefficientSlab([(1, 2), (0, 1)]),
+                                  coefficients[[1, 0], [2, 1]])
+
+
+def test_slice_has_text_file_layout(tmp_path):
+    coefficients, uncertainties = writeContainer(tmp_path / "data.ibxc")
+
+    rows = CoefficientContainer(str(tmp_path / "data.ibxc")).getSlice(1, 2)
+
+    assert rows.shape == (16, 4)
+    np.testing.assert_array_equal(rows[:4, :2], [[0, 0], [1, -1], [1, 0], [1, 1]])
+    np.testing.assert_array_equal(rows[:, 2], coefficients[1, 2])
+    np.testing.assert_array_equal(rows[:, 3], uncertainties[1, 2])
+
+
+def test_rejects_other_files(tmp_path):
+    (tmp_path / "data.txt").write_text("0 0 1.0\n")
+
+    with pytest.raises(ValueError):
+        CoefficientContainer(str(tmp_path / "data.txt"))
+
+    with pytest.raises(ValueError):
+        CoefficientContainer.write(str(tmp_path / "bad.ibxc"), np.zeros((1, 1, 5)))
+
+
+def test_slices_match_compute_heatmap(tmp_path, mapper, config):
+    writeContainer(tmp_path / "data.ibxc")
+    container = CoefficientContainer(str(tmp_path / "data.ibxc"))
+
+    results = mapper.computeHeatmapsFromContainer(str(tmp_path / "data.ibxc"), [1, 0], [2], config)
+
+    assert [(result["band"], result["interval"]) for result in results] == [(1, 2), (0, 2)]
+
+    for result in results:
+        expected = mapper.computeHeatmap(container.getSlice(result["band"], result["interval"]), config)
+        np.testing.assert_allclose(result["heatmap"], expected["heatmap"], rtol=1e-10, atol=1e-12, equal_nan=True)
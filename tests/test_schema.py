@@ -0,0 +1,118 @@
+import json
+import os
+import pytest
+from IBEXMapper.schema import CONFIG_SCHEMA, MAP_FEATURES_SCHEMA
+from IBEXMapper.storage import Storage
+
+CONFIG = {
+    "map_accuracy": 400,
+    "max_l_to_cache": 12,
+    "rotate": True,
+    "central_point": (255.7, 5.1),
+    "meridian_point": (0.0, 0.0),
+    "show_negative_values": False,
+    "map_features_type_checking": True,
+    "map_features_encoding": "json",
+    "instrumentation": False,
+    "basis_engine": "auto",
+    "memory_budget_mb": 0,
+    "basis_workers": 2,
+    "threads": 0,
+    "precision": "float32",
+    "filter_beam_fwhm": 0.0,
+    "filter_l_min": 0,
+    "filter_l_max": 0,
+    "filter_l_weights": [1.0, 0.5]
+}
+
+MAP_FEATURES = {
+    "points": [{"coordinates": (10.0, -20.0), "show_text": True, "hollow": False}],
+    "circles": [{"coordinates": (0.0, 0.0), "alpha": 0.5}],
+    "texts": [{"coordinates": (45.0, 15.0), "font_size": 12, "tilt_angle": 30.0, "text": "Voyager 1"}],
+    "heatmap_scale": (0.0, 120.0),
+    "heatmap_color": "batlow"
+}
+
+
+def stringify(value):
+    # Values as the app wrote them before versioning: every tuple, bool and number as a string.
+    if isinstance(value, dict):
+        return {key: stringify(item) for key, item in value.items()}
+
+    if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+        return [stringify(item) for item in value]
+
+    return value if isinstance(value, str) else str(value)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(str(tmp_path))
+    storage.createWorkspaceDirectories()
+    return storage
+
+
+def test_encode_decode_round_trip():
+    document = CONFIG_SCHEMA.encodeDocument(CONFIG)
+
+    assert document[CONFIG_SCHEMA.VERSION_KEY] == CONFIG_SCHEMA.version
+    assert document["rotate"] is True and document["central_point"] == [255.7, 5.1]
+    assert CONFIG_SCHEMA.decodeValues(json.loads(json.dumps(document))) == CONFIG
+
+    features = MAP_FEATURES_SCHEMA.encodeDocument(MAP_FEATURES)
+    assert MAP_FEATURES_SCHEMA.decodeValues(json.loads(json.dumps(features))) == MAP_FEATURES
+
+
+def test_bools_are_strict():
+    assert CONFIG_SCHEMA.encodeValues({"rotate": "False"}) == {"rotate": False}
+    assert CONFIG_SCHEMA.decodeValues({"rotate": "TRUE"}) == {"rotate": True}
+
+    with pytest.raises(ValueError):
+        CONFIG_SCHEMA.decodeValues({"rotate": "yes"})
+
+
+def test_legacy_config_is_migrated(storage):
+    with open(storage.config_file, "w") as f:
+        json.dump(stringify(CONFIG), f)
+
+    assert storage.loadConfig() == CONFIG
+
+    with open(storage.config_file) as f:
+        document = json.load(f)
+
+    assert document[CONFIG_SCHEMA.VERSION_KEY] == 2
+    assert document["map_accuracy"] == 400 and document["rotate"] is True
+    assert document["central_point"] == [255.7, 5.1]
+
+
+def test_legacy_map_features_are_migrated(storage):
+    storage.saveConfig(CONFIG)
+
+    with open(storage.features_file, "w") as f:
+        json.dump(stringify(MAP_FEATURES), f)
+
+    assert storage.loadMapFeatures() == MAP_FEATURES
+
+    with open(storage.features_file) as f:
+        assert json.load(f)[MAP_FEATURES_SCHEMA.VERSION_KEY] == 2
+
+
+def test_binary_map_features_round_trip(storage):
+    storage.saveConfig(dict(CONFIG, map_features_encoding="binary"))
+    storage.saveMapFeatures(MAP_FEATURES)
+
+    with open(storage.features_binary_file, "rb") as f:
+        assert f.read(5) == Storage.BINARY_MAGIC + bytes([Storage.BINARY_VERSION])
+
+    assert not os.path.exists(storage.features_file)
+    assert storage.loadMapFeatures() == MAP_FEATURES
+
+
+def test_map_features_migrate_between_encodings(storage):
+    storage.saveConfig(CONFIG)
+    storage.saveMapFeatures(MAP_FEATURES)
+
+    storage.saveConfig(dict(CONFIG, map_features_encoding="binary"))
+
+    assert storage.loadMapFeatures() == MAP_FEATURES
+    assert os.path.exists(storage.features_binary_file) and not os.path.exists(storage.features_file)